@@ -1,8 +1,15 @@
 import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import hashlib
+import json
+import os
 from pathlib import Path
 import re
 import shutil
 import sys
+import time
 import tiktoken
 from pathspec import PathSpec
 from pathspec.patterns.gitwildmatch import GitWildMatchPattern
@@ -18,21 +25,247 @@ DEFAULT_EXTS = [
 # ----------- Utilities -----------
 def load_gitignore(root_path: Path):
     gitignore_path = root_path / ".gitignore"
-    if not gitignore_path.exists():
+    if not gitignore_path.is_file():
         return None
     patterns = gitignore_path.read_text(encoding="utf-8").splitlines()
     spec = PathSpec.from_lines(GitWildMatchPattern, patterns)
     return spec
 
-def estimate_token_count(text: str) -> int:
+@lru_cache(maxsize=1)
+def _get_encoder():
     try:
-        enc = tiktoken.get_encoding("cl100k_base")
-        return len(enc.encode(text))
+        return tiktoken.get_encoding("cl100k_base")
     except Exception:
+        return None  # 離線或無快取時改用粗估
+
+def estimate_token_count(text: str) -> int:
+    enc = _get_encoder()
+    if enc is None:
         return int(len(text) / 4)  # fallback 粗估
+    return len(enc.encode(text, disallowed_special=()))
+
+def render_block(rel_path, content: str) -> str:
+    return f"\n=== FILE: {rel_path} ===\n{content}\n"
+
+# ----------- Incremental Cache -----------
+CACHE_FILE_NAME = ".zip_cache.json"
+CACHE_VERSION = 2  # v2：只存 mtime/size/sha1/tokens，不存內容（v1 連 block 都存，快取跟 snapshot 一樣大）
+
+def _encoder_name() -> str:
+    return "cl100k_base" if _get_encoder() is not None else "approx"
+
+def load_cache(cache_path: Path) -> dict:
+    # 快取格式或 tokenizer 不同就整份作廢，避免混到不同算法的 token 數
+    try:
+        data = json.loads(cache_path.read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+    if data.get("version") != CACHE_VERSION or data.get("encoder") != _encoder_name():
+        return {}
+    return data.get("files", {})
+
+def save_cache(cache_path: Path, files: dict):
+    data = {"version": CACHE_VERSION, "encoder": _encoder_name(), "files": files}
+    tmp = cache_path.with_name(cache_path.name + ".tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+    tmp.replace(cache_path)
+
+def _decode(raw: bytes) -> str:
+    # 與 read_text 相同的 universal newline 行為
+    return raw.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+def load_block(filepath: Path, rel_path, cache: dict | None = None):
+    """讀檔並回傳 (block, tokens, from_cache, entry)；有 cache 時 mtime/size/hash 未變就沿用 token 數，只重讀內容。
+    entry 是這個檔案的新快取項目（沒有 cache 時為 None），由主執行緒收進 new_cache，worker 不碰共用 dict。"""
+    if cache is None:
+        block = render_block(rel_path, filepath.read_text(encoding="utf-8"))
+        return block, estimate_token_count(block), False, None
+
+    key = str(rel_path)
+    st = filepath.stat()
+    entry = cache.get(key)
+    raw = filepath.read_bytes()
+    block = render_block(rel_path, _decode(raw))
+    if entry and entry["mtime_ns"] == st.st_mtime_ns and entry["size"] == st.st_size:
+        return block, entry["tokens"], True, entry
+
+    digest = hashlib.sha1(raw).hexdigest()
+    hit = bool(entry) and entry["sha1"] == digest  # 只有 mtime 變動（touch / checkout），內容相同不必重新 tokenize
+    tokens = entry["tokens"] if hit else estimate_token_count(block)
+    return block, tokens, hit, {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "sha1": digest, "tokens": tokens}
+
+# ----------- Walk & Parallel Load -----------
+ALWAYS_SKIP_DIRS = {".git"}
+# 教材頁：x.frag.html 是內容，x.html 是套共用版型產生的成品（GitHub Pages 要用，所以兩個都進版控）；只打包片段
+FRAGMENT_SUFFIX = ".frag.html"
+
+def _is_rendered_page(name: str, names) -> bool:
+    return name.endswith(".html") and not name.endswith(FRAGMENT_SUFFIX) and name[:-len(".html")] + FRAGMENT_SUFFIX in names
+
+def _is_ignored(rel_posix: str, is_dir: bool, ignore_stack) -> bool:
+    # 模擬 git 規則：由淺到深套用每層 .gitignore，最後一條命中的 pattern 決定結果（含 ! 反向）
+    result = None
+    for base, patterns in ignore_stack:
+        sub = rel_posix[len(base):] if base else rel_posix
+        if is_dir:
+            sub += "/"
+        for pat in patterns:
+            if pat.include is not None and pat.match_file(sub):
+                result = pat.include
+    return bool(result)
+
+def iter_candidates(root_path: Path, include_exts, output_dir_name):
+    """用 os.scandir 走訪：被忽略的資料夾直接剪枝不進入，先比副檔名再做 ignore 判斷。"""
+    root_spec = load_gitignore(root_path)
+    stack = [(root_path, "", ((("", root_spec.patterns),) if root_spec else ()))]
+    while stack:
+        dirpath, rel_dir, ignore_stack = stack.pop()
+        try:
+            with os.scandir(dirpath) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            print(f"[Skipped] {rel_dir or '.'}: {e}")
+            continue
+
+        subdirs = []
+        names = {entry.name for entry in entries}
+        for entry in entries:
+            rel_posix = f"{rel_dir}{entry.name}"
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name in ALWAYS_SKIP_DIRS or entry.name == output_dir_name:  # 排除輸出資料夾
+                    continue
+                if _is_ignored(rel_posix, True, ignore_stack):
+                    continue
+                subdirs.append((entry, rel_posix))
+                continue
+
+            if os.path.splitext(entry.name)[1].lower() not in include_exts:
+                continue
+            if entry.name == "ai_zipper.py":
+                continue  # Skip self
+            if _is_rendered_page(entry.name, names):
+                continue  # 同名片段已涵蓋內容
+            if _is_ignored(rel_posix, False, ignore_stack):
+                continue
+            if not entry.is_file():
+                continue
+            yield Path(entry.path), Path(rel_posix)
+
+        # 反向推入，讓 pop 出來時維持字母順序的深度優先
+        for entry, rel_posix in reversed(subdirs):
+            spec = load_gitignore(Path(entry.path))
+            child_stack = ignore_stack + (((rel_posix + "/", spec.patterns),) if spec else ())
+            stack.append((Path(entry.path), rel_posix + "/", child_stack))
+
+def _safe_load(filepath, rel_path, cache):
+    try:
+        return load_block(filepath, rel_path, cache), None
+    except Exception as e:
+        return None, e
+
+def iter_loaded(candidates, cache=None, jobs=1):
+    """依原順序產出 (filepath, rel_path, result, error)；jobs>1 且有 tiktoken 時以 thread pool 讀檔 + tokenize。"""
+    if jobs <= 1 or _get_encoder() is None:
+        # 粗估（len/4）幾乎不花時間，thread pool 只會多出排程成本（bench：jobs=4 195ms vs 單執行緒 111ms）
+        for filepath, rel_path in candidates:
+            yield (filepath, rel_path) + _safe_load(filepath, rel_path, cache)
+        return
+
+    # tiktoken 編碼時會釋放 GIL，thread pool 即可吃滿多核；共用同一個已快取的 encoder。
+    # 視窗限制在 jobs*4，避免大量已完成的檔案同時躺在記憶體裡。
+    window = jobs * 4
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for filepath, rel_path in candidates:
+            pending.append((filepath, rel_path, pool.submit(_safe_load, filepath, rel_path, cache)))
+            if len(pending) >= window:
+                fp, rp, fut = pending.popleft()
+                yield (fp, rp) + fut.result()
+        while pending:
+            fp, rp, fut = pending.popleft()
+            yield (fp, rp) + fut.result()
+
+# ----------- Output Writer -----------
+DATE_IN_PATH = re.compile(r"(\d{4})-(\d{2})-(\d{2})")
+
+def newest_first(candidates):
+    # 檔名帶 YYYY-MM-DD 的教材依日期排前面；沒有日期的（設定、程式、README）一律排在後面，
+    # 彼此再依 mtime——剛 checkout 時大家 mtime 都一樣，不能讓它們擠到教材前面
+    dated, undated = [], []
+    for filepath, rel_path in candidates:
+        m = DATE_IN_PATH.search(rel_path.name)
+        if m: dated.append(("".join(m.groups()), str(rel_path), filepath, rel_path))
+        else: undated.append((filepath.stat().st_mtime_ns, str(rel_path), filepath, rel_path))
+    return [(fp, rp) for *_, fp, rp in sorted(dated, reverse=True) + sorted(undated, reverse=True)]
+
+class SnapshotWriter:
+    """寫出 snapshot；給 max_tokens 時只在檔案邊界切成 part 檔，並記錄每個 part 的檔案與 token 數。"""
+
+    def __init__(self, output_path: Path, header: str, max_tokens: int | None = None):
+        self.output_path = output_path
+        self.header = header
+        self.header_tokens = estimate_token_count(header)
+        self.max_tokens = max_tokens
+        self.parts = []
+        self._out = None
+        # 清掉上一次留下、這次不會覆寫的檔：part 數變少的舊 part，以及切換分段/單檔模式時另一種模式的輸出
+        stale = list(output_path.parent.glob(f"{output_path.stem}.part*{output_path.suffix}"))
+        stale.append(self.index_path)
+        if max_tokens:
+            stale.append(output_path)
+        for old in stale:
+            old.unlink(missing_ok=True)
+        if not max_tokens:
+            self._open(output_path)
+
+    @property
+    def index_path(self) -> Path:
+        return self.output_path.with_name(f"{self.output_path.stem}.index.json")
+
+    def _part_path(self, n: int) -> Path:
+        return self.output_path.with_name(f"{self.output_path.stem}.part{n:03d}{self.output_path.suffix}")
+
+    def _open(self, path: Path):
+        if self._out:
+            self._out.close()
+        self._out = path.open("w", encoding="utf-8")
+        self._out.write(self.header)
+        self.parts.append({"file": path.name, "tokens": self.header_tokens, "files": []})
+
+    def write(self, rel_path: str, block: str, tokens: int):
+        part = self.parts[-1] if self.parts else None
+        if self.max_tokens and (part is None or (part["files"] and part["tokens"] + tokens > self.max_tokens)):
+            self._open(self._part_path(len(self.parts) + 1))
+            part = self.parts[-1]
+        self._out.write(block)
+        part["tokens"] += tokens
+        part["files"].append({"path": rel_path, "tokens": tokens})
+
+    def close(self):
+        if self.max_tokens and not self.parts:
+            self._open(self._part_path(1))  # 沒有任何檔案也留一個只有 header 的 part，index 才不會指向空清單
+        if self._out:
+            self._out.close()
+            self._out = None
+        if not self.max_tokens:
+            return None
+        index_path = self.index_path
+        index = {
+            "max_tokens_per_chunk": self.max_tokens,
+            "total_tokens": self.total_tokens,
+            "parts": self.parts,
+        }
+        index_path.write_text(json.dumps(index, ensure_ascii=False, indent=2), encoding="utf-8")
+        return index_path
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(part["tokens"] for part in self.parts) if self.parts else self.header_tokens
 
 # ----------- Main Function -----------
-def zip_project(root_path: Path, include_exts, output_dir_name=".ai_zip_output", output_file_name="uniflow_snapshot.txt"):
+def zip_project(root_path: Path, include_exts, output_dir_name=".ai_zip_output", output_file_name="uniflow_snapshot.txt",
+                incremental=False, jobs=1, per_file=False, max_tokens_per_chunk=None, priority="path"):
+    started = time.perf_counter()
     # 正規化副檔名（補點號、轉小寫、去重）
     include_exts = {
         e.lower() if e.startswith(".") else f".{e.lower()}"
@@ -43,49 +276,72 @@ def zip_project(root_path: Path, include_exts, output_dir_name=".ai_zip_output",
     output_dir.mkdir(exist_ok=True)
     output_path = output_dir / output_file_name
 
-    gitignore_spec = load_gitignore(root_path)
     files_added = []
     file_count = 0
     env_file_warning = False
-    all_text = f"### Project root: {root_path.resolve()}\n"
-
-    for filepath in root_path.rglob("*"):
-        if filepath.is_dir():
-            continue
-
-        if output_dir_name in filepath.parts:  # 排除輸出資料夾
-            continue
-        
-        rel_path = filepath.relative_to(root_path)
-
-        if rel_path.name == "ai_zipper.py":
-            continue  # Skip self
-        if gitignore_spec and gitignore_spec.match_file(str(rel_path)):
-            continue
-        if filepath.suffix.lower() not in include_exts:
-            continue
+    header = f"### Project root: {root_path.resolve()}\n"
+    cache_path = output_dir / CACHE_FILE_NAME
+    # 快取只省下 tokenize（檔案照樣要讀才能寫進 snapshot）；粗估 len/4 本身幾乎不花時間，
+    # 再加上 stat、sha1 與讀寫快取檔反而比完整跑還慢，所以沒有 tiktoken 時不用快取
+    cache_skipped = incremental and _get_encoder() is None
+    incremental = incremental and not cache_skipped
+    cache = load_cache(cache_path) if incremental else None
+    new_cache = {} if incremental else None
+    reused = 0
 
-        try:
-            content = filepath.read_text(encoding="utf-8")
-        except Exception as e:
-            print(f"[Skipped] {rel_path}: {e}")
-            continue
+    # 逐檔串流寫出：記憶體只保留讀取視窗內的檔案，token 也在同一趟逐檔累加
+    candidates = iter_candidates(root_path, include_exts, output_dir_name)
+    if priority == "newest":
+        candidates = newest_first(candidates)
+    writer = SnapshotWriter(output_path, header, max_tokens_per_chunk)
+    try:
+        for filepath, rel_path, result, err in iter_loaded(candidates, cache, jobs):
+            if err is not None:
+                print(f"[Skipped] {rel_path}: {err}")
+                continue
 
-        all_text += f"\n=== FILE: {rel_path} ===\n{content}\n"
-        files_added.append(str(rel_path))
-        file_count += 1
-        if filepath.name == ".env":
-            env_file_warning = True
+            block, tokens, hit, entry = result
+            reused += hit
+            if new_cache is not None:
+                new_cache[str(rel_path)] = entry
+            writer.write(str(rel_path), block, tokens)
+            files_added.append((str(rel_path), tokens))
+            file_count += 1
+            if filepath.name == ".env":
+                env_file_warning = True
+    finally:
+        index_path = writer.close()
+    total_tokens = writer.total_tokens
 
-    output_path.write_text(all_text, encoding="utf-8")
+    if incremental and new_cache != cache:
+        save_cache(cache_path, new_cache)  # 只留本次仍存在的檔案；全部沒變就不重寫
 
+    elapsed = time.perf_counter() - started
+    if per_file:
+        print("\n🧾 Tokens per file:")
+        for rel, tokens in files_added:
+            print(f"  {tokens:>9,}  {rel}")
     print(f"\n✅ Done. Total files added: {file_count}")
-    print(f"📄 Output file: {output_path}")
-    print(f"🧠 Estimated token count: {estimate_token_count(all_text):,} tokens")
+    if incremental:
+        print(f"♻️  Reused from cache: {reused}, re-encoded: {file_count - reused}")
+    elif cache_skipped:
+        print("ℹ️  --incremental ignored: tiktoken encoder unavailable, approximate counts are cheaper than the cache")
+    if index_path:
+        for part in writer.parts:
+            over = " ⚠️ over budget (single file)" if part["files"] and part["tokens"] > max_tokens_per_chunk else ""
+            print(f"📄 {part['file']}: {len(part['files'])} files, {part['tokens']:,} tokens{over}")
+        print(f"🗂️  Index file: {index_path}")
+    else:
+        print(f"📄 Output file: {output_path}")
+    print(f"🧠 Estimated token count: {total_tokens:,} tokens")
+    print(f"⏱️  Elapsed: {elapsed:.2f}s (jobs={jobs if _get_encoder() is not None else 1})")
+    if jobs > 1 and _get_encoder() is None:
+        print(f"ℹ️  --jobs {jobs} ignored: tiktoken encoder unavailable, token counts are approximate (len/4) and computed single-threaded")
     if env_file_warning:
         print("⚠️  Warning: .env file was included in output! Double-check for secrets.")
     if not (root_path / ".gitignore").exists():
         print("📌 Tip: You can create a .gitignore to auto-exclude folders like __pycache__, .venv, node_modules, etc.")
+    return {"files": files_added, "total_tokens": total_tokens, "elapsed": elapsed, "parts": writer.parts}
 
 # ----------- CLI Entry Point -----------
 if __name__ == "__main__":
@@ -112,6 +368,35 @@ if __name__ == "__main__":
         nargs="*",
         help="File extensions to exclude from the default include list."
     )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help=(f"Reuse cached tiktoken counts for unchanged files so they are not re-encoded (cache: <output dir>/{CACHE_FILE_NAME}). "
+              "Files are still read in full; ignored when only the approximate encoder is available")
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker threads for tokenizing files (default: 1). Only takes effect when the tiktoken "
+             "cl100k_base encoder can be loaded; otherwise counts are approximate and computed single-threaded"
+    )
+    parser.add_argument(
+        "--per-file",
+        action="store_true",
+        help="Print the token count of every included file"
+    )
+    parser.add_argument(
+        "--max-tokens-per-chunk",
+        type=int,
+        help="Split output into numbered part files (at file boundaries) of at most N tokens, plus a JSON index"
+    )
+    parser.add_argument(
+        "--priority",
+        choices=["path", "newest"],
+        default="path",
+        help="File order: path (default, walk order) or newest (dated filenames newest first, then undated files by mtime)"
+    )
     args = parser.parse_args()
     
     # 如果有指定排除，就從 include-ext 扣掉
@@ -122,4 +407,6 @@ if __name__ == "__main__":
                        for e in args.exclude_ext}
         final_exts = [ext for ext in args.include_ext if ext.lower() not in exclude_set]
 
-    zip_project(Path(args.root), final_exts)
+    zip_project(Path(args.root), final_exts, incremental=args.incremental,
+                jobs=max(1, args.jobs), per_file=args.per_file,
+                max_tokens_per_chunk=args.max_tokens_per_chunk, priority=args.priority)
@@ -0,0 +1,239 @@
+# bench/bench.py
+"""
+效能基準：在暫存資料夾產生合成資料集（bench/datasets.py），量測真正的程式路徑
+
+- server：/api/data（manifest 冷/熱快取、304、月曆索引、教材頁）、/api/save（manifest、教材片段），走 Flask test client
+- build：add_cmd、batch_add_cmd（DOCS 等路徑指向暫存資料夾）
+- zip：ai_zipper.zip_project（完整、增量、多執行緒；增量只省 tiktoken 編碼、檔案照讀，載不到 tiktoken 編碼器時
+  incremental 與 jobs 都不生效，三者跑的是同一條路徑）；沒裝 tiktoken/pathspec 時略過
+
+用法：
+  python bench/bench.py run [--scale small|medium|large] [--students N --years N] [--repeat 20]
+                            [--only server,build,zip] [--out result.json] [--baseline base.json] [--keep DIR]
+  python bench/bench.py compare base.json new.json [--threshold 0.15]
+結果是 JSON（每個案例的 n/min/median/p95/mean，單位 ms）；比較以 median 為準，變慢超過 threshold 時 exit 1。
+"""
+from __future__ import annotations
+import argparse, contextlib, datetime as dt, io, json, platform, shutil, statistics, subprocess, sys, tempfile, time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import datasets, search_index
+
+RESULT_VERSION = 1
+DEFAULT_THRESHOLD = 0.15  # median 變動 ±15% 以內視為雜訊
+GROUPS = ("server", "build", "zip")
+
+def p(*a): print(*a, file=sys.stderr)
+
+def _stats(samples: list[float]) -> dict:
+    ms = sorted(s * 1000 for s in samples)
+    return {
+        "n": len(ms),
+        "min_ms": round(ms[0], 3),
+        "median_ms": round(statistics.median(ms), 3),
+        "p95_ms": round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 3),
+        "mean_ms": round(statistics.fmean(ms), 3),
+    }
+
+def _time(fn, repeat: int, *, setup=None, warmup: int = 1) -> list[float]:
+    """每輪先跑 setup（不計時）再計時 fn(i)；前 warmup 輪不記錄。"""
+    out = []
+    for i in range(warmup + repeat):
+        arg = setup(i) if setup else i
+        with contextlib.redirect_stdout(io.StringIO()):  # build.py / ai_zipper 的進度輸出
+            t0 = time.perf_counter()
+            fn(arg)
+            dt_ = time.perf_counter() - t0
+        if i >= warmup: out.append(dt_)
+    return out
+
+def _ok(resp, *codes):
+    if resp.status_code not in (codes or (200,)):
+        raise RuntimeError(f"{resp.request.path} → {resp.status_code} {resp.get_data(as_text=True)[:200]}")
+    return resp
+
+# ------------------------ server.py ------------------------
+def bench_server(root: Path, info: dict, repeat: int) -> dict:
+    import server
+    server.BASE_DIR, server.DOCS_DIR = root, root / "docs"
+    server.SEARCH_DB = root / search_index.DB_NAME
+    server._json_cache.clear(); server._index_cache.clear(); server._render_cache.clear()
+    client = server.app.test_client()
+    sids = [datasets.student_id(i) for i in range(info["students"])]
+    lesson = next((root / "docs").glob("materials/*/*/*_material_*.html"), None)
+    res = {}
+
+    def get_manifest(i, headers=None):
+        return _ok(client.get(f"/api/data/students/{sids[i % len(sids)]}/manifest.json", headers=headers or {}), 200, 304)
+    def cold(i):
+        server._json_cache.clear(); return i
+    res["server.api_data.manifest.cold"] = _time(get_manifest, repeat, setup=cold)
+    res["server.api_data.manifest.warm"] = _time(lambda i: get_manifest(0), repeat)
+    etag = get_manifest(0).headers["ETag"]
+    res["server.api_data.manifest.304"] = _time(lambda i: get_manifest(0, {"If-None-Match": etag}), repeat)
+    res["server.api_data.index"] = _time(
+        lambda i: _ok(client.get(f"/api/data/students/{sids[i % len(sids)]}/index.json")), repeat)
+    if lesson is not None:
+        rel = lesson.relative_to(root / "docs").as_posix()
+        res["server.api_data.lesson"] = _time(lambda i: _ok(client.get(f"/api/data/{rel}")), repeat)
+
+    # 後台存檔：整份 manifest（加一筆新日期的教材）與一個教材片段
+    sid = sids[-1]
+    manifest = get_manifest(len(sids) - 1).get_json()
+    def add_item(i):
+        date = (datasets.START - dt.timedelta(days=i + 1)).isoformat()
+        path = f"materials/{sid}/english/{date}_bench.html"
+        manifest["days"][date] = {"english": {"material": [{"title": f"bench {i}", "path": path}]}}
+        return {"path": f"students/{sid}/manifest.json", "content": manifest}
+    res["server.api_save.manifest"] = _time(lambda body: _ok(client.post("/api/save", json=body)), repeat, setup=add_item)
+    def frag(i):
+        date = (datasets.START - dt.timedelta(days=i + 1)).isoformat()
+        text = f'<!--lesson {{"title":"bench {i}","date":"{date}","kind":"material"}}-->\n<p>{" ".join(datasets.WORDS) * 20}</p>\n'
+        return {"path": f"materials/{sid}/english/{date}_bench.frag.html", "content": text}
+    res["server.api_save.lesson"] = _time(lambda body: _ok(client.post("/api/save", json=body)), repeat, setup=frag)
+    return res
+
+# ------------------------ build.py ------------------------
+def bench_build(root: Path, info: dict, repeat: int, *, batch: int) -> dict:
+    import build
+    build.ROOT, build.DOCS = root, root / "docs"
+    build.BACKUPS, build.BLOBS = root / ".backups", root / "docs" / ".blobs"
+    build.SEARCH_DB = root / search_index.DB_NAME
+    src_root = root / ".bench_src"
+    res = {}
+
+    sid = datasets.student_id(0)
+    src = datasets.make_sources(src_root / "single", count=1, start=datasets.START)[0]
+    def add(i):
+        date = (datasets.START - dt.timedelta(days=400 + i)).isoformat()
+        build.add_cmd(student=sid, course="english", date=date, typ="material", fmt="html", src=str(src), title=f"bench {i}")
+    res["build.add_cmd"] = _time(add, repeat)
+
+    sid = datasets.student_id(min(1, info["students"] - 1))
+    def sources(i):
+        start = datasets.START - dt.timedelta(days=(i + 1) * (batch + 7) + 800)
+        return datasets.make_sources(src_root / f"batch{i}", count=batch, start=start)[0].parent
+    res[f"build.batch_add_cmd.{batch}"] = _time(
+        lambda folder: build.batch_add_cmd(student=sid, course="math", from_dir=str(folder)), repeat, setup=sources)
+    shutil.rmtree(src_root, ignore_errors=True)
+    return res
+
+# ------------------------ ai_zipper.py ------------------------
+def bench_zip(root: Path, info: dict, repeat: int) -> dict:
+    try:
+        import ai_zipper
+    except ImportError as e:
+        p(f"  [skip] zip：{e}"); return {}
+    tree, exts = root / "docs", ai_zipper.DEFAULT_EXTS
+    out = ".bench_zip"
+    def run(i, **kw):
+        ai_zipper.zip_project(tree, exts, output_dir_name=out, **kw)
+    res = {"zip.zip_project.full": _time(run, repeat)}
+    res["zip.zip_project.incremental"] = _time(lambda i: run(i, incremental=True), repeat)
+    res["zip.zip_project.jobs4"] = _time(lambda i: run(i, jobs=4), repeat)
+    shutil.rmtree(tree / out, ignore_errors=True)
+    return res
+
+# ------------------------ run / compare ------------------------
+def _git_rev() -> str | None:
+    try: return subprocess.run(["git", "-C", str(ROOT), "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError): return None
+
+def run_cmd(args) -> int:
+    students, years = datasets.SCALES[args.scale]
+    students, years = args.students or students, args.years or years
+    groups = [g for g in (args.only.split(",") if args.only else GROUPS) if g]
+    unknown = set(groups) - set(GROUPS)
+    if unknown: raise SystemExit(f"未知的 --only：{', '.join(sorted(unknown))}（可用：{', '.join(GROUPS)}）")
+
+    tmp = None
+    if args.keep:
+        root = Path(args.keep).resolve()
+        if root.exists(): shutil.rmtree(root)
+    else:
+        tmp = tempfile.TemporaryDirectory(prefix="bench-")
+        root = Path(tmp.name)
+    try:
+        t0 = time.perf_counter()
+        info = datasets.generate(root, students=students, years=years, files_students=args.files_students, seed=args.seed)
+        p(f"  [data] {info['students']} 位學生 × {info['years']} 年：{info['days']:,} 天、{info['items']:,} 筆、"
+          f"{info['files']:,} 個教材檔（{time.perf_counter() - t0:.1f}s）→ {root}")
+        samples = {}
+        for group in groups:
+            t0 = time.perf_counter()
+            if group == "server": samples.update(bench_server(root, info, args.repeat))
+            elif group == "build": samples.update(bench_build(root, info, args.repeat, batch=args.batch))
+            elif group == "zip": samples.update(bench_zip(root, info, args.repeat))
+            p(f"  [{group}] {time.perf_counter() - t0:.1f}s")
+    finally:
+        if tmp: tmp.cleanup()
+
+    result = {
+        "version": RESULT_VERSION,
+        "meta": {"time": dt.datetime.now().isoformat(timespec="seconds"), "git": _git_rev(),
+                 "python": platform.python_version(), "platform": platform.platform(),
+                 "scale": args.scale, "repeat": args.repeat},
+        "dataset": info,
+        "results": {name: _stats(s) for name, s in samples.items()},
+    }
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8"); p(f"  ==> {args.out}")
+    else:
+        print(text)
+    if args.baseline:
+        return compare(json.loads(Path(args.baseline).read_text(encoding="utf-8")), result, threshold=args.threshold)
+    return 0
+
+def compare(base: dict, new: dict, *, threshold: float = DEFAULT_THRESHOLD) -> int:
+    """以 median 比較；回傳變慢超過 threshold 的案例數（當 exit code，0 表示沒有退步）。"""
+    if base.get("dataset") != new.get("dataset"):
+        p("  [!] 兩份結果的資料集不同（scale/seed/students/years），數字僅供參考")
+    a, b = base.get("results") or {}, new.get("results") or {}
+    slower = 0
+    p(f"  {'case':<36}{'base ms':>11}{'new ms':>11}{'ratio':>8}")
+    for name in sorted(a.keys() | b.keys()):
+        if name not in a or name not in b:
+            p(f"  {name:<36}{'—' if name not in a else a[name]['median_ms']:>11}{'—' if name not in b else b[name]['median_ms']:>11}")
+            continue
+        old, cur = a[name]["median_ms"], b[name]["median_ms"]
+        ratio = cur / old if old else float("inf")
+        mark = "  slower" if ratio > 1 + threshold else "  faster" if ratio < 1 - threshold else ""
+        slower += ratio > 1 + threshold
+        p(f"  {name:<36}{old:>11.3f}{cur:>11.3f}{ratio:>7.2f}x{mark}")
+    p(f"  [compare] threshold ±{threshold:.0%} · 變慢 {slower} 項")
+    return slower
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="english-tutoring 效能基準（合成資料集）")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ap_run = sub.add_parser("run", help="產生資料集並量測，輸出 JSON")
+    ap_run.add_argument("--scale", choices=sorted(datasets.SCALES), default="small")
+    ap_run.add_argument("--students", type=int, help="覆寫 scale 的學生數")
+    ap_run.add_argument("--years", type=int, help="覆寫 scale 的年數")
+    ap_run.add_argument("--files-students", type=int, default=5, help="前 N 位學生產生實際教材檔（預設 5）")
+    ap_run.add_argument("--seed", type=int, default=42)
+    ap_run.add_argument("--repeat", type=int, default=20, help="每個案例量測次數（預設 20）")
+    ap_run.add_argument("--batch", type=int, default=20, help="batch_add_cmd 每批檔案數（預設 20）")
+    ap_run.add_argument("--only", help=f"只跑這些組（逗號分隔：{','.join(GROUPS)}）")
+    ap_run.add_argument("--out", help="結果寫到檔案（預設印到 stdout）")
+    ap_run.add_argument("--baseline", help="與這份結果比較（變慢時 exit 1）")
+    ap_run.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    ap_run.add_argument("--keep", help="資料集放在這個資料夾並保留（會先清空），預設用暫存資料夾")
+    ap_cmp = sub.add_parser("compare", help="比較兩份結果 JSON")
+    ap_cmp.add_argument("base"); ap_cmp.add_argument("new")
+    ap_cmp.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = ap.parse_args(argv)
+
+    if args.cmd == "run":
+        code = run_cmd(args)
+    else:
+        load = lambda f: json.loads(Path(f).read_text(encoding="utf-8"))
+        code = compare(load(args.base), load(args.new), threshold=args.threshold)
+    raise SystemExit(1 if code else 0)
+
+if __name__ == "__main__":
+    main()
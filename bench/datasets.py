@@ -0,0 +1,106 @@
+# bench/datasets.py
+"""
+合成測試資料（固定亂數種子，同參數產生的內容完全相同）
+
+- <root>/docs/roster.json、docs/students/<id>/manifest.json（磁碟格式與正式相同：精簡 v4）
+- 每位學生每週 1～2 堂、兩門課，每堂 material／homework／note 各有機率出現
+- 教材檔只替前 files_students 位學生產生（片段 .frag.html＋成品 .html），其餘學生的 path 指向不存在的檔，
+  大規模時 manifest 仍是真實大小，但不用寫幾十萬個檔
+"""
+from __future__ import annotations
+import datetime as dt, json, random, sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import lesson_layout, manifest_store
+
+SCALES = {  # 學生數 × 年數
+    "small": (10, 1),
+    "medium": (100, 2),
+    "large": (1000, 3),
+}
+COURSES = {"english": {"label": "英文", "color": "#1d4ed8"}, "math": {"label": "數學", "color": "#059669"}}
+TYPES = {"material": "教材", "homework": "作業", "note": "提醒"}
+TYPE_ODDS = {"material": 0.95, "homework": 0.6, "note": 0.25}
+START = dt.date(2023, 1, 2)
+WORDS = ("vocabulary reading grammar listening essay practice review fractions geometry algebra "
+         "閱讀 文法 單字 聽力 作文 練習 複習 分數 幾何 代數 測驗 筆記").split()
+
+def student_id(i: int) -> str:
+    return f"s{i:04d}"
+
+def _title(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 4)))
+
+def _body(rng: random.Random, paragraphs: int) -> str:
+    return "\n".join(f"<p>{' '.join(rng.choice(WORDS) for _ in range(rng.randint(30, 80)))}</p>" for _ in range(paragraphs))
+
+def make_manifest(rng: random.Random, sid: str, years: int) -> dict:
+    days = {}
+    for week in range(52 * years):
+        for offset in sorted(rng.sample(range(7), rng.choice((1, 1, 2)))):
+            date = (START + dt.timedelta(weeks=week, days=offset)).isoformat()
+            per_date = {}
+            for course in COURSES:
+                if rng.random() < 0.3: continue
+                per_course = {}
+                for typ, odds in TYPE_ODDS.items():
+                    if rng.random() >= odds: continue
+                    title = _title(rng)
+                    name = f"{date}_{typ}_{rng.randrange(10**6):06d}.html"
+                    per_course[typ] = [{"title": title, "path": f"{manifest_store.course_prefix(sid, course)}{name}"}]
+                if per_course: per_date[course] = per_course
+            if per_date: days[date] = per_date
+    holidays = sorted((START + dt.timedelta(days=rng.randrange(365 * years))).isoformat() for _ in range(6 * years))
+    return {"version": 3, "student": sid, "displayName": sid.upper(), "courses": COURSES, "types": TYPES,
+            "days": days, "holidays": holidays}
+
+def write_materials(docs: Path, manifest: dict, rng: random.Random):
+    for date, per_date in manifest["days"].items():
+        for course, per_course in per_date.items():
+            for typ, items in per_course.items():
+                for it in items:
+                    page = docs / it["path"]
+                    page.parent.mkdir(parents=True, exist_ok=True)
+                    kind = "note" if typ == "note" else "material"
+                    body = f'<div class="note">{_title(rng)}</div>' if kind == "note" else _body(rng, rng.randint(3, 12))
+                    frag = lesson_layout.make_fragment({"title": it["title"], "date": date, "kind": kind}, body)
+                    frag_rel = lesson_layout.fragment_for(it["path"])
+                    (docs / frag_rel).write_text(frag, encoding="utf-8")
+                    page.write_text(lesson_layout.render_fragment(frag, frag_rel), encoding="utf-8")
+
+def generate(root: Path, *, students: int, years: int, files_students: int = 5, seed: int = 42) -> dict:
+    """在 root 底下產生一份資料集，回傳摘要（學生數、天數、項目數、檔案數）。"""
+    rng = random.Random(seed)
+    docs = root / "docs"
+    (docs / "students").mkdir(parents=True, exist_ok=True)
+    for rel, text in lesson_layout.asset_files().items():
+        (docs / rel).parent.mkdir(parents=True, exist_ok=True)
+        (docs / rel).write_text(text, encoding="utf-8")
+    roster, ndays, nitems, nfiles = [], 0, 0, 0
+    for i in range(students):
+        sid = student_id(i)
+        manifest = make_manifest(rng, sid, years)
+        fp = docs / "students" / sid / "manifest.json"
+        fp.parent.mkdir(parents=True, exist_ok=True)
+        fp.write_text(manifest_store.dumps(manifest), encoding="utf-8")
+        fp.with_name("index.json").write_text(manifest_store.dumps_index(manifest_store.calendar_index(manifest)), encoding="utf-8")
+        items = sum(len(v) for d in manifest["days"].values() for c in d.values() for v in c.values())
+        ndays += len(manifest["days"]); nitems += items
+        if i < files_students:
+            write_materials(docs, manifest, rng); nfiles += items
+        roster.append({"id": sid, "name": sid.upper()})
+    (docs / "roster.json").write_text(json.dumps({"students": roster}, ensure_ascii=False, indent=2), encoding="utf-8")
+    return {"students": students, "years": years, "days": ndays, "items": nitems, "files": nfiles, "seed": seed}
+
+def make_sources(src_dir: Path, *, count: int, start: dt.date, seed: int = 7) -> list[Path]:
+    """給 batch_add 用的來源資料夾：YYMMDD[_hw].html，每個檔案一天。"""
+    rng = random.Random(seed)
+    src_dir.mkdir(parents=True, exist_ok=True)
+    out = []
+    for i in range(count):
+        date = start + dt.timedelta(days=i)
+        fp = src_dir / f"{date:%y%m%d}{'_hw' if i % 3 == 2 else ''}.html"
+        fp.write_text(f"<!doctype html><html><body>{_body(rng, 4)}</body></html>", encoding="utf-8")
+        out.append(fp)
+    return out
@@ -5,38 +5,298 @@ Spec: /docs 專案，學生端首頁 + 後台 GUI + per-student manifest
 Commands:
   init --student <id>
   new-student --student <id>
-  add --student <id> --course <key> --date YYYY-MM-DD --type material|homework --format html|pdf|image|link [--src PATH] [--external-url URL] [--title "文字"] [--dry-run]
-  batch-add --student <id> --course <key> --from-dir PATH [--dry-run]
+  add --student <id> --course <key> --date YYYY-MM-DD --type material|homework --format html|pdf|image|link [--src PATH] [--external-url URL] [--title "文字"] [--hardlink] [--dry-run]
+  batch-add --student <id> --course <key> --from-dir PATH [--jobs N] [--hardlink] [--dry-run]
+  gc-blobs [--dry-run]
+  export-manifest --student <id> [--out PATH]
+  precompress [--force] [--min-size N] [--dry-run]
+  index [--student <id>] [--dry-run]
+  overview [--dry-run]
+  shard --student <id> [--off] [--dry-run]
+  search-index [--student <id>]
+  search <關鍵字> [--student <id>] [--limit N]
+  render [--dry-run]
+  migrate-layout [--dry-run]
+  migrate-manifest [--student <id>] [--dry-run]
+  restore --student <id> [--at YYYY-MM-DD[THH:MM[:SS]]|latest] [--list] [--dry-run]
 """
-import argparse, datetime as dt, json, os, re, shutil, sys
+import argparse, datetime as dt, gzip, hashlib, json, os, re, shutil, sys, tempfile, time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
 from pathlib import Path
 
+import lesson_layout
+import manifest_store
+import search_index
+try:
+    import fcntl  # Linux reflink (FICLONE)、資料夾 flock
+except ImportError:
+    fcntl = None
+try:
+    import brotli  # optional：有裝才多產 .br
+except ImportError:
+    brotli = None
+
 ROOT = Path(__file__).resolve().parent
 DOCS = ROOT / "docs"
+BACKUPS = ROOT / ".backups"      # 不放在 docs/ 底下，避免被 GitHub Pages 發佈
+BACKUP_KEEP_LAST = 20            # 保留最近 N 份
+BACKUP_KEEP_DAILY = 30           # 另外每天保留最後一份，保留 N 天
+BLOBS = DOCS / ".blobs"          # 內容定址儲存：同內容只存一份，materials/ 以 reflink 共用（hardlink 要 --hardlink 才用）
+SEARCH_DB = ROOT / search_index.DB_NAME  # 全文索引（與 server.py /api/search 共用）
 
 # ------------------------ helpers ------------------------
 def p(*a): print(*a)
 def ensure_dir(path: Path): path.mkdir(parents=True, exist_ok=True)
+
+# 與 server.py _locked 同一把鎖：對檔案所在資料夾 flock，CLI 與伺服器（含多個 worker）寫同一位學生時依序進行
+_held_dirs = set()  # 本行程已持有 flock 的資料夾（flock 以開啟的檔案為單位，同一行程再開一次也會卡住）
+
+@contextmanager
+def _flock_dir(d: Path):
+    key = str(d)
+    if fcntl is None or key in _held_dirs: yield; return
+    ensure_dir(d)
+    fd = os.open(d, os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        _held_dirs.add(key)
+        yield
+    finally:
+        _held_dirs.discard(key)
+        os.close(fd)  # 關掉即釋放
+
+@contextmanager
+def locked(*dirs: Path):
+    """鎖住幾個資料夾：先深後淺，與伺服器的順序相同（materials/… → students/<id>/ → docs/assets/ → docs/），不會互鎖。"""
+    with ExitStack() as stack:
+        for d in sorted(set(dirs), key=lambda d: (-len(d.parts), str(d))):
+            stack.enter_context(_flock_dir(d))
+        yield
+
 def write_text(path: Path, text: str, *, dry=False):
     ensure_dir(path.parent)
     if dry: p("  [dry] write", path); return
-    path.write_text(text, encoding="utf-8"); p("  [+] write", path)
-def copy_file(src: Path, dst: Path, *, dry=False):
+    with locked(path.parent):
+        tmp = path.with_name(f".{path.name}.tmp")  # 暫存檔 + rename：中途失敗不會留下半個檔
+        tmp.write_text(text, encoding="utf-8"); os.replace(tmp, path); p("  [+] write", path)
+def copy_file(src: Path, dst: Path, *, dry=False, hardlink=False):
     ensure_dir(dst.parent)
     if dry: p("  [dry] copy", src, "->", dst); return
-    shutil.copy2(src, dst); p("  [+] copy", src, "->", dst)
+    tmp, how = stage_file(src, dst, hardlink=hardlink)
+    if tmp is None: p("  [=] unchanged", dst); return how
+    os.replace(tmp, dst); p(f"  [+] {how}", src, "->", dst)
+    return how
+
+# ------------------------ blob store ------------------------
+FICLONE = 0x40049409  # Linux ioctl：btrfs/xfs 等支援 copy-on-write 的檔案系統
+HARDLINK_HELP = "不支援 reflink 時改用 hardlink（省空間，但教材與 docs/.blobs 共用同一份：就地修改會影響所有共用者）"
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""): h.update(chunk)
+    return h.hexdigest()
+
+def blob_for(src: Path, digest: str) -> Path:
+    blob = BLOBS / digest[:2] / f"{digest}{src.suffix.lower()}"
+    if not blob.exists():
+        ensure_dir(blob.parent)
+        fd, tmp = tempfile.mkstemp(dir=blob.parent, prefix=f".{blob.name}.", suffix=".tmp")  # 各執行緒各自的暫存檔
+        os.close(fd)
+        try: shutil.copy2(src, tmp); os.replace(tmp, blob)
+        except BaseException: Path(tmp).unlink(missing_ok=True); raise
+    return blob
+
+def _clone(blob: Path, fd: int, tmp: Path, *, hardlink=False) -> str:
+    """reflink（寫入時才分家，最安全）→ hardlink（只在 hardlink=True）→ 一般複製。
+    hardlink 與 blob 共用 inode：任何「直接改檔」的編輯器或工具都會同時改到所有共用這份內容的學生，所以預設不用。
+    fd/tmp 是 mkstemp 剛建立、只有這個執行緒持有的空檔：reflink 直接寫進這個 fd，hardlink 先刪掉它再連到 blob，
+    不會以 "wb" 開啟任何可能已經連到 blob 的路徑（否則會把 blob 與所有共用它的教材一起清空）。"""
+    try:
+        if fcntl is not None:
+            try:
+                with blob.open("rb") as s:
+                    fcntl.ioctl(fd, FICLONE, s.fileno())
+                shutil.copystat(blob, tmp)
+                return "reflink"
+            except OSError:
+                os.ftruncate(fd, 0)
+    finally:
+        os.close(fd)
+    if hardlink:
+        try:
+            tmp.unlink()
+            os.link(blob, tmp)
+            return "hardlink"
+        except OSError:
+            pass
+    shutil.copy2(blob, tmp)  # tmp 不存在（link 失敗）或仍是自己的空檔
+    return "copy"
+
+def stage_file(src: Path, dst: Path, *, hardlink=False):
+    """把 src 經由 blob store 放到 dst 旁的暫存檔；回傳 (tmp, 方式)，內容未變則 (None, "unchanged")。
+    暫存檔名由 mkstemp 產生：平行 batch-add 時兩筆指到同一個 dst 也不會共用暫存檔。"""
+    digest = file_sha256(src)  # 每個來源只 hash 一次
+    blob = blob_for(src, digest)
+    if dst.exists() and (os.path.samefile(dst, blob) or
+                         (dst.stat().st_size == blob.stat().st_size and file_sha256(dst) == digest)):
+        return None, "unchanged"
+    ensure_dir(dst.parent)
+    fd, tmp = tempfile.mkstemp(dir=dst.parent, prefix=f".{dst.name}.", suffix=".tmp")
+    tmp = Path(tmp)
+    try:
+        return tmp, _clone(blob, fd, tmp, hardlink=hardlink)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+def gc_blobs_cmd(*, dry=False):
+    """blob 沒有任何 docs/ 教材使用就刪掉：hardlink 看 inode，reflink/複製的教材依大小篩過再比 sha256。"""
+    if not BLOBS.exists(): p("（沒有 docs/.blobs）"); return
+    blobs = {}
+    for b in BLOBS.glob("*/*"):
+        if b.is_file() and not b.name.startswith("."): blobs[b] = b.stat()
+    blob_inodes = {(st.st_dev, st.st_ino) for st in blobs.values()}
+    sizes = {st.st_size for st in blobs.values()}
+    linked, digests = set(), set()
+    for dirpath, dirnames, filenames in os.walk(DOCS):
+        dirnames[:] = [d for d in dirnames if not d.startswith(".")]  # 略過 .blobs 本身
+        for name in filenames:
+            fp = Path(dirpath) / name
+            st = fp.stat()
+            if (st.st_dev, st.st_ino) in blob_inodes: linked.add((st.st_dev, st.st_ino))
+            elif st.st_size in sizes: digests.add(file_sha256(fp))
+    removed = freed = 0
+    for b, st in blobs.items():
+        if (st.st_dev, st.st_ino) in linked or b.name.split(".", 1)[0] in digests: continue
+        removed += 1; freed += st.st_size
+        if dry: p("  [dry] remove", b)
+        else: b.unlink(); p("  [-] remove", b)
+    if not dry:
+        for d in BLOBS.iterdir():
+            if d.is_dir() and not any(d.iterdir()): d.rmdir()
+    p(f"  [gc] {'將刪除' if dry else '刪除'} {removed} 個 blob（{freed:,} bytes），保留 {len(blobs) - removed} 個")
 
 def load_json(path: Path, default=None):
     if path.exists():
         return json.loads(path.read_text(encoding="utf-8"))
     return default if default is not None else {}
 
+def load_manifest(path: Path, default=None, *, months=None):
+    # 磁碟上可能是精簡 v4 或月份分片，一律組成 v3 形狀再操作（months：分片時只讀這些月份）
+    if not path.exists(): return manifest_store.expand(default if default is not None else {})
+    return manifest_store.load(path, months=months)
+def write_manifest(path: Path, manifest: dict, *, months=None, dry=False):
+    """寫 manifest（精簡 v4；分片時只寫 months 的分片＋head）並同步更新旁邊的 index.json（月曆索引，GitHub Pages 靜態讀取用）。"""
+    if not manifest_store.is_sharded(manifest): months = None
+    for fp, text in manifest_store.dump_files(path, manifest, months=months):
+        if text is not None: write_text(fp, text, dry=dry)
+        elif dry: p("  [dry] remove", fp)
+        else: fp.unlink(missing_ok=True); p("  [-] remove", fp)
+    index_path = manifest_store.index_path_for(path)
+    base = load_json(index_path) if months is not None else None
+    if months is not None and not base and not dry:
+        manifest, months = manifest_store.load(path), None  # 沒有舊索引可沿用：讀完整 manifest 重算
+    index = manifest_store.calendar_index(manifest, base=base, loaded=months)
+    write_text(index_path, manifest_store.dumps_index(index), dry=dry)
+    write_overview(dry=dry)
+    if not dry: update_search(path.parent.name, manifest, months=months)
+
+def update_search(student: str, manifest: dict, *, months=None):
+    """把這次寫入的內容同步進全文索引（只比對 months；完整比對留給 server 依 manifest mtime 補做）。"""
+    conn = search_index.connect(SEARCH_DB)
+    try: n = search_index.sync_student(conn, DOCS, student, manifest, months=months)
+    finally: conn.close()
+    if n: p(f"  [search] {student}：更新 {n} 筆")
+
+def write_overview(*, dry=False):
+    """docs/overview.json：老師首頁每位學生的摘要（/api/overview 的靜態版，由各自的 index.json 算；不含跟當天日期有關的欄位）。"""
+    with locked(DOCS):  # 與伺服器 _write_overview 相同：算與寫都在鎖內，不會被較舊的結果蓋掉
+        _write_overview(dry=dry)
+
+def _write_overview(*, dry=False):
+    roster = load_json(DOCS / "roster.json", {"students": []})
+    rows = []
+    for stu in roster.get("students") or []:
+        sid = stu.get("id")
+        if not sid: continue
+        path = DOCS / f"students/{sid}/manifest.json"
+        index = load_json(manifest_store.index_path_for(path)) or manifest_store.calendar_index(load_manifest(path))
+        updated = dt.datetime.fromtimestamp(path.stat().st_mtime).isoformat(timespec="seconds") if path.exists() else None
+        rows.append({"id": sid, "name": stu.get("name") or sid, "updated": updated, **manifest_store.overview_row(index)})
+    overview = {"students": rows}
+    write_text(DOCS / "overview.json", json.dumps(overview, ensure_ascii=False, separators=manifest_store.COMPACT_SEPARATORS), dry=dry)
+
+# ------------------------ backups ------------------------
+_backed_up = set()  # 本次 CLI 執行已備份過的 manifest（一次執行只備份一次）
+
+def _backup_dir(path: Path) -> Path:
+    try: rel = path.resolve().relative_to(DOCS.resolve())
+    except ValueError: rel = Path(path.name)
+    return BACKUPS / rel.parent
+
+def list_backups(path: Path):
+    """(timestamp, file) 由舊到新；檔名 <stem>-YYYYmmdd-HHMMSS[-n].json.gz（同一秒多份以 -n 排序）"""
+    d = _backup_dir(path)
+    if not d.exists(): return []
+    out = []
+    for f in d.glob(f"{path.stem}-*.json.gz"):
+        m = re.match(rf"^{re.escape(path.stem)}-(\d{{8}}-\d{{6}})(?:-(\d+))?\.json\.gz$", f.name)
+        if m: out.append((dt.datetime.strptime(m.group(1), "%Y%m%d-%H%M%S"), int(m.group(2) or 0), f))
+    return [(ts, f) for ts, _, f in sorted(out)]
+
+def prune_backups(path: Path, *, keep_last=BACKUP_KEEP_LAST, keep_daily=BACKUP_KEEP_DAILY):
+    items = list_backups(path)
+    keep = {f for _, f in items[-keep_last:]}
+    today = dt.date.today()
+    per_day = {}
+    for ts, f in items:  # 由舊到新，同一天後者覆蓋前者 → 留每天最後一份
+        if (today - ts.date()).days < keep_daily: per_day[ts.date()] = f
+    keep |= set(per_day.values())
+    for _, f in items:
+        if f not in keep: f.unlink()
+
 def backup_manifest(path: Path, *, dry=False):
-    if not path.exists(): return
+    if not path.exists() or path in _backed_up: return
+    _backed_up.add(path)
+    raw = path.read_bytes()
+    if manifest_store.is_sharded(json.loads(raw)):  # 分片：備份組好的完整 manifest（含 layout，還原後照樣分片）
+        raw = manifest_store.dumps(manifest_store.load(path)).encode("utf-8")
+    items = list_backups(path)
+    if items and hashlib.sha256(gzip.decompress(items[-1][1].read_bytes())).digest() == hashlib.sha256(raw).digest():
+        p("  [=] backup unchanged", items[-1][1]); return
     ts = dt.datetime.now().strftime("%Y%m%d-%H%M%S")
-    b = path.with_name(f"{path.stem}.backup-{ts}.json")
+    d = _backup_dir(path)
+    b, n = d / f"{path.stem}-{ts}.json.gz", 1
+    while b.exists(): b, n = d / f"{path.stem}-{ts}-{n}.json.gz", n + 1
     if dry: p("  [dry] backup", path, "->", b); return
-    shutil.copy2(path, b); p("  [*] backup", b)
+    ensure_dir(d)
+    b.write_bytes(gzip.compress(raw, mtime=0)); p("  [*] backup", b)
+    prune_backups(path)
+
+def restore_cmd(student: str, at: str|None, *, list_only=False, dry=False):
+    manifest_path = DOCS / f"students/{student}/manifest.json"
+    items = list_backups(manifest_path)
+    if list_only:
+        for ts, f in items: p(f"  {ts:%Y-%m-%d %H:%M:%S}  {f.name}  ({f.stat().st_size:,} bytes)")
+        if not items: p("（沒有備份）")
+        return
+    if not items: raise SystemExit(f"找不到備份：{_backup_dir(manifest_path)}")
+    if not at or at == "latest":
+        target = items[-1]
+    else:
+        # --at 可給 YYYY-MM-DD 或 YYYY-MM-DD[T ]HH:MM[:SS]：取該時間點（含）之前最新的一份
+        try: when = dt.datetime.fromisoformat(at)
+        except ValueError: raise SystemExit("--at 格式：YYYY-MM-DD 或 YYYY-MM-DDTHH:MM[:SS] 或 latest")
+        if len(at) == 10: when = when.replace(hour=23, minute=59, second=59)
+        older = [it for it in items if it[0] <= when]
+        if not older: raise SystemExit(f"{at} 之前沒有備份（最早：{items[0][0]:%Y-%m-%d %H:%M:%S}）")
+        target = older[-1]
+    p(f">>> restore {manifest_path} <- {target[1].name}")
+    with locked(manifest_path.parent):
+        backup_manifest(manifest_path, dry=dry)  # 還原前先備份現況，可再還原回來
+        write_manifest(manifest_path, manifest_store.loads(gzip.decompress(target[1].read_bytes()).decode("utf-8")), dry=dry)
 
 def yymmdd(dtobj: dt.date): return dtobj.strftime("%y%m%d")
 
@@ -116,7 +376,7 @@ INDEX_HTML = """<!DOCTYPE html>
 
       let manifest = { days: {}, courses: {} };
       try {
-        const res = await fetch(`students/${student}/manifest.json?ts=${Date.now()}`, { cache: 'no-store' });
+        const res = await fetch(`students/${student}/manifest.json`, { cache: 'no-cache' });
         if (res.ok) manifest = await res.json();
         else console.warn('讀 manifest 失敗：', res.status);
       } catch (e) { console.warn('讀 manifest 錯誤：', e); }
@@ -238,8 +498,8 @@ const $ = s => document.querySelector(s);
 let manifest = null;
 
 async function fetchManifest(student){
-  const url = `students/${student}/manifest.json?ts=${Date.now()}`;
-  const res = await fetch(url, {cache:'no-store'});
+  const url = `students/${student}/manifest.json`;
+  const res = await fetch(url, {cache:'no-cache'});
   if(!res.ok) throw new Error('HTTP '+res.status);
   return await res.json();
 }
@@ -417,42 +677,60 @@ $('#downloadTpl').addEventListener('click', ()=>{
 </body></html>
 """
 
-MATERIAL_TEMPLATE = """<!doctype html>
-<html lang="zh-Hant">
-<meta charset="utf-8"><meta name="viewport" content="width=device-width,initial-scale=1">
-<meta name="lesson-date" content="{iso_date}">
-<title>{title}</title>
-<script src="https://cdn.tailwindcss.com"></script>
-<body class="bg-gray-100 p-4 sm:p-8">
-<div id="breadcrumb" class="max-w-4xl mx-auto mb-4"></div>
-<script>(function(){{
-  const p = new URLSearchParams(location.search);
-  const student = p.get('student') || 'ray';
-  const meta = document.querySelector('meta[name="lesson-date"]')?.content?.trim();
-  const back = meta
-    ? '../index.html?student=' + student + '&date=' + meta + '#calendar-widget'
-    : '../index.html?student=' + student + '#calendar-widget';
-  document.getElementById('breadcrumb').innerHTML =
-    '<a href="' + back + '" class="text-blue-600 hover:underline">&larr; 返回課程日曆</a>';
-}})();</script>
-<div class="max-w-4xl mx-auto bg-white rounded-2xl shadow p-6">
-  <h1 class="text-2xl font-bold mb-2">{title}</h1>
-  <p class="text-gray-600 mb-6">把 AI 產的內容貼到這裡。</p>
-</div>
-</body></html>
-"""
+# 新教材的內容片段（外殼、樣式、麵包屑由 lesson_layout 共用版型套上）
+MATERIAL_PLACEHOLDER = "<p>把 AI 產的內容貼到這裡。</p>"
 
 README = """# en_class (Project Pages)
 
 - GitHub Pages → Source = `main` / `docs`
 - 學生首頁：`docs/index.html?student=<id>`
 - 後台：`docs/admin.html`（離線匯出版）
-- 每位學生設定：`docs/students/<id>/manifest.json`
+- 每位學生設定：`docs/students/<id>/manifest.json`（磁碟上為精簡 v4：無縮排、課程資料夾內的 path 只存檔名；API 與前端讀取時展開成 v3；要看縮排版：`python build.py export-manifest --student <id>` 或 `/api/data/students/<id>/manifest.json?pretty=1`；舊版有縮排的 manifest 在下次寫入時自動轉成 v4，也可跑 `python build.py migrate-manifest [--dry-run]` 一次全部改寫）
 - 教材/作業檔：`docs/materials/<student>/<course>/...`
+- 月曆索引：`docs/students/<id>/index.json`（每月 bitmap、各類型數量、第一/最後一天；CLI 與伺服器寫 manifest 時同步更新，手動改過可跑 `python build.py index`）；本機 API：`/api/students/<id>/index?month=YYYY-MM`
+- 月份分片（可選）：`python build.py shard --student <id>` 把 days 拆成 `docs/students/<id>/days/YYYY-MM.json`，`manifest.json` 只留 head（courses/types/holidays + months）；CLI 與伺服器只讀寫有變動的月份，`/api/data/students/<id>/manifest.json` 仍回完整 v3；`--off` 合回單一檔
+- 老師首頁摘要：`docs/overview.json`（每位學生總堂數、第一堂、每月上課/作業 bitmap、更新時間；由各自的 index.json 算，寫 manifest 時自動更新，也可跑 `python build.py overview`）；內容與日期無關，上次/下次上課、待完成作業由 `teacher.html` 依瀏覽器當天日期計算，放在 GitHub Pages 上隔天也不會過期；本機 API：`/api/overview`（依 manifest mtime 增量快取）
+- 全文搜尋：`.search.sqlite3`（專案根目錄、不發佈；標題＋HTML 內文，中文以單字＋雙字詞索引）；本機 API：`/api/search?q=<關鍵字>[&student=<id>]`；CLI：`python build.py search <關鍵字>`、重建 `python build.py search-index`（存檔、刪檔、add/batch-add 時自動增量更新）
+- 教材版型：內容存在 `docs/materials/<student>/<course>/<name>.frag.html`（第一行 `<!--lesson {"title","date","kind"}-->`，其後只放內容），頁面外殼與「返回日曆」共用 `docs/assets/lesson.css`、`lesson.js`；同名 `.html` 由後台存檔、add/batch-add 或 `python build.py render` 產生（本機伺服器遇到片段較新時也會即時重產）；舊的整頁教材可跑 `python build.py migrate-layout [--dry-run]` 拆成片段
+- 教材檔去重：add/batch-add 先把內容存進 `docs/.blobs/`（依 sha256 命名、不發佈），檔案系統支援 reflink（btrfs/xfs）時教材與 blob 寫入時才分家，否則一般複製；`--hardlink` 可改用 hardlink 省空間，但教材與 blob 共用同一個 inode，**任何就地修改的編輯器或工具都會同時改到所有共用這份內容的學生**；刪掉教材後 blob 不會自動清，跑 `python build.py gc-blobs [--dry-run]` 回收
+- manifest 備份：`.backups/students/<id>/manifest-<時間>.json.gz`（每次 CLI 執行最多一份，保留最近 20 份 + 近 30 天每天一份）；還原：`python build.py restore --student <id> [--at YYYY-MM-DD|latest] [--list]`
+
+## 本機伺服器（`python server.py`）
+
+- 開發：`python server.py [--host 127.0.0.1] [--port 5000]`（Flask debug + reloader）
+- 正式：`python server.py --serve --workers 4 --threads 8 [--host 0.0.0.0] [--port 5000]`（需 `pip install waitress`；debug 關閉，多個 worker 共用同一個 socket，SIGTERM/Ctrl-C 會先處理完進行中的請求再結束）
+
+- `python build.py precompress`：為 `docs/` 的 HTML/JS/JSON 產生 `.gz`（有裝 `brotli` 再加 `.br`）；伺服器依 `Accept-Encoding` 直接送出（來源改過而未重跑時自動退回原檔）
+- JSON 回應為最小化輸出，瀏覽器送 `Accept-Encoding: gzip` 時直接回預先壓好的 gzip（`Vary: Accept-Encoding`）
+- `/api/data/<path>` 與靜態檔都帶強 ETag（JSON 用內容雜湊，其餘用 mtime+size），並回 `Cache-Control: no-cache`
+- 前端以 `fetch(path, {cache:'no-cache'})` 讀取：瀏覽器自動送 `If-None-Match`，沒變動時只回 `304 Not Modified`
+- 其他客戶端（腳本等）也請改送 `If-None-Match: <上次的 ETag>`，不要再加 `?ts=` 破快取
+- 寫入（`/api/save`、`/api/manifest/<id>/patch`）一律「暫存檔 + `os.replace`」原子替換；body 帶 `"fsync": true`（或 `?fsync=1`）會先 fsync 再回應
+- 寫入時帶 `If-Match: <ETag>` 做樂觀鎖：檔案已被別處改過會回 `409` 與目前的 ETag，請重新載入後再送
+- 批次寫入：`POST /api/batch` 帶 `{"ops":[{"op":"save","path","content"},{"op":"delete","path"},{"op":"patch","student","ops":[…]}]}`，依序執行、全部成功或全部不寫：先在鎖內驗證每一筆（可各帶 `if_match`，patch 會看到前面 op 的結果）才動檔案，寫到一半失敗會把碰過的檔案還原；回應逐筆列出結果與新的 ETag。後台刪除項目、儲存教材（片段＋複製＋刪舊檔＋manifest）都只送一個請求
+- 即時同步：`/api/events?student=<id>`（Server-Sent Events）；存檔/patch/刪除時立即推送，另有每秒檢查 manifest mtime 的輪詢（只看有人訂閱的學生）抓到 CLI、手動或其他 worker 的修改。事件帶新的 rev（ETag）、變動的 date/course/type 與新內容、受影響月份的 bitmap，後台與月曆頁就地更新不重抓整份 manifest；斷線重連帶 `Last-Event-ID` 會補送，補不到時依 rev 判斷是否重新讀取。每條連線佔一個 waitress 執行緒，`--serve` 時最多開執行緒數的一半，單次連線 5 分鐘後由瀏覽器自動重連
+- 量測：`/api/metrics`（Prometheus text format：各 endpoint 請求數、延遲 histogram、收送 bytes，read/parse/dump/gzip/write/render/index/search 各階段耗時，json/index/render 快取命中；`--workers N` 時每個 worker 各自計數）；每個回應帶 `Server-Timing` 標頭（瀏覽器 DevTools 可看各階段）
+- 慢請求記錄（可選）：`python server.py --slow-ms 200 [--slow-log-dir .slow_requests]` 會以 cProfile 量每個請求，超過門檻的寫進 `.slow_requests/slow.log`（各階段耗時＋前 25 名函式）並另存 `.prof`（`python -m pstats <檔案>` 可再分析）
+
+## 效能基準（`bench/`）
+
+- `python bench/bench.py run [--scale small|medium|large] [--repeat 20] [--only server,build,zip] --out result.json`：在暫存資料夾產生合成資料集（10/100/1000 位學生 × 1/2/3 年，`--students`/`--years` 可覆寫），量測 `/api/data`、`/api/save`（Flask test client）、`build.py add`/`batch-add`、`ai_zipper.zip_project`，輸出每個案例的 min/median/p95（ms）
+- 比較：`python bench/bench.py compare base.json new.json`，或 `run --baseline base.json`；median 變慢超過 `--threshold`（預設 15%）時 exit 1
+
+## 測試（`tests/`）
+
+- `python -m pytest -q`：manifest 精簡/展開、月曆索引、JSON Patch、`/api/batch`（含寫到一半失敗的還原）、`batch-add`（含日期/目的檔重複）；server/build 的 `docs/` 都指向暫存資料夾，不會動到版控裡的資料
 """
 
 GITIGNORE = """__pycache__/
 *.backup-*.json
+/.backups/
+/docs/.blobs/
+/docs/**/*.gz
+/docs/**/*.br
+/.search.sqlite3*
+/.slow_requests/
+.*.tmp
 """
 
 # ------------------------ core ops ------------------------
@@ -470,9 +748,13 @@ def init_cmd(student: str, *, dry=False):
 
 def new_student_cmd(student: str, create_samples=False, *, dry=False):
     manifest_path = DOCS / f"students/{student}/manifest.json"
-    if manifest_path.exists() and not dry:
-        p("  [=] already exists:", manifest_path)
-        return
+    with locked(manifest_path.parent):
+        if manifest_path.exists() and not dry:
+            p("  [=] already exists:", manifest_path)
+            return
+        _new_student_manifest(manifest_path, student, create_samples, dry=dry)
+
+def _new_student_manifest(manifest_path: Path, student: str, create_samples: bool, *, dry=False):
     today = dt.date.today()
     d0 = today.strftime("%Y-%m-%d")
     d1 = (today - dt.timedelta(days=7)).strftime("%Y-%m-%d")
@@ -489,7 +771,7 @@ def new_student_cmd(student: str, create_samples=False, *, dry=False):
             d1: {}
         }
     }
-    write_text(manifest_path, json.dumps(data, ensure_ascii=False, indent=2), dry=dry)
+    write_manifest(manifest_path, data, dry=dry)
 
     if create_samples:
         # create sample HTMLs for today
@@ -497,8 +779,21 @@ def new_student_cmd(student: str, create_samples=False, *, dry=False):
             add_cmd(student=student, course=course, date=d0, typ="material", fmt="html",
                     src=None, title=f"{data['courses'][course]['label']}教材（樣板）", dry=dry)
 
-def add_cmd(*, student: str, course: str, date: str, typ: str, fmt: str,
-            src: str|None, title: str|None=None, external_url: str|None=None, dry=False):
+def _material_dir(student: str, course: str) -> Path:
+    return DOCS / f"materials/{student}/{course}"
+
+def _manifest_dir(student: str) -> Path:
+    return DOCS / f"students/{student}"
+
+def _load_student_manifest(student: str, course: str, months=None):
+    manifest_path = DOCS / f"students/{student}/manifest.json"
+    manifest = load_manifest(manifest_path, default={"version":1,"student":student,"courses":{course:{"label":course,"color":"#333"}}, "days":{}},
+                             months=months)
+    return manifest_path, manifest
+
+def apply_entry(manifest: dict, *, student: str, course: str, date: str, typ: str, fmt: str,
+                src: str|None, title: str|None=None, external_url: str|None=None, dry=False, pending=None, hardlink=False):
+    """把一筆教材/作業套進記憶體中的 manifest；pending 為 list 時檔案複製改為收集 (src, dst) 稍後一起做。"""
     assert typ in ("material","homework")
     assert fmt in ("html","pdf","image","link")
     # paths
@@ -506,11 +801,6 @@ def add_cmd(*, student: str, course: str, date: str, typ: str, fmt: str,
     abs_dir = DOCS / rel_dir
     ensure_dir(abs_dir)
 
-    # load & backup manifest
-    manifest_path = DOCS / f"students/{student}/manifest.json"
-    manifest = load_json(manifest_path, default={"version":1,"student":student,"courses":{course:{"label":course,"color":"#333"}}, "days":{}})
-    backup_manifest(manifest_path, dry=dry)
-
     # decide target URL
     if fmt == "link":
         if not external_url:
@@ -529,15 +819,15 @@ def add_cmd(*, student: str, course: str, date: str, typ: str, fmt: str,
                 ext = ".html" if fmt=="html" else (".pdf" if fmt=="pdf" else ".png")
             fname = f"{yyMMdd}{'_hw' if typ=='homework' and fmt!='html' else ''}{ext}" if fmt!="html" else f"{yyMMdd}{suffix}.html"
             dst_path = abs_dir / fname
-            copy_file(Path(src), dst_path, dry=dry)
+            if pending is None: copy_file(Path(src), dst_path, dry=dry, hardlink=hardlink)
+            else: pending.append((Path(src), dst_path))
         else:
             # no src: only allowed for html -> create template
             if fmt != "html":
                 raise SystemExit("未提供 --src，僅支援 format=html 自動產生模板")
             fname = f"{yyMMdd}{'_hw' if typ=='homework' else ''}.html"
             dst_path = abs_dir / fname
-            html = MATERIAL_TEMPLATE.format(iso_date=date, title=title or "教材（樣板）")
-            write_text(dst_path, html, dry=dry)
+            write_lesson(dst_path, {"title": title or "教材（樣板）", "date": date, "kind": "material"}, MATERIAL_PLACEHOLDER, dry=dry)
         url = f"{rel_dir.as_posix()}/{dst_path.name}"
 
     # update manifest
@@ -549,26 +839,263 @@ def add_cmd(*, student: str, course: str, date: str, typ: str, fmt: str,
     node[typ]["format"] = fmt
     node[typ]["url"] = url
 
-    # write manifest
-    write_text(manifest_path, json.dumps(manifest, ensure_ascii=False, indent=2), dry=dry)
-    p("  ==> updated", manifest_path)
-
-def batch_add_cmd(*, student: str, course: str, from_dir: str, dry=False):
+def add_cmd(*, student: str, course: str, date: str, typ: str, fmt: str,
+            src: str|None, title: str|None=None, external_url: str|None=None, dry=False, hardlink=False):
+    # 教材資料夾與 manifest 所在資料夾一起鎖（與伺服器 /api/batch 同順序），讀到寫之間不會被伺服器插隊
+    with locked(_material_dir(student, course), _manifest_dir(student)):
+        # load & backup manifest（分片時只讀/寫該日期所在的月份）
+        months = {date[:7]}
+        manifest_path, manifest = _load_student_manifest(student, course, months)
+        backup_manifest(manifest_path, dry=dry)
+
+        apply_entry(manifest, student=student, course=course, date=date, typ=typ, fmt=fmt,
+                    src=src, title=title, external_url=external_url, dry=dry, hardlink=hardlink)
+
+        # write manifest
+        write_manifest(manifest_path, manifest, months=months, dry=dry)
+        p("  ==> updated", manifest_path)
+
+def copy_files_atomic(pairs, *, jobs=8, dry=False, hardlink=False):
+    """先平行複製到同目錄暫存檔；全部成功才逐一 os.replace 到位，任何一筆失敗就清掉暫存並中止。"""
+    if dry:
+        for src, dst in pairs: p("  [dry] copy", src, "->", dst)
+        return
+    by_dst = {}
+    for src, dst in pairs: by_dst.setdefault(dst, []).append(src)
+    clashes = {dst: srcs for dst, srcs in by_dst.items() if len(srcs) > 1}
+    if clashes:  # 同一個目的檔只能有一個來源：否則誰最後寫入就是誰，且會共用暫存檔
+        for dst, srcs in clashes.items(): p("  [!] 目的檔重複", dst, "←", ", ".join(str(s) for s in srcs))
+        raise SystemExit(f"{len(clashes)} 個目的檔有多個來源，已全部取消（沒有寫入任何檔案）")
+    staged, errors = [], []
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(stage_file, src, dst, hardlink=hardlink) for src, dst in pairs]
+        for pair, fut in zip(pairs, futures):
+            try: staged.append(fut.result() + pair)
+            except Exception as e: errors.append((pair[0], e))
+    if errors:
+        for tmp, *_ in staged:
+            if tmp: tmp.unlink(missing_ok=True)
+        for src, e in errors: p("  [!] copy failed", src, e)
+        raise SystemExit(f"複製失敗 {len(errors)} 筆，已全部取消（manifest 未變更）")
+    counts = {}
+    for tmp, how, src, dst in staged:
+        counts[how] = counts.get(how, 0) + 1
+        if tmp is None: p("  [=] unchanged", dst); continue
+        os.replace(tmp, dst); p(f"  [+] {how}", src, "->", dst)
+    return counts
+
+def batch_add_cmd(*, student: str, course: str, from_dir: str, dry=False, jobs=8, hardlink=False):
+    t0 = time.perf_counter()
     base = Path(from_dir)
     if not base.exists(): raise SystemExit(f"來源資料夾不存在：{base}")
     files = [p for p in base.iterdir() if p.is_file()]
     if not files: p("（來源資料夾沒有檔案）"); return
+
+    # 1) 先解析檔名；讀一次 manifest（分片時只讀用到的月份），全部條目先在記憶體中套用（任何一筆有錯就整批中止，什麼都不寫）
+    entries = []
     for f in sorted(files):
         m = re.match(r"^(\d{6})(?:_hw)?", f.stem, re.IGNORECASE)
         if not m:
             p("  [skip] 檔名未含日期 YYMMDD：", f.name); continue
         date = yyyy_mm_dd_from_yymmdd(m.group(1))
         is_hw = "_hw" in f.stem.lower()
-        ext = f.suffix.lower()
-        fmt = guess_format_from_ext(ext)
-        typ = "homework" if is_hw else "material"
-        p(f"  -> {f.name}  date={date} type={typ} fmt={fmt}")
-        add_cmd(student=student, course=course, date=date, typ=typ, fmt=fmt, src=str(f), dry=dry, title=None)
+        fmt = guess_format_from_ext(f.suffix.lower())
+        entries.append((f, date, "homework" if is_hw else "material", fmt))
+    slots = {}
+    for f, date, typ, _ in entries: slots.setdefault((date, typ), []).append(f.name)
+    clashes = {k: v for k, v in slots.items() if len(v) > 1}
+    if clashes:  # 同一天同類型只有一格（也會寫到同一個目的檔）：整批拒絕，不猜要留哪一個
+        for (date, typ), names in sorted(clashes.items()): p(f"  [!] {date} {typ} 有多個檔案：", ", ".join(names))
+        raise SystemExit(f"{len(clashes)} 個日期/類型重複，請改名或分批加入（什麼都沒寫）")
+    with locked(_material_dir(student, course), _manifest_dir(student)):
+        months = {date[:7] for _, date, _, _ in entries}
+        manifest_path, manifest = _load_student_manifest(student, course, months)
+        pending, added = [], len(entries)
+        for f, date, typ, fmt in entries:
+            p(f"  -> {f.name}  date={date} type={typ} fmt={fmt}")
+            apply_entry(manifest, student=student, course=course, date=date, typ=typ, fmt=fmt,
+                        src=str(f), dry=dry, title=None, pending=pending)
+        t_plan = time.perf_counter()
+
+        # 2) 平行複製檔案（blob store + 暫存檔 + rename，失敗就全部取消；內容沒變的直接略過）
+        counts = copy_files_atomic(pending, jobs=jobs, dry=dry, hardlink=hardlink) or {}
+        t_copy = time.perf_counter()
+
+        # 3) 備份一次、寫一次 manifest
+        if added:
+            backup_manifest(manifest_path, dry=dry)
+            write_manifest(manifest_path, manifest, months=months, dry=dry)
+            p("  ==> updated", manifest_path)
+    t_end = time.perf_counter()
+    p(f"  [time] {added} 筆：規劃 {t_plan-t0:.3f}s · 複製 {len(pending)} 檔 {t_copy-t_plan:.3f}s（jobs={jobs}）"
+      f" · 寫 manifest {t_end-t_copy:.3f}s · 共 {t_end-t0:.3f}s")
+    if counts: p("  [files] " + " · ".join(f"{k} {v}" for k, v in sorted(counts.items())))
+
+def write_assets(*, dry=False):
+    for rel, text in lesson_layout.asset_files().items():
+        path = DOCS / rel
+        if not path.exists() or path.read_text(encoding="utf-8") != text: write_text(path, text, dry=dry)
+
+def write_lesson(page: Path, meta: dict, body: str, *, dry=False):
+    """寫教材片段 x.frag.html，再套共用版型產生 x.html。"""
+    frag_rel = lesson_layout.fragment_for(page.relative_to(DOCS).as_posix())
+    text = lesson_layout.make_fragment(meta, body)
+    write_text(DOCS / frag_rel, text, dry=dry)
+    write_text(page, lesson_layout.render_fragment(text, frag_rel), dry=dry)
+    write_assets(dry=dry)
+
+def render_cmd(*, dry=False):
+    """依片段重新產生所有教材頁（版型改過、或手動改了 .frag.html 之後跑）；內容沒變的頁不動。"""
+    write_assets(dry=dry)
+    done = same = 0
+    for frag in sorted(DOCS.glob(f"materials/**/*{lesson_layout.FRAGMENT_SUFFIX}")):
+        rel = frag.relative_to(DOCS).as_posix()
+        page = DOCS / lesson_layout.page_for(rel)
+        html = lesson_layout.render_fragment(frag.read_text(encoding="utf-8"), rel)
+        if page.exists() and page.read_text(encoding="utf-8") == html: same += 1; continue
+        write_text(page, html, dry=dry); done += 1
+    p(f"  [render] 重新產生 {done} 頁 · 未變 {same} 頁")
+
+def migrate_layout_cmd(*, dry=False):
+    """把舊的自帶整頁外殼的教材拆成片段＋共用版型；認不得的檔案（手貼整頁等）保持原樣。"""
+    done = skipped = 0
+    before = after = 0
+    for page in sorted(DOCS.glob("materials/**/*.html")):
+        rel = page.relative_to(DOCS).as_posix()
+        if lesson_layout.is_fragment(rel) or (DOCS / lesson_layout.fragment_for(rel)).exists(): continue
+        raw = page.read_text(encoding="utf-8")
+        got = lesson_layout.extract_legacy(raw, rel)
+        if got is None:
+            p("  [skip] 認不得的外殼，保持原檔：", page); skipped += 1; continue
+        meta, body = got
+        text = lesson_layout.make_fragment(meta, body)
+        html = lesson_layout.render_fragment(text, lesson_layout.fragment_for(rel))
+        before += len(raw.encode("utf-8")); after += len(html.encode("utf-8"))
+        write_text(DOCS / lesson_layout.fragment_for(rel), text, dry=dry)
+        write_text(page, html, dry=dry)
+        done += 1
+    write_assets(dry=dry)
+    p(f"  [migrate] 轉換 {done} 頁 · 略過 {skipped} 頁 · 頁面 {before:,} → {after:,} bytes（樣式/麵包屑改由 assets/ 共用）")
+
+def migrate_manifest_cmd(student: str|None=None, *, dry=False):
+    """把舊版（v1～v3、有縮排）的 manifest 改寫成磁碟格式精簡 v4；已是 v4 的不動。平常 CLI/伺服器寫入時也會順便轉。"""
+    paths = [DOCS / f"students/{student}/manifest.json"] if student else sorted(DOCS.glob("students/*/manifest.json"))
+    done = same = 0
+    for path in paths:
+        if not path.exists(): raise SystemExit(f"找不到 manifest：{path}")
+        with locked(path.parent):
+            raw = path.read_text(encoding="utf-8")
+            manifest = load_manifest(path)
+            if manifest_store.is_sharded(manifest) or raw == manifest_store.dumps(manifest): same += 1; continue
+            backup_manifest(path, dry=dry)
+            write_manifest(path, manifest, dry=dry)
+            p(f"  [migrate] {path.parent.name}：v{json.loads(raw).get('version')} → v{manifest_store.MANIFEST_VERSION}，"
+              f"{len(raw.encode('utf-8')):,} → {len(manifest_store.dumps(manifest).encode('utf-8')):,} bytes")
+            done += 1
+    p(f"  [migrate] 改寫 {done} 份 · 已是 v4 {same} 份")
+
+def export_manifest_cmd(student: str, out: str|None=None):
+    """把（可能是 v4 精簡格式的）manifest 匯出成縮排好的 v3，方便閱讀或 diff。"""
+    manifest_path = DOCS / f"students/{student}/manifest.json"
+    if not manifest_path.exists(): raise SystemExit(f"找不到 manifest：{manifest_path}")
+    text = manifest_store.dumps(load_manifest(manifest_path), pretty=True)
+    if out: write_text(Path(out), text + "\n")
+    else: sys.stdout.write(text + "\n")
+
+def shard_cmd(student: str, *, off=False, dry=False):
+    """切換 manifest 存放方式：依月份分片（days/YYYY-MM.json + head）或合回單一 manifest.json。"""
+    manifest_path = DOCS / f"students/{student}/manifest.json"
+    if not manifest_path.exists(): raise SystemExit(f"找不到 manifest：{manifest_path}")
+    with locked(manifest_path.parent):
+        manifest = load_manifest(manifest_path)
+        if manifest_store.is_sharded(manifest) != off:
+            p("  [=] 已是", "單一檔案" if off else "月份分片"); return
+        backup_manifest(manifest_path, dry=dry)
+        if off: manifest.pop("layout", None)
+        else: manifest["layout"] = manifest_store.LAYOUT_MONTHLY
+        write_manifest(manifest_path, manifest, dry=dry)
+        if off and not dry:
+            try: manifest_store.shard_dir(manifest_path).rmdir()
+            except OSError: pass
+    p(f"  ==> {student}：{'合併為單一 manifest.json' if off else '已依月份分片'}（{len(manifest.get('days') or {})} 天）")
+
+def search_index_cmd(student: str|None=None):
+    """重建全文索引（預設全部學生）；平常 add/batch-add 與伺服器存檔時會自動增量更新。"""
+    t0 = time.perf_counter()
+    paths = [DOCS / f"students/{student}/manifest.json"] if student else sorted(DOCS.glob("students/*/manifest.json"))
+    conn = search_index.connect(SEARCH_DB)
+    try:
+        for path in paths:
+            if not path.exists(): raise SystemExit(f"找不到 manifest：{path}")
+            st = path.stat()
+            n = search_index.sync_student(conn, DOCS, path.parent.name, load_manifest(path), f"{st.st_mtime_ns:x}-{st.st_size:x}")
+            p(f"  [search] {path.parent.name}：更新 {n} 筆")
+    finally: conn.close()
+    p(f"  [search] {SEARCH_DB} · {time.perf_counter()-t0:.2f}s")
+
+def search_cmd(q: str, student: str|None=None, limit=20):
+    conn = search_index.connect(SEARCH_DB)
+    try: results = search_index.search(conn, q, student=student, limit=limit)
+    finally: conn.close()
+    for r in results: p(f"  {r['date']}  {r['student']}/{r['course']}/{r['type']}  {r['title'] or r['path']}\n      {r['snippet']}")
+    if not results: p("（沒有結果；索引是空的可先跑 search-index）")
+
+def index_cmd(student: str|None=None, *, dry=False):
+    """重建 students/<id>/index.json（手動改過 manifest 或舊資料補產生用）；未指定學生就全部重建。"""
+    paths = [DOCS / f"students/{student}/manifest.json"] if student else sorted(DOCS.glob("students/*/manifest.json"))
+    for path in paths:
+        if not path.exists(): raise SystemExit(f"找不到 manifest：{path}")
+        with locked(path.parent):
+            index = manifest_store.calendar_index(load_manifest(path))
+            write_text(manifest_store.index_path_for(path), manifest_store.dumps_index(index), dry=dry)
+        p(f"  [index] {index['student']}：{index['days']} 天 · {len(index['months'])} 個月 · {index['first']} ~ {index['last']}")
+    write_overview(dry=dry)
+
+PRECOMPRESS_EXTS = (".html", ".htm", ".js", ".json", ".css", ".svg", ".txt")
+
+def _write_sidecar(src: Path, dst: Path, data: bytes):
+    tmp = dst.with_name(f".{dst.name}.tmp")
+    tmp.write_bytes(data); os.replace(tmp, dst)
+    st = src.stat()
+    os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))  # 與來源同 mtime：server 以此判斷是否過期
+
+def precompress_cmd(*, force=False, min_size=256, dry=False):
+    """為 docs/ 下的 HTML/JS/JSON 產生 .gz（與 .br）同名檔，server.py 依 Accept-Encoding 直接送出。"""
+    t0 = time.perf_counter()
+    encoders = [(".gz", lambda b: gzip.compress(b, compresslevel=9, mtime=0))]
+    if brotli is not None: encoders.append((".br", lambda b: brotli.compress(b, quality=11)))
+    else: p("  [i] 未安裝 brotli，只產生 .gz（pip install brotli 可多產 .br）")
+    done = skipped = removed = 0
+    raw_total = out_total = 0
+    for dirpath, dirnames, filenames in os.walk(DOCS):
+        dirnames[:] = [d for d in dirnames if not d.startswith(".")]  # 略過 .blobs 等
+        names = set(filenames)
+        for name in filenames:
+            path = Path(dirpath) / name
+            if name.endswith((".gz", ".br")):
+                if name[:-3] not in names:  # 來源已刪除的孤兒
+                    if dry: p("  [dry] remove", path)
+                    else: path.unlink(); p("  [-] remove", path)
+                    removed += 1
+                continue
+            if not name.lower().endswith(PRECOMPRESS_EXTS): continue
+            st = path.stat()
+            if st.st_size < min_size: continue
+            raw = None
+            for ext, enc in encoders:
+                side = path.with_name(name + ext)
+                if not force and side.exists() and side.stat().st_mtime_ns >= st.st_mtime_ns:
+                    skipped += 1; continue
+                if dry: p("  [dry] write", side); continue
+                raw = raw if raw is not None else path.read_bytes()
+                data = enc(raw)
+                if len(data) >= len(raw):
+                    side.unlink(missing_ok=True); continue  # 壓不小就不留
+                _write_sidecar(path, side, data)
+                done += 1; raw_total += len(raw); out_total += len(data)
+    ratio = f"{raw_total / out_total:.1f}x" if out_total else "-"
+    p(f"  [precompress] 新產生 {done} · 已是最新 {skipped} · 移除孤兒 {removed}"
+      f" · {raw_total:,} → {out_total:,} bytes（{ratio}） · {time.perf_counter()-t0:.2f}s")
 
 # ------------------------ CLI ------------------------
 def main():
@@ -592,14 +1119,65 @@ def main():
     ap_add.add_argument("--src")
     ap_add.add_argument("--external-url")
     ap_add.add_argument("--title")
+    ap_add.add_argument("--hardlink", action="store_true", help=HARDLINK_HELP)
     ap_add.add_argument("--dry-run", action="store_true")
 
     ap_b = sub.add_parser("batch-add", help="批次匯入資料夾（檔名要有 YYMMDD；含 _hw 視為作業）")
     ap_b.add_argument("--student", required=True)
     ap_b.add_argument("--course", required=True)
     ap_b.add_argument("--from-dir", required=True)
+    ap_b.add_argument("--jobs", type=int, default=8, help="平行複製的執行緒數（預設 8）")
+    ap_b.add_argument("--hardlink", action="store_true", help=HARDLINK_HELP)
     ap_b.add_argument("--dry-run", action="store_true")
 
+    ap_gc = sub.add_parser("gc-blobs", help="刪除 docs/.blobs 裡已沒有任何教材使用的內容")
+    ap_gc.add_argument("--dry-run", action="store_true")
+
+    ap_r = sub.add_parser("restore", help="從壓縮備份還原 manifest（預設最新一份）")
+    ap_r.add_argument("--student", required=True)
+    ap_r.add_argument("--at", help="YYYY-MM-DD 或 YYYY-MM-DDTHH:MM[:SS]：還原到該時間點（含）之前最新的備份；latest = 最新")
+    ap_r.add_argument("--list", action="store_true", help="只列出可用備份")
+    ap_r.add_argument("--dry-run", action="store_true")
+
+    ap_x = sub.add_parser("export-manifest", help="匯出縮排好的 v3 manifest（預設輸出到 stdout）")
+    ap_x.add_argument("--student", required=True)
+    ap_x.add_argument("--out")
+
+    ap_pc = sub.add_parser("precompress", help="為 docs/ 的 HTML/JS/JSON 產生 .gz（有 brotli 時再加 .br）")
+    ap_pc.add_argument("--force", action="store_true", help="全部重新壓縮")
+    ap_pc.add_argument("--min-size", type=int, default=256, help="小於此位元組數的檔案略過（預設 256）")
+    ap_pc.add_argument("--dry-run", action="store_true")
+
+    ap_ix = sub.add_parser("index", help="重建月曆索引 students/<id>/index.json（預設全部學生）")
+    ap_ix.add_argument("--student")
+    ap_ix.add_argument("--dry-run", action="store_true")
+
+    ap_ov = sub.add_parser("overview", help="重建老師首頁摘要 docs/overview.json")
+    ap_ov.add_argument("--dry-run", action="store_true")
+
+    ap_sh = sub.add_parser("shard", help="manifest 依月份分片存放（students/<id>/days/YYYY-MM.json）；--off 合回單一檔")
+    ap_sh.add_argument("--student", required=True)
+    ap_sh.add_argument("--off", action="store_true")
+    ap_sh.add_argument("--dry-run", action="store_true")
+
+    ap_si = sub.add_parser("search-index", help="重建全文索引 .search.sqlite3（預設全部學生）")
+    ap_si.add_argument("--student")
+
+    ap_s = sub.add_parser("search", help="全文搜尋教材（標題＋HTML 內文，中文以雙字詞比對）")
+    ap_s.add_argument("q")
+    ap_s.add_argument("--student")
+    ap_s.add_argument("--limit", type=int, default=20)
+
+    ap_rd = sub.add_parser("render", help="依教材片段（*.frag.html）＋共用版型重新產生教材頁")
+    ap_rd.add_argument("--dry-run", action="store_true")
+
+    ap_ml = sub.add_parser("migrate-layout", help="把舊的整頁教材拆成片段＋共用版型（docs/assets/lesson.css|js）")
+    ap_ml.add_argument("--dry-run", action="store_true")
+
+    ap_mm = sub.add_parser("migrate-manifest", help="把舊版有縮排的 manifest 改寫成精簡 v4（預設全部學生）")
+    ap_mm.add_argument("--student")
+    ap_mm.add_argument("--dry-run", action="store_true")
+
     args = ap.parse_args()
 
     if args.cmd == "init":
@@ -608,9 +1186,34 @@ def main():
         new_student_cmd(args.student, dry=args.dry_run)
     elif args.cmd == "add":
         add_cmd(student=args.student, course=args.course, date=args.date, typ=args.typ, fmt=args.fmt,
-                src=args.src, title=args.title, external_url=args.external_url, dry=args.dry_run)
+                src=args.src, title=args.title, external_url=args.external_url, dry=args.dry_run, hardlink=args.hardlink)
     elif args.cmd == "batch-add":
-        batch_add_cmd(student=args.student, course=args.course, from_dir=args.from_dir, dry=args.dry_run)
+        batch_add_cmd(student=args.student, course=args.course, from_dir=args.from_dir, dry=args.dry_run,
+                      jobs=max(1, args.jobs), hardlink=args.hardlink)
+    elif args.cmd == "gc-blobs":
+        gc_blobs_cmd(dry=args.dry_run)
+    elif args.cmd == "export-manifest":
+        export_manifest_cmd(args.student, args.out)
+    elif args.cmd == "precompress":
+        precompress_cmd(force=args.force, min_size=args.min_size, dry=args.dry_run)
+    elif args.cmd == "index":
+        index_cmd(args.student, dry=args.dry_run)
+    elif args.cmd == "overview":
+        write_overview(dry=args.dry_run)
+    elif args.cmd == "search-index":
+        search_index_cmd(args.student)
+    elif args.cmd == "search":
+        search_cmd(args.q, args.student, args.limit)
+    elif args.cmd == "render":
+        render_cmd(dry=args.dry_run)
+    elif args.cmd == "migrate-layout":
+        migrate_layout_cmd(dry=args.dry_run)
+    elif args.cmd == "migrate-manifest":
+        migrate_manifest_cmd(args.student, dry=args.dry_run)
+    elif args.cmd == "shard":
+        shard_cmd(args.student, off=args.off, dry=args.dry_run)
+    elif args.cmd == "restore":
+        restore_cmd(args.student, args.at, list_only=args.list, dry=args.dry_run)
 
 if __name__ == "__main__":
     main()
@@ -11,31 +11,92 @@ function toast(ok, text){
   msg.textContent=text; msg.style.display='block';
   clearTimeout(window.__t); window.__t=setTimeout(()=>msg.style.display='none',3000);
 }
+// 每個 JSON 最後一次讀到/寫入的 ETag；存檔時帶 If-Match，別的分頁/CLI 改過就會收到 409 而不是默默覆蓋
+const etags={};
+// cache:'no-cache'：瀏覽器每次都帶 If-None-Match 重新驗證，內容沒變伺服器回 304（不再用 ?ts= 破快取）
 async function getJSON(path){
   if(isLocal()){
-    try{ const r=await fetch(`/api/data/${path}?ts=${Date.now()}`,{cache:'no-store'}); if(r.ok) return await r.json(); }catch(e){}
+    try{ const r=await fetch(`/api/data/${path}`,{cache:'no-cache'}); if(r.ok){ etags[path]=r.headers.get('ETag'); return await r.json(); } }catch(e){}
   }
-  const r2=await fetch(`${path}?ts=${Date.now()}`,{cache:'no-store'}); if(!r2.ok) throw new Error('HTTP '+r2.status); return await r2.json();
+  const r2=await fetch(path,{cache:'no-cache'}); if(!r2.ok) throw new Error('HTTP '+r2.status); return assembleShards(path, expandManifest(await r2.json()));
+}
+// 月份分片（layout=monthly）的靜態 head：把 days/YYYY-MM.json 組回完整 manifest（本機 API 已組好，不會走到這裡）
+async function assembleShards(path, m){
+  if(!m || m.layout!=='monthly' || !Array.isArray(m.months)) return m;
+  const dir=path.replace(/manifest\.json$/,'days/');
+  const shards=await Promise.all(m.months.map(ym=>fetch(`${dir}${ym}.json`,{cache:'no-cache'}).then(r=>r.ok?r.json():null).catch(()=>null)));
+  m.days={}; shards.forEach(sh=>{ if(sh) Object.assign(m.days, expandManifest(sh).days||{}); });
+  delete m.months; return m;
+}
+async function postJSON(url, payload, etagKey){
+  const headers={'Content-Type':'application/json'};
+  if(etagKey && etags[etagKey]) headers['If-Match']=etags[etagKey];
+  const r=await fetch(url,{method:'POST',headers,body:JSON.stringify(payload)});
+  const j=await r.json();
+  if(r.status===409 && j.etag!==undefined){ toast(false,'資料已在其他分頁或 CLI 被修改，請按「重新載入」後再試'); throw new Error(j.message); }
+  if(!r.ok||j.status!=='success') throw new Error(j.message||('HTTP '+r.status));
+  if(etagKey && r.headers.get('ETag')) etags[etagKey]=r.headers.get('ETag');
+  return j;
 }
 async function getText(path){
   if(isLocal()){
-    try{ const r=await fetch(`/api/data/${path}?ts=${Date.now()}`,{cache:'no-store'}); if(r.ok) return await r.text(); }catch(e){}
+    try{ const r=await fetch(`/api/data/${path}`,{cache:'no-cache'}); if(r.ok) return await r.text(); }catch(e){}
   }
-  const r2=await fetch(`${path}?ts=${Date.now()}`,{cache:'no-store'}); if(!r2.ok) throw new Error('HTTP '+r2.status); return await r2.text();
+  const r2=await fetch(path,{cache:'no-cache'}); if(!r2.ok) throw new Error('HTTP '+r2.status); return await r2.text();
 }
+const ownWrites={};  // 教材頁路徑 -> 本分頁寫入時間（即時同步時不把自己的存檔當成別處的變更）
+const markOwn=(path)=>{ ownWrites[path.replace(/\.frag\.html$/i,'.html')]=Date.now(); };
 async function apiSave(path, content){
   if(!isLocal()) throw new Error('save only available on localhost');
-  const r=await fetch('/api/save',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({path,content})});
-  const j=await r.json(); if(!r.ok||j.status!=='success') throw new Error(j.message||('HTTP '+r.status)); return j;
+  markOwn(path);
+  return postJSON('/api/save', {path,content}, /\.json$/i.test(path) ? path : null);
 }
-async function apiDelete(path){
-  if(!isLocal()) throw new Error('delete only available on localhost');
-  const r=await fetch('/api/delete',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({path})});
-  const j=await r.json(); if(!r.ok||j.status!=='success') throw new Error(j.message||('HTTP '+r.status)); return j;
+// 只送變動的部分（RFC 6902 JSON Patch），不再每次 POST 整份 manifest
+async function apiPatch(ops){
+  if(!isLocal()) throw new Error('save only available on localhost');
+  return postJSON(`/api/manifest/${encodeURIComponent(stu)}/patch`, {ops}, `students/${stu}/manifest.json`);
 }
-
-// 讀檔時：note 只回純文字；其他回 container(去掉h1)的HTML
+const ptr=(...keys)=>keys.map(k=>'/'+String(k).replace(/~/g,'~0').replace(/\//g,'~1')).join('');
+// 以「單日」為單位：該日還有資料就整日覆寫（add 對既有 key 即取代），已被清空就移除
+function dayPatch(date){
+  return manifest.days?.[date] ? {op:'add', path:ptr('days',date), value:manifest.days[date]} : {op:'remove', path:ptr('days',date)};
+}
+// 多個動作一次送出（/api/batch）：依序執行、全部成功或全部不做；patch 預設針對目前學生並帶 If-Match
+const isLocalPath=(path)=>!!path && !/^[a-z][a-z0-9+.-]*:|^\/\//i.test(path);
+async function apiBatch(ops){
+  if(!isLocal()) throw new Error('save only available on localhost');
+  const key=`students/${stu}/manifest.json`;
+  ops=ops.map(op=>op.op==='patch' ? {student: stu, if_match: etags[key], ...op} : op);
+  ops.forEach(op=>{ if(op.path) markOwn(op.path); });
+  const j=await postJSON('/api/batch', {ops});
+  j.results.forEach(r=>{ if(r.etag && r.path===key) etags[key]=`"${r.etag}"`; });
+  return j;
+}
+
+// 教材片段：x.html 的內容存在 x.frag.html（第一行 <!--lesson {...}--> ），外殼由伺服器套共用版型產生
+const fragOf = (path) => path.replace(/\.html$/i, '.frag.html');
+const FRAG_HEADER = /^\s*<!--lesson [\s\S]*?-->\n?/;
+const lessonHeader = (meta) => `<!--lesson ${JSON.stringify(meta).replace(/-->/g,'--\\u003e')}-->\n`;
+async function getFragment(path){
+  if(!/\.html$/i.test(path)) return null;
+  try{ return await getText(fragOf(path)); }catch(e){ return null; }
+}
+// 複製/搬移教材（回傳 batch 的 save 動作）：有片段就複製片段（改寫日期/標題後由伺服器重新產生頁面），舊的整頁檔原樣複製
+async function copyLessonOp(from, to, meta){
+  const frag = /\.html$/i.test(to) ? await getFragment(from) : null;
+  if(frag!==null) return {op:'save', path:fragOf(to), content:frag.replace(FRAG_HEADER, lessonHeader(meta))};
+  return {op:'save', path:to, content:await getText(from)};
+}
+
+// 讀檔時：note 只回純文字；其他回 container(去掉h1)的HTML（有片段就直接讀片段）
 async function loadSnippet(path, type){
+  const frag = await getFragment(path);
+  if (frag !== null) {
+    const body = frag.replace(FRAG_HEADER, '');
+    if (type !== 'note') return body.trim();
+    const note = new DOMParser().parseFromString(body, 'text/html').querySelector('.note');
+    return note ? (note.textContent || '').trim() : '';
+  }
   const raw = await getText(path);
   const doc = new DOMParser().parseFromString(raw, 'text/html');
   if (type === 'note') {
@@ -245,14 +306,16 @@ function renderTypeChips(){
       const ok = confirm(`確認刪除這個類型嗎？\n\nKey：${k}\n顯示名稱：${label}\n\n僅當此類型沒有任何使用紀錄時才可刪除。\n此操作無法復原！`);
       if(!ok) return;
       delete manifest.types[k];
+      const ops=[{op:'remove', path:ptr('types',k)}];
       Object.keys(manifest.days||{}).forEach(d=>{
         Object.keys(manifest.days[d]||{}).forEach(c=>{
           if(manifest.days[d][c] && manifest.days[d][c][k] && manifest.days[d][c][k].length===0){
             delete manifest.days[d][c][k];
+            ops.push({op:'remove', path:ptr('days',d,c,k)});
           }
         });
       });
-      await apiSave(`students/${stu}/manifest.json`, manifest);
+      await apiPatch(ops);
       renderCourseType(); renderTypeChips();
       toast(true,'已刪除類型：'+k);
     };
@@ -330,8 +393,11 @@ function renderList(){
             if (!confirm(msg)) return;
             const arr=manifest.days[d][course][type];
             const [removed]=arr.splice(idx,1); removeEmpty(d,course,type);
-            await apiSave(`students/${stu}/manifest.json`, manifest);
-            if(removed?.path){ try{ await apiDelete(removed.path); } catch(e){ toast(false,'刪檔失敗：'+(e.message||e)); } }
+            // manifest 與檔案一起刪（同一個請求，不會只刪一半）
+            const ops=[{op:'patch', ops:[dayPatch(d)]}];
+            if(isLocalPath(removed?.path)) ops.push({op:'delete', path:removed.path});
+            try{ await apiBatch(ops); }
+            catch(e){ toast(false,'刪除失敗：'+(e.message||e)); return refreshManifest(); }
             renderList();
             if (editingRef && removed?.path === editingRef.path) { clearForm(); toast(true,'已刪除（含 HTML 檔），並已退出編輯'); }
             else { toast(true,'已刪除（含 HTML 檔）'); }
@@ -354,6 +420,7 @@ async function loadRoster(){
 }
 async function loadManifest(){
   editingRef = null;
+  watchStudent();  // 先訂閱再讀：讀取期間的變更也不會漏掉
   manifest=await getJSON(`students/${stu}/manifest.json`); ensureBase();
   renderCourseType(); setDefaultDateFocus(); 
   filterMode='day'; range=null; // ← 切學生回到單日
@@ -361,14 +428,55 @@ async function loadManifest(){
   wireCalendarLink(); updateEditUI();
 }
 
+// ------- 即時同步（本機 /api/events）：別的分頁或 CLI 改了同一位學生，只套用有變動的日期 -------
+let events=null;
+const revOf=t=>(t||'').replace(/-gz"$/,'"');  // gzip 版的 ETag 多了 -gz
+async function refreshManifest(){
+  manifest=await getJSON(`students/${stu}/manifest.json`); ensureBase();
+  renderCourseType(); renderList(); renderTypeChips();
+}
+function applyManifestEvent(d){
+  const key=`students/${stu}/manifest.json`;
+  if(!manifest || d.student!==stu || revOf(etags[key])===revOf(d.rev)) return;  // 自己剛存的或已是最新
+  if(d.full) return refreshManifest();
+  (d.changes||[]).forEach(({date,course,type,items})=>{
+    if(items==null){ if(manifest.days[date]?.[course]){ delete manifest.days[date][course][type]; removeEmpty(date,course,type); } }
+    else ((manifest.days[date] ??= {})[course] ??= {})[type]=items;
+  });
+  if(d.holidays) manifest.holidays=d.holidays;
+  etags[key]=d.rev;
+  renderList(); renderTypeChips();
+  toast(true,'已同步其他分頁/CLI 的變更');
+}
+function watchStudent(){
+  if(events) events.close();
+  events=null;
+  if(!isLocal() || !window.EventSource || !stu) return;
+  const key=`students/${stu}/manifest.json`;
+  events=new EventSource(`/api/events?student=${encodeURIComponent(stu)}`);
+  events.addEventListener('hello', e=>{
+    const d=JSON.parse(e.data);
+    if(!d.resumed && manifest && etags[key] && revOf(etags[key])!==revOf(d.rev)) refreshManifest();  // 斷線期間漏掉的
+  });
+  events.addEventListener('manifest', e=>applyManifestEvent(JSON.parse(e.data)));
+  events.addEventListener('file', e=>{
+    const d=JSON.parse(e.data);
+    if(Date.now()-(ownWrites[d.path]||0) < 5000) return;
+    if(editingRef && editingRef.path===d.path) toast(false, d.deleted ? '正在編輯的檔案已在別處被刪除' : '正在編輯的檔案已在別處更新，可按「重載目前教材」');
+  });
+}
+
 async function toggleHolidayForCurrentDate(){
   if (filterMode !== 'day') return toast(false,'請切回「單日」模式（點日期或按「今天」）後再設定放假。');
   const d = q('#filterDate').value || q('#date').value; if(!d) return toast(false,'請先選日期');
   manifest.holidays = Array.isArray(manifest.holidays) ? manifest.holidays : [];
   const i = manifest.holidays.indexOf(d);
+  const ops = i === -1
+    ? [{op:'add', path:ptr('holidays','-'), value:d}]
+    : [{op:'test', path:ptr('holidays',i), value:d}, {op:'remove', path:ptr('holidays',i)}];
+  await apiPatch(ops);
   if (i === -1) { manifest.holidays.push(d); toast(true, `已標記放假：${d}`); }
   else { manifest.holidays.splice(i,1); toast(true, `已取消放假：${d}`); }
-  await apiSave(`students/${stu}/manifest.json`, manifest);
   renderList(); wireCalendarLink();
 }
 
@@ -403,41 +511,17 @@ async function doSave(){
   const html=(q('#html').value||'').trim();
   const fromEdit = !!editingRef;
   if (!html && !fromEdit) {return toast(false, '沒有內容：請先輸入內容，或從列表點「編輯」再儲存');}
+  const kind = type === 'note' ? 'note' : 'material';
+  const batch = [];  // 檔案與 manifest 一起送出（/api/batch）
   if(html){
-    let wrap;
+    let body = html;
     if (type === 'note') {
       // 轉義 + 保留換行（靠 CSS）
       const esc = s => s.replace(/[&<>]/g, c => ({'&':'&amp;','<':'&lt;','>':'&gt;'}[c]));
-      const safeNote = esc(html);
-      wrap = `<!doctype html><html lang="zh-Hant"><head><meta charset="utf-8"/>
-      <meta name="viewport" content="width=device-width,initial-scale=1"/>
-      <title>${title||'提醒'}</title>
-      <style>
-        :root{--ink:#111827;--muted:#6b7280;--bg:#fff1f2;--card:#fff;--pink:#ec4899;}
-        body{font-family:system-ui,"Noto Sans TC",Arial,sans-serif;margin:0;background:var(--bg);color:var(--ink);}
-        .header{background:#111827;color:#fff;padding:10px 14px;}
-        .header a{color:#f9a8d4;text-decoration:none}
-        .container{max-width:800px;margin:18px auto;background:var(--card);border-radius:14px;padding:18px 20px;box-shadow:0 10px 30px rgba(0,0,0,.06);border:1px dashed #fbcfe8}
-        .tag{display:inline-flex;gap:6px;align-items:center;background:#fdf2f8;color:#9d174d;border:1px solid #fbcfe8;border-radius:999px;padding:4px 8px;font-size:12px;margin-bottom:8px}
-        .note{font-size:16px;line-height:1.7; white-space: pre-wrap;}
-      </style>
-      </head><body>
-      <div class="header">← <a href="../../../index.html?student=${encodeURIComponent(stu)}&date=${encodeURIComponent(date)}">返回日曆</a></div>
-      <div class="container">
-        <div class="tag">📌 提醒</div>
-        <h1 style="margin:6px 0 12px">${title||'提醒'}</h1>
-        <div class="note">${safeNote }</div>
-      </div></body></html>`;
-    } else {
-      wrap =`<!doctype html><html lang="zh-Hant"><head><meta charset="utf-8"/><meta name="viewport" content="width=device-width,initial-scale=1"/>
-      <title>${title||''}</title>
-      <style>body{font-family:system-ui,"Noto Sans TC",Arial,sans-serif;margin:0;background:#f6f7fb;} .header{background:#111827;color:#fff;padding:10px 14px;} .header a{color:#a7f3d0;text-decoration:none} .container{max-width:900px;margin:18px auto;background:#fff;border-radius:12px;padding:18px 20px;box-shadow:0 10px 30px rgba(0,0,0,.06)}</style>
-      </head><body>
-      <div class="header">← <a href="../../../index.html?student=${encodeURIComponent(stu)}&date=${encodeURIComponent(date)}">返回日曆</a></div>
-      <div class="container"><h1>${title||''}</h1>${html}</div>
-      </body></html>`;
+      body = `<div class="note">${esc(html)}</div>`;
     }
-    await apiSave(rel, wrap);
+    // 只存內容片段；伺服器套共用版型（docs/assets/lesson.css、lesson.js）寫出 ${rel}
+    batch.push({op:'save', path:fragOf(rel), content:lessonHeader({title, date, kind}) + body + '\n'});
   }
   const changedKeys = editingRef && (editingRef.date!==date || editingRef.course!==course || editingRef.type!==type || editingRef.path!==rel);
   let doMove = false;
@@ -445,7 +529,7 @@ async function doSave(){
     doMove = confirm('偵測到你變更了日期/課程/類型或檔名。\n按「確定」：搬移/覆蓋原項目到新位置（原項目會被移除）。\n按「取消」：保留原項目，另外新增一筆。');
     if (!doMove) {
       if (fromEdit && !html && editingRef?.path && editingRef.path !== rel) {
-        try { const raw = await getText(editingRef.path); await apiSave(rel, raw); }
+        try { batch.push(await copyLessonOp(editingRef.path, rel, {title, date, kind})); }
         catch (e) { return toast(false, '建立新副本失敗：' + (e.message || e)); }
       }
       editingRef = null;
@@ -453,16 +537,20 @@ async function doSave(){
   }
   if (doMove) {
     if (editingRef.path && editingRef.path !== rel && !html) {
-      try { const raw = await getText(editingRef.path); await apiSave(rel, raw); }
-      catch (e) { toast(false, '搬移時建立新檔失敗：' + (e.message || e)); }
+      try { batch.push(await copyLessonOp(editingRef.path, rel, {title, date, kind})); }
+      catch (e) { return toast(false, '搬移時讀取原檔失敗：' + (e.message || e)); }
     }
     const oldArr = manifest.days?.[editingRef.date]?.[editingRef.course]?.[editingRef.type];
     if (Array.isArray(oldArr)) { const i = oldArr.findIndex(x => x.path === editingRef.path); if (i >= 0) oldArr.splice(i, 1); removeEmpty(editingRef.date, editingRef.course, editingRef.type); }
-    if (editingRef.path && editingRef.path !== rel) { try { await apiDelete(editingRef.path); } catch(e) { toast(false, '刪除舊檔失敗：'+(e.message||e)); } }
+    if (isLocalPath(editingRef.path) && editingRef.path !== rel) batch.push({op:'delete', path:editingRef.path});
   }
   const arr=ensureArr(date,course,type);
   const exists=arr.find(x=>x.path===rel); if(exists){ exists.title=title; } else { arr.push({title, path: rel}); }
-  await apiSave(`students/${stu}/manifest.json`, manifest);
+  const ops = [dayPatch(date)];
+  if (doMove && editingRef.date !== date) ops.unshift(dayPatch(editingRef.date));
+  batch.push({op:'patch', ops});
+  try { await apiBatch(batch); }
+  catch (e) { toast(false, '儲存失敗（全部未寫入）：' + (e.message || e)); return refreshManifest(); }
   if(!q('#keepForm').checked){ q('#title').value=''; q('#filename').value=''; q('#html').value=''; }
   const onlyMetaUpdate = fromEdit && !html && !changedKeys && !doMove;
   editingRef = null; updateEditUI(); 
@@ -498,7 +586,7 @@ async function addOrUpdateType(){
   const label=(q('#newTypeLabel').value||'').trim();
   if(!/^[a-z0-9_-]{2,}$/.test(key)) return toast(false,'請用小寫英數與 _- 當作 key（至少 2 字）');
   manifest.types[key] = label || key;
-  await apiSave(`students/${stu}/manifest.json`, manifest);
+  await apiPatch([{op:'add', path:ptr('types',key), value:manifest.types[key]}]);
   renderCourseType(); renderTypeChips();
   toast(true, `已 ${label?'更新':'新增'} 類型：${key}`);
   q('#newTypeKey').value=''; q('#newTypeLabel').value='';
@@ -0,0 +1,11 @@
+// 共用麵包屑：依 <body data-student data-date> 產生「返回日曆」（index.html 位置由本檔網址推算）
+(function(){
+  var b=document.body, nav=document.querySelector('.lesson-header');
+  if(!nav) return;
+  var student=b.dataset.student||new URLSearchParams(location.search).get('student')||'';
+  var home=new URL('../index.html', document.currentScript.src);
+  if(student) home.searchParams.set('student', student);
+  if(b.dataset.date) home.searchParams.set('date', b.dataset.date);
+  var a=document.createElement('a'); a.href=home.href; a.textContent='返回日曆';
+  nav.textContent='← '; nav.appendChild(a);
+})();
@@ -0,0 +1,9 @@
+// manifest 共用規則（index.html、admin.js 都載入；與 manifest_store.py 的 expand() 同一套）
+// v4（磁碟精簡格式）→ v3：path 只存檔名時補回 materials/<student>/<course>/（本機 API 已展開，這裡給 GitHub Pages 靜態讀取用）
+function expandManifest(m){
+  if(!m || m.version!==4) return m;
+  Object.values(m.days||{}).forEach(perDate=>Object.entries(perDate||{}).forEach(([c,perCourse])=>Object.values(perCourse||{}).forEach(arr=>{
+    if(Array.isArray(arr)) arr.forEach(it=>{ if(it && typeof it.path==='string' && !it.path.includes('/')) it.path=`materials/${m.student}/${c}/${it.path}`; });
+  })));
+  m.version=3; return m;
+}
@@ -0,0 +1,109 @@
+# lesson_layout.py
+"""
+教材頁共用版型（server.py 與 build.py 共用，只用標準函式庫）
+
+- 片段（fragment）：materials/<student>/<course>/<name>.frag.html，
+  第一行是 <!--lesson {"title":…,"date":"YYYY-MM-DD","kind":"material|note"}--> ，其後是內容 HTML
+- 成品頁：同名 .html，由 render() 套上共用版型；樣式與「返回日曆」麵包屑放在
+  docs/assets/lesson.css、docs/assets/lesson.js（直接編輯這兩個檔，版本號依內容自動變），只下載一次、各頁共用快取
+- extract_legacy()：把舊的自帶整頁外殼的教材（後台 doSave 產生的教材/提醒、build.py 樣板）拆回片段，給 migrate-layout 用
+"""
+from __future__ import annotations
+import hashlib, html, json, re
+from pathlib import Path
+from string import Template
+
+FRAGMENT_SUFFIX = ".frag.html"
+ASSETS_DIR = "assets"
+
+# 唯一來源是版控裡的 docs/assets/lesson.css、lesson.js（GitHub Pages 直接用這兩個檔）；這裡讀進來算版本、給 build/server 檢查或補寫
+ASSETS_SRC = Path(__file__).resolve().parent / "docs" / ASSETS_DIR
+LESSON_CSS = (ASSETS_SRC / "lesson.css").read_text(encoding="utf-8")
+LESSON_JS = (ASSETS_SRC / "lesson.js").read_text(encoding="utf-8")
+
+# 內容一變網址就變：資產可以放心長期快取
+ASSET_VERSION = hashlib.blake2b((LESSON_CSS + LESSON_JS).encode("utf-8"), digest_size=4).hexdigest()
+
+_LAYOUT = Template("""<!doctype html><html lang="zh-Hant"><head><meta charset="utf-8"/><meta name="viewport" content="width=device-width,initial-scale=1"/>
+<title>$title</title>
+<link rel="stylesheet" href="${assets}lesson.css?v=$version"/>
+<script src="${assets}lesson.js?v=$version" defer></script>
+</head><body class="lesson lesson-$kind" data-student="$student" data-date="$date">
+<nav class="lesson-header"></nav>
+<main class="container">$tag<h1>$title</h1>
+$body
+</main>
+</body></html>
+""")
+_NOTE_TAG = '<div class="tag">📌 提醒</div>\n'
+_HEADER = re.compile(r"\A\s*<!--lesson (\{.*?\})-->\n?", re.S)
+
+def asset_files() -> dict:
+    """docs/ 底下的相對路徑 → 內容"""
+    return {f"{ASSETS_DIR}/lesson.css": LESSON_CSS, f"{ASSETS_DIR}/lesson.js": LESSON_JS}
+
+def fragment_for(page_rel: str) -> str:
+    return page_rel[:-len(".html")] + FRAGMENT_SUFFIX
+
+def page_for(fragment_rel: str) -> str:
+    return fragment_rel[:-len(FRAGMENT_SUFFIX)] + ".html"
+
+def is_fragment(rel: str) -> bool:
+    return rel.endswith(FRAGMENT_SUFFIX)
+
+def make_fragment(meta: dict, body: str) -> str:
+    header = json.dumps(meta, ensure_ascii=False).replace("-->", "--\\u003e")  # 不能提早結束註解
+    return f"<!--lesson {header}-->\n{body.strip()}\n"
+
+def parse_fragment(text: str) -> tuple[dict, str]:
+    m = _HEADER.match(text)
+    if not m: return {}, text
+    try: meta = json.loads(m.group(1))
+    except ValueError: meta = {}
+    return meta, text[m.end():]
+
+def render(meta: dict, body: str, rel_path: str) -> str:
+    """rel_path：成品頁相對於 docs/ 的路徑（決定 assets 的相對位置與學生 id）。"""
+    parts = rel_path.split("/")
+    student = meta.get("student") or (parts[1] if len(parts) > 2 and parts[0] == "materials" else "")
+    kind = "note" if meta.get("kind") == "note" else "material"
+    return _LAYOUT.substitute(
+        title=html.escape(meta.get("title") or ("提醒" if kind == "note" else "")),
+        assets="../" * (len(parts) - 1) + ASSETS_DIR + "/",
+        version=ASSET_VERSION,
+        kind=kind,
+        student=html.escape(student),
+        date=html.escape(meta.get("date") or ""),
+        tag=_NOTE_TAG if kind == "note" else "",
+        body=body.strip(),
+    )
+
+def render_fragment(text: str, fragment_rel: str) -> str:
+    meta, body = parse_fragment(text)
+    return render(meta, body, page_for(fragment_rel))
+
+# ---- 舊格式（自帶整頁外殼）→ 片段 ----
+_DATE_IN_HREF = re.compile(r"[?&]date=(\d{4}-\d{2}-\d{2})")
+_TAG = re.compile(r"<[^>]*>")
+_LEGACY = (
+    # 後台 doSave：提醒
+    ("note", re.compile(r'<div class="tag">📌 提醒</div>\s*<h1[^>]*>(?P<title>.*?)</h1>\s*(?P<body><div class="note">.*</div>)\s*</div>\s*</body>\s*</html>\s*\Z', re.S)),
+    # 後台 doSave：教材/作業
+    ("material", re.compile(r'<div class="container"><h1>(?P<title>.*?)</h1>(?P<body>.*)</div>\s*</body>\s*</html>\s*\Z', re.S)),
+    # build.py MATERIAL_TEMPLATE
+    ("material", re.compile(r'<div class="max-w-4xl mx-auto bg-white rounded-2xl shadow p-6">\s*<h1[^>]*>(?P<title>.*?)</h1>(?P<body>.*)</div>\s*</body>\s*</html>\s*\Z', re.S)),
+)
+
+def extract_legacy(text: str, page_rel: str) -> tuple[dict, str] | None:
+    """認得的舊外殼回傳 (meta, body)；認不得（手貼的整頁等）回傳 None，保持原檔。"""
+    for kind, pattern in _LEGACY:
+        m = pattern.search(text)
+        if not m: continue
+        date = _DATE_IN_HREF.search(text) or re.search(r'name="lesson-date" content="(\d{4}-\d{2}-\d{2})"', text)
+        if not date:
+            date = re.match(r"(\d{4}-\d{2}-\d{2})", page_rel.rsplit("/", 1)[-1])
+        # meta 的 title 是純文字（render 時會 escape）：先去掉標籤再解開實體，<b>x</b> 不會變成字面的「<b>x</b>」
+        title = html.unescape(_TAG.sub("", m.group("title")))
+        meta = {"title": " ".join(title.split()), "date": date.group(1) if date else "", "kind": kind}
+        return meta, m.group("body")
+    return None
@@ -0,0 +1,235 @@
+# manifest_store.py
+"""
+Manifest 讀寫格式（server.py 與 build.py 共用，只用標準函式庫）
+
+- v3：前端（docs/admin.js、docs/index.html）使用的形狀，
+  days[date][course][type] = [{title, path:"materials/<student>/<course>/<file>"}]
+- v4：磁碟上的精簡格式，結構同 v3，但 path 若位於該課程資料夾就只存檔名，
+  並以最小分隔字元輸出（無縮排）
+- index：月曆用的精簡索引（students/<id>/index.json 與 /api/students/<id>/index），
+  months["YYYY-MM"] = {content, note, holiday, homework} bitmap（第 d 天 = bit d-1）＋該月各類型數量，
+  另含總數與第一/最後一天，前端不必下載整份 manifest 就能畫月曆
+- 分片（可選，layout="monthly"）：manifest.json 只留 head，days 依月份放在 days/YYYY-MM.json
+"""
+from __future__ import annotations
+import datetime as dt, json
+
+MANIFEST_VERSION = 4
+INDEX_VERSION = 1
+COMPACT_SEPARATORS = (",", ":")
+
+def course_prefix(student: str, course: str) -> str:
+    return f"materials/{student}/{course}/"
+
+def _map_paths(manifest: dict, fn) -> dict:
+    """Copy of manifest with fn(course, path) applied to every days[*][course][type][*].path."""
+    days = {}
+    for date, per_date in (manifest.get("days") or {}).items():
+        if not isinstance(per_date, dict):
+            days[date] = per_date; continue
+        new_date = {}
+        for course, per_course in per_date.items():
+            if not isinstance(per_course, dict):
+                new_date[course] = per_course; continue
+            new_course = {}
+            for typ, items in per_course.items():
+                if isinstance(items, list):
+                    items = [
+                        {**it, "path": fn(course, it["path"])} if isinstance(it, dict) and isinstance(it.get("path"), str) else it
+                        for it in items
+                    ]
+                new_course[typ] = items
+            new_date[course] = new_course
+        days[date] = new_date
+    return {**manifest, "days": days}
+
+def compact(manifest: dict) -> dict:
+    """v3 → v4：課程資料夾內的 path 只留檔名（檔名本身不含 "/"，展開時據此判斷）。"""
+    student = manifest.get("student")
+    if not student or manifest.get("version") == MANIFEST_VERSION:
+        return manifest
+    def shorten(course, path):
+        prefix = course_prefix(student, course)
+        rest = path[len(prefix):]
+        return rest if path.startswith(prefix) and rest and "/" not in rest else path
+    return {**_map_paths(manifest, shorten), "version": MANIFEST_VERSION}
+
+def expand(manifest: dict) -> dict:
+    """v4 → v3；其他版本原樣回傳。"""
+    if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION:
+        return manifest
+    student = manifest.get("student", "")
+    def lengthen(course, path):
+        return path if "/" in path else course_prefix(student, course) + path
+    return {**_map_paths(manifest, lengthen), "version": 3}
+
+def dumps(manifest: dict, *, pretty: bool = False) -> str:
+    """磁碟格式：精簡 v4；pretty=True 則輸出給人看的 v3（匯出用）。"""
+    if pretty:
+        return json.dumps(expand(manifest), ensure_ascii=False, indent=2)
+    return json.dumps(compact(manifest), ensure_ascii=False, separators=COMPACT_SEPARATORS)
+
+def loads(text: str) -> dict:
+    return expand(json.loads(text))
+
+def index_path_for(manifest_path):
+    """students/<id>/manifest.json → students/<id>/index.json"""
+    return manifest_path.with_name("index.json")
+
+def _empty_slot() -> dict:
+    return {"content": 0, "note": 0, "holiday": 0, "homework": 0, "types": {}}
+
+def _day_of(date) -> int | None:
+    """YYYY-MM-DD 的日（1～31）；不是合法日期（2025-09-00、2025-02-30、週日期寫法…）回傳 None，不進索引。"""
+    if not isinstance(date, str): return None
+    try: d = dt.date.fromisoformat(date)
+    except ValueError: return None
+    return d.day if d.isoformat() == date else None
+
+def calendar_index(manifest: dict, *, base: dict | None = None, loaded=None) -> dict:
+    """與 index.html 的 dayFlags 同規則：非空陣列才算；type 為 note 算提醒，其餘算教材。
+    loaded：manifest.days 只含這些月份時（分片只載入部分），其他月份的教材/提醒沿用 base（舊 index）；
+    holidays 在 head 裡一定完整，每次重算。"""
+    months = {}
+    if base and loaded is not None:
+        for ym, slot in (base.get("months") or {}).items():
+            if ym not in loaded:
+                months[ym] = {**_empty_slot(), **{k: slot.get(k, 0) for k in ("content", "note", "homework")},
+                              "types": dict(slot.get("types") or {})}
+    for date, per_date in (manifest.get("days") or {}).items():
+        day = _day_of(date)
+        if day is None or not isinstance(per_date, dict): continue
+        if base and loaded is not None and date[:7] not in loaded: continue  # 以 base 為準
+        for per_course in per_date.values():
+            if not isinstance(per_course, dict): continue
+            for typ, items in per_course.items():
+                if not isinstance(items, list) or not items: continue
+                slot = months.setdefault(date[:7], _empty_slot())
+                slot["types"][typ] = slot["types"].get(typ, 0) + len(items)
+                slot["note" if typ == "note" else "content"] |= 1 << (day - 1)
+                if typ == "homework": slot["homework"] |= 1 << (day - 1)
+    for date in manifest.get("holidays") or []:
+        day = _day_of(date)
+        if day is not None: months.setdefault(date[:7], _empty_slot())["holiday"] |= 1 << (day - 1)
+
+    months = dict(sorted(months.items()))
+    types, ndays, first, last = {}, 0, None, None
+    for ym, slot in months.items():
+        for typ, n in slot["types"].items(): types[typ] = types.get(typ, 0) + n
+        bits = slot["content"] | slot["note"]
+        if not bits: continue
+        ndays += bin(bits).count("1")
+        if first is None: first = f"{ym}-{(bits & -bits).bit_length():02d}"
+        last = f"{ym}-{bits.bit_length():02d}"
+    return {
+        "version": INDEX_VERSION,
+        "student": manifest.get("student"),
+        "first": first,
+        "last": last,
+        "days": ndays,
+        "types": types,
+        "months": months,
+    }
+
+def index_month(index: dict, month: str) -> dict:
+    """只留某個月份（YYYY-MM）的 bitmap 與類型數量；沒有資料的月份回傳全 0。"""
+    return {**index, "months": {month: index["months"].get(month, _empty_slot())}}
+
+def _bit_dates(ym: str, bits: int):
+    return [f"{ym}-{d:02d}" for d in range(1, bits.bit_length() + 1) if bits >> (d - 1) & 1]
+
+def overview_row(index: dict) -> dict:
+    """老師首頁（/api/overview、docs/overview.json）每位學生一列：由月曆索引算，不必讀 manifest。
+    只放與日期無關的資料（GitHub Pages 上的 overview.json 隔天也不會過期）：總堂數、第一堂，
+    以及每月上課/作業 bitmap；「上次/下次上課、待完成作業」由 teacher.html 依當天日期算。"""
+    months = {}
+    for ym, slot in sorted((index.get("months") or {}).items()):
+        content, homework = slot.get("content", 0), slot.get("homework", 0)
+        if content or homework: months[ym] = {"content": content, "homework": homework}
+    lessons = sum(bin(m["content"]).count("1") for m in months.values())
+    first = next((_bit_dates(ym, m["content"])[0] for ym, m in months.items() if m["content"]), None)
+    return {"lessons": lessons, "first": first, "months": months}
+
+def dumps_index(index: dict) -> str:
+    return json.dumps(index, ensure_ascii=False, separators=COMPACT_SEPARATORS)
+
+# ------------------------ 月份分片（layout = "monthly"） ------------------------
+# students/<id>/manifest.json 只放 head（courses/types/holidays…＋ months 清單），
+# 每月的 days 放在 students/<id>/days/YYYY-MM.json：{"version":4,"student","month","days":{...}}。
+# 讀取時組回完整 v3（相容舊客戶端，保留 layout 以便存回時照樣分片）；寫入時只動有變的月份，head 最後寫。
+LAYOUT_MONTHLY = "monthly"
+
+def is_sharded(manifest) -> bool:
+    return isinstance(manifest, dict) and manifest.get("layout") == LAYOUT_MONTHLY
+
+def shard_dir(manifest_path):
+    return manifest_path.parent / "days"
+
+def shard_path(manifest_path, month: str):
+    return shard_dir(manifest_path) / f"{month}.json"
+
+def _by_month(manifest: dict) -> dict:
+    out = {}
+    for date, per_date in (manifest.get("days") or {}).items():
+        out.setdefault(str(date)[:7], {})[date] = per_date
+    return out
+
+def changed_months(old: dict, new: dict) -> set:
+    """兩份 v3 manifest 之間 days 有差異的月份。"""
+    a, b = _by_month(old or {}), _by_month(new or {})
+    return {m for m in a.keys() | b.keys() if a.get(m) != b.get(m)}
+
+def changed_entries(old: dict, new: dict) -> list:
+    """兩份 v3 manifest 之間有差異的 (date, course, type)，依日期排序（即時通知 /api/events 用）。"""
+    a, b = (old or {}).get("days") or {}, (new or {}).get("days") or {}
+    out = []
+    for date in sorted(a.keys() | b.keys()):
+        da, db = a.get(date), b.get(date)
+        if da == db: continue
+        da, db = da if isinstance(da, dict) else {}, db if isinstance(db, dict) else {}
+        for course in sorted(da.keys() | db.keys()):
+            ca, cb = da.get(course), db.get(course)
+            if ca == cb: continue
+            ca, cb = ca if isinstance(ca, dict) else {}, cb if isinstance(cb, dict) else {}
+            out += [(date, course, typ) for typ in sorted(ca.keys() | cb.keys()) if ca.get(typ) != cb.get(typ)]
+    return out
+
+def _read_head(manifest_path) -> dict:
+    try: return json.loads(manifest_path.read_text(encoding="utf-8"))
+    except FileNotFoundError: return {}
+
+def load(manifest_path, *, months=None) -> dict:
+    """讀 manifest 成 v3；分片 layout 組回 days（months 指定時只讀這些月份）。檔案不存在時丟 FileNotFoundError。"""
+    head = json.loads(manifest_path.read_text(encoding="utf-8"))
+    if not is_sharded(head):
+        return expand(head)
+    days = {}
+    for month in head.get("months") or []:
+        if months is not None and month not in months: continue
+        try: shard = json.loads(shard_path(manifest_path, month).read_text(encoding="utf-8"))
+        except FileNotFoundError: continue
+        days.update(shard.get("days") or {})
+    view = {k: v for k, v in head.items() if k != "months"}
+    return expand({**view, "days": days})
+
+def dump_files(manifest_path, manifest: dict, *, months=None) -> list:
+    """要寫的檔案 [(path, text 或 None=刪除)]，依序寫入即可（head 一定在最後）。
+    months=None 表示全部重寫；否則只輸出這些月份的分片（manifest.days 可以只含這些月份）。"""
+    old = _read_head(manifest_path)
+    old_months = set(old.get("months") or []) if is_sharded(old) else set()
+    if not is_sharded(manifest):
+        return [(shard_path(manifest_path, m), None) for m in sorted(old_months)] + [(manifest_path, dumps(manifest))]
+    m = compact(manifest)
+    by_month = _by_month(m)
+    todo = set(by_month) | old_months if months is None else set(months)
+    out = []
+    for month in sorted(todo):
+        if month in by_month:
+            shard = {"version": m.get("version"), "student": m.get("student"), "month": month, "days": by_month[month]}
+            out.append((shard_path(manifest_path, month), json.dumps(shard, ensure_ascii=False, separators=COMPACT_SEPARATORS)))
+        else:
+            out.append((shard_path(manifest_path, month), None))
+    head = {k: v for k, v in m.items() if k != "days"}
+    head["months"] = sorted((old_months - todo) | set(by_month))
+    out.append((manifest_path, json.dumps(head, ensure_ascii=False, separators=COMPACT_SEPARATORS)))
+    return out
@@ -0,0 +1,116 @@
+# metrics.py
+"""
+伺服器量測（server.py 用，只用標準函式庫）
+
+- 每個 endpoint：請求數（依 method/status）、延遲 histogram、收到/送出的 bytes
+- 各階段計時 phase("read"|"parse"|"dump"|"gzip"|"write"|"render"|"index"|"search")：
+  全程式累計成 histogram，同時記到目前這個請求（慢請求記錄用）
+- 快取命中：cache_hit("json", True/False)
+- render() 輸出 Prometheus text format（/api/metrics）；數字只屬於目前這個 process（--workers N 時各自計算）
+"""
+from __future__ import annotations
+import threading, time
+from contextlib import contextmanager
+
+PREFIX = "en_class"
+# 秒；涵蓋快取命中（< 1ms）到整份大 manifest 重寫
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets, self.counts, self.sum, self.count = buckets, [0] * len(buckets), 0.0, 0
+    def observe(self, value: float):
+        for i, le in enumerate(self.buckets):
+            if value <= le:
+                self.counts[i] += 1; break
+        self.sum += value; self.count += 1
+
+_lock = threading.Lock()
+_requests: dict[tuple[str, str, str], int] = {}   # (endpoint, method, status) -> n
+_latency: dict[str, Histogram] = {}               # endpoint -> seconds
+_bytes_in: dict[str, int] = {}
+_bytes_out: dict[str, int] = {}
+_phases: dict[str, Histogram] = {}
+_cache: dict[tuple[str, str], int] = {}           # (cache, "hit"|"miss") -> n
+_current = threading.local()                      # 這個執行緒正在處理的請求的各階段累計
+STARTED = time.time()
+
+def begin_request():
+    _current.phases = {}
+
+def request_phases() -> dict:
+    return dict(getattr(_current, "phases", None) or {})
+
+@contextmanager
+def phase(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        took = time.perf_counter() - t0
+        with _lock:
+            _phases.setdefault(name, Histogram()).observe(took)
+        per_req = getattr(_current, "phases", None)
+        if per_req is not None: per_req[name] = per_req.get(name, 0.0) + took
+
+def cache_hit(cache: str, hit: bool):
+    key = (cache, "hit" if hit else "miss")
+    with _lock:
+        _cache[key] = _cache.get(key, 0) + 1
+
+def observe_request(endpoint: str, method: str, status: int, seconds: float, bytes_in: int, bytes_out: int):
+    with _lock:
+        key = (endpoint, method, str(status))
+        _requests[key] = _requests.get(key, 0) + 1
+        _latency.setdefault(endpoint, Histogram()).observe(seconds)
+        _bytes_in[endpoint] = _bytes_in.get(endpoint, 0) + bytes_in
+        _bytes_out[endpoint] = _bytes_out.get(endpoint, 0) + bytes_out
+    _current.phases = None
+
+def reset():
+    with _lock:
+        for d in (_requests, _latency, _bytes_in, _bytes_out, _phases, _cache): d.clear()
+
+# ---- Prometheus text exposition format 0.0.4 ----
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _labels(**kw) -> str:
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in kw.items()) + "}"
+
+def _num(v) -> str:
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+def _histogram(out: list, name: str, helptext: str, series: dict, label: str):
+    out += [f"# HELP {name} {helptext}", f"# TYPE {name} histogram"]
+    for key, h in sorted(series.items()):
+        acc = 0
+        for le, n in zip(h.buckets, h.counts):
+            acc += n
+            out.append(f"{name}_bucket{_labels(**{label: key, 'le': _num(le)})} {acc}")
+        out.append(f"{name}_bucket{_labels(**{label: key, 'le': '+Inf'})} {h.count}")
+        out.append(f"{name}_sum{_labels(**{label: key})} {_num(h.sum)}")
+        out.append(f"{name}_count{_labels(**{label: key})} {h.count}")
+
+def _counter(out: list, name: str, helptext: str, series: dict, labels):
+    out += [f"# HELP {name} {helptext}", f"# TYPE {name} counter"]
+    for key, n in sorted(series.items()):
+        key = key if isinstance(key, tuple) else (key,)
+        out.append(f"{name}{_labels(**dict(zip(labels, key)))} {n}")
+
+def render() -> str:
+    with _lock:
+        out = []
+        _counter(out, f"{PREFIX}_http_requests_total", "HTTP requests by endpoint, method and status.",
+                 _requests, ("endpoint", "method", "status"))
+        _histogram(out, f"{PREFIX}_http_request_duration_seconds", "Request latency by endpoint.", _latency, "endpoint")
+        _counter(out, f"{PREFIX}_http_request_bytes_total", "Request body bytes received by endpoint.", _bytes_in, ("endpoint",))
+        _counter(out, f"{PREFIX}_http_response_bytes_total", "Response body bytes sent by endpoint.", _bytes_out, ("endpoint",))
+        _histogram(out, f"{PREFIX}_phase_duration_seconds", "Time spent in read/parse/dump/gzip/write/render/index/search steps.",
+                   _phases, "phase")
+        _counter(out, f"{PREFIX}_cache_requests_total", "Cache lookups by cache and result (hit/miss).", _cache, ("cache", "result"))
+        out += [f"# HELP {PREFIX}_process_start_time_seconds Start time of this worker process (unix seconds).",
+                f"# TYPE {PREFIX}_process_start_time_seconds gauge",
+                f"{PREFIX}_process_start_time_seconds {_num(STARTED)}"]
+    return "\n".join(out) + "\n"
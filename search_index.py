@@ -0,0 +1,188 @@
+# search_index.py
+"""
+教材全文搜尋（server.py 與 build.py 共用，只用標準函式庫 sqlite3）
+
+- 文件：manifest 裡的每一筆教材/作業/提醒（學生、日期、課程、類型、標題、path），
+  本機 HTML 會去掉標籤後把內文一起索引
+- 斷詞：英數字以單字為單位（小寫、NFKC）；中日文連續字串切成單字＋相鄰兩字（bigram），
+  查詢時兩字以上只用 bigram，比對較精準
+- 倒排索引存在 postings(token, doc) 表（主鍵即索引），不依賴 FTS5 是否有編譯進 sqlite
+- 增量更新：每位學生記錄 manifest 的 mtime/size，沒變就不重讀；有變時逐筆比對檔案 mtime 與標題，只重建變動的文件
+"""
+from __future__ import annotations
+import re, sqlite3, unicodedata
+from collections import Counter
+from html.parser import HTMLParser
+
+DB_NAME = ".search.sqlite3"  # 放在專案根目錄（不在 docs/ 底下，不會被發佈）
+TITLE_WEIGHT = 5          # 標題命中的權重（相對於內文）
+SNIPPET_CHARS = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs(
+  id INTEGER PRIMARY KEY,
+  student TEXT NOT NULL, date TEXT NOT NULL, course TEXT NOT NULL, type TEXT NOT NULL,
+  path TEXT NOT NULL, title TEXT NOT NULL, mtime INTEGER NOT NULL, text TEXT NOT NULL,
+  UNIQUE(student, date, course, type, path)
+);
+CREATE INDEX IF NOT EXISTS docs_path ON docs(path);
+CREATE TABLE IF NOT EXISTS postings(
+  token TEXT NOT NULL, doc INTEGER NOT NULL, tf INTEGER NOT NULL,
+  PRIMARY KEY(token, doc)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_doc ON postings(doc);
+CREATE TABLE IF NOT EXISTS students(student TEXT PRIMARY KEY, stamp TEXT NOT NULL);
+"""
+
+# 英數字單字，或一段連續的假名/漢字（含擴充 A 與相容漢字）
+_WORD = re.compile(r"[0-9a-z]+|[぀-ヿ㐀-䶿一-鿿豈-﫿]+")
+_CJK = re.compile(r"[぀-ヿ㐀-䶿一-鿿豈-﫿]")
+
+def _normalize(text: str) -> str:
+    return unicodedata.normalize("NFKC", text or "").lower()
+
+def tokenize(text: str, *, query: bool = False) -> list[str]:
+    out = []
+    for run in _WORD.findall(_normalize(text)):
+        if not _CJK.match(run):
+            out.append(run)
+        elif query and len(run) > 1:
+            out += [run[i:i+2] for i in range(len(run) - 1)]
+        else:
+            out += list(run) + [run[i:i+2] for i in range(len(run) - 1)]
+    return out
+
+class _TextExtractor(HTMLParser):
+    SKIP = {"script", "style", "head", "template"}
+    def __init__(self):
+        super().__init__()
+        self.parts, self._skip = [], 0
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP: self._skip += 1
+    def handle_endtag(self, tag):
+        if tag in self.SKIP and self._skip: self._skip -= 1
+    def handle_data(self, data):
+        if not self._skip: self.parts.append(data)
+
+def html_text(raw: str) -> str:
+    parser = _TextExtractor()
+    parser.feed(raw); parser.close()
+    return " ".join(" ".join(parser.parts).split())
+
+def connect(db_path) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(db_path), timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")  # 多個 worker 同時讀，寫入時不擋讀
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+def iter_items(manifest: dict):
+    """(date, course, type, title, path)；也接受 build.py add 舊寫法的 {format, url}。"""
+    for date, per_date in (manifest.get("days") or {}).items():
+        if not isinstance(per_date, dict): continue
+        for course, per_course in per_date.items():
+            if not isinstance(per_course, dict): continue
+            for typ, items in per_course.items():
+                if isinstance(items, dict) and isinstance(items.get("url"), str):
+                    items = [{"title": per_course.get("title"), "path": items["url"]}]
+                if not isinstance(items, list): continue
+                for it in items:
+                    if isinstance(it, dict) and isinstance(it.get("path"), str):
+                        yield date, course, typ, (it.get("title") or "").strip(), it["path"]
+
+def _local_file(docs_dir, path: str):
+    if "://" in path or path.startswith("/") or ".." in path.split("/"): return None
+    return docs_dir / path
+
+def _body(fp) -> str:
+    if fp is None or fp.suffix.lower() not in (".html", ".htm"): return ""
+    try: return html_text(fp.read_text(encoding="utf-8", errors="replace"))
+    except OSError: return ""
+
+def _mtime(fp) -> int:
+    try: return fp.stat().st_mtime_ns if fp is not None else 0
+    except OSError: return 0
+
+def _put_postings(conn, doc_id: int, title: str, text: str):
+    tf = Counter(tokenize(text))
+    for tok in tokenize(title): tf[tok] += TITLE_WEIGHT
+    conn.executemany("INSERT INTO postings(token, doc, tf) VALUES (?,?,?)", ((t, doc_id, n) for t, n in tf.items()))
+
+def _drop_doc(conn, doc_id: int):
+    conn.execute("DELETE FROM postings WHERE doc=?", (doc_id,))
+    conn.execute("DELETE FROM docs WHERE id=?", (doc_id,))
+
+def is_fresh(conn, student: str, stamp: str) -> bool:
+    row = conn.execute("SELECT stamp FROM students WHERE student=?", (student,)).fetchone()
+    return bool(row) and row[0] == stamp
+
+def sync_student(conn, docs_dir, student: str, manifest: dict, stamp: str | None = None, *, months=None) -> int:
+    """讓某位學生的索引跟 manifest 一致，回傳重建的文件數。
+    stamp（manifest mtime/size）與上次相同就直接略過，同步完記下新的 stamp；
+    months 指定時只比對這些月份（manifest 只載入部分月份時用），不更新 stamp。"""
+    if stamp is not None and months is None and is_fresh(conn, student, stamp): return 0
+    existing = {(d, c, t, p): (i, m, ti) for i, d, c, t, p, m, ti in
+                conn.execute("SELECT id, date, course, type, path, mtime, title FROM docs WHERE student=?", (student,))
+                if months is None or d[:7] in months}
+    changed = 0
+    with conn:
+        for date, course, typ, title, path in iter_items(manifest):
+            if months is not None and str(date)[:7] not in months: continue
+            key = (date, course, typ, path)
+            fp = _local_file(docs_dir, path)
+            mtime = _mtime(fp)
+            old = existing.pop(key, None)
+            if old and old[1] == mtime and old[2] == title: continue
+            if old: _drop_doc(conn, old[0])
+            text = _body(fp)
+            cur = conn.execute("INSERT INTO docs(student, date, course, type, path, title, mtime, text) VALUES (?,?,?,?,?,?,?,?)",
+                               (student, date, course, typ, path, title, mtime, text))
+            _put_postings(conn, cur.lastrowid, title, text)
+            changed += 1
+        for doc_id, *_ in existing.values():
+            _drop_doc(conn, doc_id); changed += 1
+        if stamp is not None and months is None:
+            conn.execute("INSERT OR REPLACE INTO students(student, stamp) VALUES (?,?)", (student, stamp))
+    return changed
+
+def refresh_path(conn, docs_dir, path: str) -> int:
+    """單一教材檔被改寫或刪除後，重建引用它的文件內文（manifest 沒變時用）。"""
+    rows = conn.execute("SELECT id, title FROM docs WHERE path=?", (path,)).fetchall()
+    if not rows: return 0
+    fp = _local_file(docs_dir, path)
+    text, mtime = _body(fp), _mtime(fp)
+    with conn:
+        for doc_id, title in rows:
+            conn.execute("DELETE FROM postings WHERE doc=?", (doc_id,))
+            conn.execute("UPDATE docs SET text=?, mtime=? WHERE id=?", (text, mtime, doc_id))
+            _put_postings(conn, doc_id, title, text)
+    return len(rows)
+
+def drop_student(conn, student: str):
+    with conn:
+        for (doc_id,) in conn.execute("SELECT id FROM docs WHERE student=?", (student,)).fetchall():
+            _drop_doc(conn, doc_id)
+        conn.execute("DELETE FROM students WHERE student=?", (student,))
+
+def _snippet(text: str, needles) -> str:
+    low = _normalize(text)
+    hits = [i for i in (low.find(n) for n in needles) if i >= 0]
+    if not hits: return text[:SNIPPET_CHARS * 2]
+    start = max(0, min(hits) - SNIPPET_CHARS)
+    return ("…" if start else "") + text[start:start + SNIPPET_CHARS * 2] + ("…" if start + SNIPPET_CHARS * 2 < len(text) else "")
+
+def search(conn, q: str, *, student: str | None = None, limit: int = 20) -> list[dict]:
+    """所有查詢詞都要命中（AND）；依 tf 總和排序，同分新日期在前。"""
+    tokens = sorted(set(tokenize(q, query=True)))
+    if not tokens: return []
+    marks = ",".join("?" * len(tokens))
+    sql = (f"SELECT d.student, d.date, d.course, d.type, d.title, d.path, d.text, SUM(p.tf) AS score "
+           f"FROM postings p JOIN docs d ON d.id = p.doc WHERE p.token IN ({marks})")
+    args = list(tokens)
+    if student:
+        sql += " AND d.student = ?"; args.append(student)
+    sql += " GROUP BY p.doc HAVING COUNT(*) = ? ORDER BY score DESC, d.date DESC LIMIT ?"
+    args += [len(tokens), limit]
+    needles = _WORD.findall(_normalize(q))
+    return [{"student": s, "date": d, "course": c, "type": t, "title": ti, "path": p, "snippet": _snippet(text, needles), "score": sc}
+            for s, d, c, t, ti, p, text, sc in conn.execute(sql, args)]
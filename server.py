@@ -1,19 +1,240 @@
 # server.py
 from __future__ import annotations
-import json, mimetypes
+import copy, datetime as dt, gzip, hashlib, json, mimetypes, os, re, sqlite3, tempfile, threading, time
+from collections import OrderedDict, deque
+from contextlib import ExitStack, contextmanager
 from pathlib import Path
-from flask import Flask, request, jsonify, send_from_directory, Response, abort
+from typing import NamedTuple
+from flask import Flask, g, request, jsonify, send_file, send_from_directory, Response, abort
 from werkzeug.utils import safe_join
 
+import lesson_layout
+import manifest_store
+import metrics
+import search_index
+
+try:
+    import fcntl  # POSIX: cross-process lock so several workers can share docs/
+except ImportError:  # Windows: in-process locking only
+    fcntl = None
+
 app = Flask(__name__, static_folder=None)
 
 BASE_DIR = Path(__file__).resolve().parent
 DOCS_DIR = BASE_DIR / "docs"
 DOCS_DIR.mkdir(exist_ok=True)
 
+GZIP_MIN_SIZE = 1024
+SEARCH_DB = BASE_DIR / search_index.DB_NAME
+
+def _dump_json(data, *, pretty=False) -> bytes:
+    with metrics.phase("dump"):
+        if pretty:
+            return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+        return json.dumps(data, ensure_ascii=False, separators=manifest_store.COMPACT_SEPARATORS).encode("utf-8")
+
+def _is_manifest(fp: Path) -> bool:
+    return fp.name == "manifest.json" and fp.parent.parent.name == "students"
+
+def _is_shard(fp: Path) -> bool:
+    """students/<id>/days/YYYY-MM.json (monthly-sharded manifest layout)."""
+    return fp.parent.name == "days" and fp.parent.parent.parent.name == "students"
+
+def _content_etag(body: bytes) -> str:
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+def _file_etag(st) -> str:
+    return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+def _conditional(resp: Response, etag: str) -> Response:
+    """Strong ETag + revalidate-every-time; answers If-None-Match with 304."""
+    resp.set_etag(etag)
+    resp.cache_control.no_cache = True
+    resp.vary.add("Accept-Encoding")
+    return resp.make_conditional(request)
+
+# sidecars written by `build.py precompress`, best first
+PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+
+def _precompressed(fp: Path, mime: str, etag: str) -> Response | None:
+    """Serve a fresh .br/.gz sibling of fp if the client accepts it (no per-request compression)."""
+    src_mtime = fp.stat().st_mtime_ns
+    for enc, ext in PRECOMPRESSED:
+        if enc not in request.accept_encodings:
+            continue
+        side = fp.with_name(fp.name + ext)
+        try:
+            st = side.stat()
+        except OSError:
+            continue
+        if st.st_mtime_ns < src_mtime:
+            continue  # stale: source edited after precompress
+        resp = send_file(side, mimetype=mime, etag=f"{etag}-{ext[1:]}")
+        resp.headers["Content-Encoding"] = enc
+        resp.vary.add("Accept-Encoding")
+        return resp
+    return None
+
+def _accepts_gzip() -> bool:
+    return "gzip" in request.accept_encodings
+
 def _json_ok(data):
-    return Response(json.dumps(data, ensure_ascii=False, indent=2),
-                    mimetype="application/json; charset=utf-8")
+    body = _dump_json(data)
+    return _json_bytes_ok(body, _content_etag(body))
+
+def _json_bytes_ok(body: bytes, etag: str, gz: bytes | None = None):
+    if request.args.get("pretty") in ("1", "true"):  # human-readable export path
+        body, gz = _dump_json(json.loads(body), pretty=True), None
+        etag += "-pretty"
+    if gz is not None and _accepts_gzip():
+        # distinct ETag per representation; If-Match accepts all of them (see _base_etag)
+        resp = Response(gz, mimetype="application/json; charset=utf-8")
+        resp.headers["Content-Encoding"] = "gzip"
+        etag += "-gz"
+    else:
+        resp = Response(body, mimetype="application/json; charset=utf-8")
+    resp.vary.add("Accept-Encoding")
+    return _conditional(resp, etag)
+
+# ---- JSON (manifest/roster) cache: path -> parsed (manifests expanded to v3), response bytes, ETag, gzip ----
+class _JsonEntry(NamedTuple):
+    mtime_ns: int
+    size: int
+    data: object
+    body: bytes
+    etag: str
+    gz: bytes | None
+
+JSON_CACHE_MAX = 64
+_json_cache: OrderedDict[str, _JsonEntry] = OrderedDict()
+_json_cache_lock = threading.Lock()
+
+def _json_cache_put(fp: Path, data, body: bytes) -> _JsonEntry:
+    st = fp.stat()
+    gz = None
+    if len(body) >= GZIP_MIN_SIZE:
+        with metrics.phase("gzip"): gz = gzip.compress(body, compresslevel=6, mtime=0)
+    entry = _JsonEntry(st.st_mtime_ns, st.st_size, data, body, _content_etag(body), gz)
+    with _json_cache_lock:
+        _json_cache[str(fp)] = entry
+        _json_cache.move_to_end(str(fp))
+        while len(_json_cache) > JSON_CACHE_MAX:
+            _json_cache.popitem(last=False)
+    return entry
+
+def _json_cache_drop(fp: Path):
+    with _json_cache_lock:
+        _json_cache.pop(str(fp), None)
+
+def _read_json_cached(fp: Path) -> _JsonEntry:
+    """Parsed + pre-serialized (+ gzipped) JSON + ETag; re-read only when mtime/size changed (e.g. edited by build.py)."""
+    st = fp.stat()
+    with _json_cache_lock:
+        hit = _json_cache.get(str(fp))
+        if hit and hit.mtime_ns == st.st_mtime_ns and hit.size == st.st_size:
+            _json_cache.move_to_end(str(fp))
+            metrics.cache_hit("json", True)
+            return hit
+    metrics.cache_hit("json", False)
+    with metrics.phase("read"):
+        raw = fp.read_bytes()
+    with metrics.phase("parse"):
+        data = json.loads(raw)
+        if _is_manifest(fp) and manifest_store.is_sharded(data):
+            # clients always get v3; a sharded head is assembled with its days/YYYY-MM.json
+            # (every shard write also rewrites the head, so the head's mtime/size still validates the entry)
+            data = manifest_store.load(fp)
+        elif _is_manifest(fp) or _is_shard(fp):
+            data = manifest_store.expand(data)
+    return _json_cache_put(fp, data, _dump_json(data))
+
+# ---- crash-safe writes + per-path locking ----
+_dir_locks: dict[str, threading.RLock] = {}
+_dir_locks_guard = threading.Lock()
+_held_dirs = threading.local()  # directories this thread already holds a flock on (flock is per open file, not re-entrant)
+
+@contextmanager
+def _locked(target: Path):
+    """Serialize writers of one path: a thread lock per parent directory (the same granularity
+    as the flock, so the two can't be taken in opposite orders), plus flock on that directory when
+    available so separate worker processes serialize too. Re-entrant within a thread
+    (/api/batch holds several paths while the write helpers lock them again)."""
+    key = str(target.parent)
+    with _dir_locks_guard:
+        lock = _dir_locks.setdefault(key, threading.RLock())
+    with lock:
+        held = _held_dirs.__dict__.setdefault("dirs", set())
+        if fcntl is None or key in held:
+            yield
+            return
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(target.parent, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            held.add(key)
+            yield
+        finally:
+            held.discard(key)
+            os.close(fd)  # closing the fd releases the flock
+
+def _locked_all(targets):
+    """Lock several paths: deepest directories first, the order nested helpers already use
+    (students/<id>/ before docs/overview.json, materials/… before docs/assets/), so no lock-order deadlock."""
+    stack = ExitStack()
+    try:
+        per_dir = {fp.parent: fp for fp in targets}  # one lock per directory
+        for d in sorted(per_dir, key=lambda d: (-len(d.parts), str(d))):
+            stack.enter_context(_locked(per_dir[d]))
+    except BaseException:
+        stack.close()
+        raise
+    return stack
+
+def _atomic_write(target: Path, body: bytes, *, fsync: bool = False):
+    """Write to a temp file in the same directory, then os.replace: readers see the old or the new file, never half."""
+    with metrics.phase("write"):
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=target.parent, prefix=f".{target.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(body)
+                if fsync:
+                    f.flush(); os.fsync(f.fileno())
+            os.replace(tmp, target)
+        except BaseException:
+            try: os.unlink(tmp)
+            except OSError: pass
+            raise
+        if fsync and fcntl is not None:
+            dfd = os.open(target.parent, os.O_RDONLY)
+            try: os.fsync(dfd)
+            finally: os.close(dfd)
+
+def _current_etag(target: Path) -> str | None:
+    return _read_json_cached(target).etag if target.exists() else None
+
+def _base_etag(tag: str) -> str:
+    """Content revision of any ETag we serve: _json_bytes_ok appends -pretty and/or -gz per representation."""
+    tag = tag.removeprefix("W/").strip('"')
+    for suffix in ("-gz", "-pretty"):
+        tag = tag.removesuffix(suffix)
+    return tag
+
+def _precondition_failed(target: Path) -> Response | None:
+    """Optimistic concurrency: a stale If-Match gets 409 with the current revision."""
+    if not request.if_match:
+        return None
+    current = _current_etag(target)
+    if current is not None and (request.if_match.star_tag or current in {_base_etag(t) for t in request.if_match.as_set()}):
+        return None
+    resp = jsonify({"status":"error","message":"stale revision: file was modified elsewhere, reload and retry",
+                    "etag": current})
+    resp.status_code = 409
+    if current: resp.set_etag(current)
+    return resp
+
+def _wants_fsync(data: dict) -> bool:
+    return bool(data.get("fsync")) or request.args.get("fsync") in ("1", "true")
 
 def _default_manifest(student_id: str) -> dict:
     return {
@@ -38,6 +259,234 @@ def _guess_mime(p: Path) -> str:
     t, _ = mimetypes.guess_type(str(p))
     return t or "text/plain; charset=utf-8"
 
+# ---- JSON Patch (RFC 6902) on manifests ----
+PATCH_ROOTS = ("days", "holidays", "types", "courses")
+
+class PatchError(ValueError):
+    pass
+
+class PatchTestFailed(PatchError):
+    pass
+
+def _manifest_path(student: str) -> Path:
+    dst = safe_join(str(DOCS_DIR), "students", student, "manifest.json")
+    if not dst: abort(400)
+    return Path(dst)
+
+def _load_manifest(student: str) -> dict:
+    """Cached parsed manifest (shared object: never mutate in place) with v3 base keys filled in."""
+    fp = _manifest_path(student)
+    data = _read_json_cached(fp).data if fp.exists() else {}
+    base = _default_manifest(student)
+    if all(k in data for k in base):
+        return data
+    return {**base, **data}
+
+def _pointer(path: str) -> list[str]:
+    if not isinstance(path, str) or not path.startswith("/"):
+        raise PatchError(f"invalid JSON pointer: {path!r}")
+    tokens = [t.replace("~1", "/").replace("~0", "~") for t in path[1:].split("/")]
+    if tokens[0] not in PATCH_ROOTS:
+        raise PatchError(f"path outside {'/'.join(PATCH_ROOTS)}: {path}")
+    return tokens
+
+def _child_key(node, token: str, *, for_add=False):
+    if isinstance(node, dict):
+        if not for_add and token not in node:
+            raise PatchError(f"no such member: {token}")
+        return token
+    if isinstance(node, list):
+        if for_add and token == "-":
+            return len(node)
+        if not token.isdigit():
+            raise PatchError(f"invalid array index: {token}")
+        idx = int(token)
+        if idx > len(node) or (idx == len(node) and not for_add):
+            raise PatchError(f"array index out of range: {token}")
+        return idx
+    raise PatchError(f"cannot descend into {type(node).__name__}")
+
+def _get(doc, tokens):
+    node = doc
+    for t in tokens:
+        node = node[_child_key(node, t)]
+    return node
+
+def _cow_parent(doc, tokens, fresh: set):
+    """Copy-on-write: shallow-copy only the containers along the path, so untouched
+    subtrees (and the cached manifest) are shared instead of deep-copied."""
+    def own(node):
+        if id(node) in fresh:
+            return node
+        if not isinstance(node, (dict, list)):
+            raise PatchError(f"cannot descend into {type(node).__name__}")
+        node = dict(node) if isinstance(node, dict) else list(node)
+        fresh.add(id(node))
+        return node
+    doc = own(doc)
+    node = doc
+    for t in tokens[:-1]:
+        key = _child_key(node, t)
+        node[key] = own(node[key])
+        node = node[key]
+    return doc, node
+
+def apply_patch(doc: dict, ops) -> dict:
+    if not isinstance(ops, list):
+        raise PatchError("ops must be a list")
+    fresh: set[int] = set()
+
+    def add(doc, tokens, value):
+        doc, parent = _cow_parent(doc, tokens, fresh)
+        key = _child_key(parent, tokens[-1], for_add=True)
+        if isinstance(parent, list): parent.insert(key, value)
+        else: parent[key] = value
+        return doc
+
+    def remove(doc, tokens):
+        if len(tokens) == 1:
+            raise PatchError(f"refuse to remove /{tokens[0]}")
+        doc, parent = _cow_parent(doc, tokens, fresh)
+        del parent[_child_key(parent, tokens[-1])]
+        return doc
+
+    for op in ops:
+        if not isinstance(op, dict):
+            raise PatchError("each op must be an object")
+        kind, tokens = op.get("op"), _pointer(op.get("path"))
+        if kind in ("add", "replace", "test") and "value" not in op:
+            raise PatchError(f"{kind} requires value")
+        if kind == "add":
+            doc = add(doc, tokens, op["value"])
+        elif kind == "remove":
+            doc = remove(doc, tokens)
+        elif kind == "replace":
+            doc, parent = _cow_parent(doc, tokens, fresh)
+            parent[_child_key(parent, tokens[-1])] = op["value"]
+        elif kind in ("move", "copy"):
+            src = _pointer(op.get("from"))
+            value = _get(doc, src)
+            if kind == "copy":
+                value = copy.deepcopy(value)
+            else:
+                doc = remove(doc, src)
+            doc = add(doc, tokens, value)
+        elif kind == "test":
+            if _get(doc, tokens) != op["value"]:
+                raise PatchTestFailed(f"test failed: {op.get('path')}")
+        else:
+            raise PatchError(f"unsupported op: {kind!r}")
+    return doc
+
+
+def _write_manifest(target: Path, manifest: dict, *, fsync: bool = False) -> str:
+    """Caller holds the lock. Compact v4 on disk; a monthly-sharded manifest rewrites only the
+    months whose days changed, then its head. Refreshes cache + calendar index; returns the ETag."""
+    old = _read_json_cached(target).data if target.exists() else {}
+    if manifest_store.is_sharded(old) and "layout" not in manifest:
+        manifest = {**manifest, "layout": old["layout"]}  # keep the layout for clients that drop unknown keys
+    months = None
+    if manifest_store.is_sharded(old) and manifest_store.is_sharded(manifest):
+        months = manifest_store.changed_months(old, manifest)
+    index_body = _index_body(manifest)  # derived data first: if it can't be built, nothing has been written yet
+    for fp, text in manifest_store.dump_files(target, manifest, months=months):
+        if text is None: fp.unlink(missing_ok=True)
+        else: _atomic_write(fp, text.encode("utf-8"), fsync=fsync)
+        if fp != target: _json_cache_drop(fp)
+    _write_index(target, index_body, fsync=fsync)
+    etag = _json_cache_put(target, manifest, _dump_json(manifest)).etag  # write-through：下一次讀取直接命中
+    _write_overview()
+    _search_sync(target.parent.name)
+    _publish_manifest(target.parent.name, old, manifest, etag, _stat_key(target))
+    return etag
+
+# ---- calendar index (month bitmaps, per-type counts, first/last) derived from the cached manifest ----
+_index_cache: dict[str, tuple[int, int, dict]] = {}  # manifest path -> (mtime_ns, size, index)
+
+def _calendar_index(student: str) -> dict:
+    """Recomputed only when the manifest's mtime/size changed; otherwise a single stat (keeps /api/overview cheap)."""
+    fp = _manifest_path(student)
+    try:
+        st = fp.stat()
+    except FileNotFoundError:
+        return manifest_store.calendar_index(_default_manifest(student))
+    hit = _index_cache.get(str(fp))
+    fresh = bool(hit) and hit[:2] == (st.st_mtime_ns, st.st_size)
+    metrics.cache_hit("index", fresh)
+    if fresh:
+        return hit[2]
+    manifest = _read_json_cached(fp).data
+    with metrics.phase("index"):
+        index = manifest_store.calendar_index(manifest)
+    _index_cache[str(fp)] = (st.st_mtime_ns, st.st_size, index)
+    return index
+
+def _index_body(manifest: dict) -> bytes:
+    with metrics.phase("index"):
+        return manifest_store.dumps_index(manifest_store.calendar_index(manifest)).encode("utf-8")
+
+def _write_index(target: Path, body: bytes, *, fsync: bool = False):
+    """Keep the static students/<id>/index.json (GitHub Pages) in step with the manifest; caller holds the lock."""
+    fp = manifest_store.index_path_for(target)
+    try:
+        if fp.read_bytes() == body: return
+    except OSError:
+        pass
+    _atomic_write(fp, body, fsync=fsync)
+
+# ---- lesson pages: x.frag.html (content) + shared layout (lesson_layout.py) -> x.html ----
+RENDER_CACHE_MAX = 128
+_render_cache: OrderedDict[str, tuple[int, int, bytes, str]] = OrderedDict()  # fragment path -> (mtime_ns, size, page, ETag)
+_render_lock = threading.Lock()
+
+def _ensure_assets():
+    """docs/assets/lesson.css|js (normally written by build.py render); rewritten if missing or out of date."""
+    for rel, text in lesson_layout.asset_files().items():
+        fp, body = DOCS_DIR / rel, text.encode("utf-8")
+        try:
+            if fp.read_bytes() == body: continue
+        except OSError:
+            pass
+        with _locked(fp):
+            _atomic_write(fp, body)
+
+def _render_page(frag: Path) -> bytes:
+    _ensure_assets()
+    with metrics.phase("render"):
+        return lesson_layout.render_fragment(frag.read_text(encoding="utf-8"), frag.relative_to(DOCS_DIR).as_posix()).encode("utf-8")
+
+def _rendered_lesson(fp: Path) -> tuple[bytes, str] | None:
+    """x.html whose x.frag.html is newer (or whose page was never rendered): render on the fly,
+    cached by the fragment's mtime/size. None means: serve the file on disk as usual."""
+    if not fp.name.endswith(".html") or lesson_layout.is_fragment(fp.name):
+        return None
+    frag = fp.with_name(fp.name[:-len(".html")] + lesson_layout.FRAGMENT_SUFFIX)
+    try:
+        fst = frag.stat()
+    except FileNotFoundError:
+        return None
+    try:
+        if fp.stat().st_mtime_ns >= fst.st_mtime_ns: return None
+    except FileNotFoundError:
+        pass
+    with _render_lock:
+        hit = _render_cache.get(str(frag))
+        if hit and hit[:2] == (fst.st_mtime_ns, fst.st_size):
+            _render_cache.move_to_end(str(frag))
+            metrics.cache_hit("render", True)
+            return hit[2], hit[3]
+    metrics.cache_hit("render", False)
+    page = _render_page(frag)
+    etag = _content_etag(page)
+    with _render_lock:
+        _render_cache[str(frag)] = (fst.st_mtime_ns, fst.st_size, page, etag)
+        while len(_render_cache) > RENDER_CACHE_MAX:
+            _render_cache.popitem(last=False)
+    return page, etag
+
+def _lesson_response(rendered: tuple[bytes, str]) -> Response:
+    return _conditional(Response(rendered[0], mimetype="text/html; charset=utf-8"), rendered[1])
+
 @app.get("/api/data/<path:req_path>")
 def api_data(req_path: str):
     dst = safe_join(str(DOCS_DIR), req_path)
@@ -45,6 +494,9 @@ def api_data(req_path: str):
     fp = Path(dst)
     lower = req_path.lower()
 
+    rendered = _rendered_lesson(fp)
+    if rendered is not None:
+        return _lesson_response(rendered)
     if not fp.exists():
         if lower.endswith("manifest.json"):
             parts = Path(req_path).parts
@@ -52,15 +504,69 @@ def api_data(req_path: str):
             return _json_ok(_default_manifest(sid))
         if lower == "roster.json":
             return _json_ok(_default_roster())
+        parts = Path(req_path).parts
+        if len(parts) == 3 and parts[0] == "students" and parts[2] == "index.json":
+            return _json_ok(_calendar_index(parts[1]))  # not generated yet: compute from the manifest
         return jsonify({"error": "Not Found", "path": req_path}), 404
 
     if lower.endswith(".json"):
-        return _json_ok(json.loads(fp.read_text(encoding="utf-8")))
+        entry = _read_json_cached(fp)
+        return _json_bytes_ok(entry.body, entry.etag, entry.gz)
 
     mime = _guess_mime(fp)
-    if mime.startswith("text/") or mime.endswith(("xml", "javascript")):
-        return Response(fp.read_text(encoding="utf-8"), mimetype=mime)
-    return Response(fp.read_bytes(), mimetype=mime)
+    etag = _file_etag(fp.stat())
+    pre = _precompressed(fp, mime, etag)
+    if pre is not None:
+        return pre
+    # stream the raw bytes (wsgi.file_wrapper/sendfile under waitress), no decode/re-encode;
+    # conditional=True answers If-None-Match with 304 and Range with 206 (PDF viewers fetch pages lazily)
+    resp = send_file(fp, mimetype=mime, etag=etag, conditional=True)
+    resp.vary.add("Accept-Encoding")
+    return resp
+
+# ---- write helpers shared by /api/save, /api/delete and /api/batch (caller holds the locks) ----
+def _save_json(target: Path, content, *, fsync: bool = False) -> str:
+    if _is_manifest(target):
+        return _write_manifest(target, manifest_store.expand(content), fsync=fsync)
+    _atomic_write(target, _dump_json(content, pretty=True), fsync=fsync)  # roster…: pretty for hand edits
+    return _json_cache_put(target, content, _dump_json(content)).etag  # write-through：下一次讀取直接命中
+
+def _save_text(target: Path, content: str, *, fsync: bool = False) -> str:
+    """Returns the page the search index / change feed should hear about."""
+    _atomic_write(target, content.encode("utf-8"), fsync=fsync)
+    rel = target.relative_to(DOCS_DIR).as_posix()
+    if lesson_layout.is_fragment(rel):
+        # write-through render so the static page (GitHub Pages) is current too
+        page = DOCS_DIR / lesson_layout.page_for(rel)
+        with _locked(page):
+            _atomic_write(page, _render_page(target), fsync=fsync)
+        rel = lesson_layout.page_for(rel)
+    return rel
+
+def _lesson_sibling(relpath: str) -> Path | None:
+    """A lesson page and its fragment go together."""
+    sibling = (lesson_layout.page_for(relpath) if lesson_layout.is_fragment(relpath)
+               else lesson_layout.fragment_for(relpath) if relpath.endswith(".html") else None)
+    return DOCS_DIR / sibling if sibling else None
+
+def _delete_files(target: Path, sibling: Path | None):
+    target.unlink(missing_ok=True)
+    if sibling: sibling.unlink(missing_ok=True)
+    _json_cache_drop(target)
+    if _is_manifest(target):
+        manifest_store.index_path_for(target).unlink(missing_ok=True)
+        for shard in manifest_store.shard_dir(target).glob("*.json"):
+            shard.unlink(); _json_cache_drop(shard)
+
+def _after_delete(target: Path):
+    rel = target.relative_to(DOCS_DIR).as_posix()
+    if _is_manifest(target):
+        _search_sync(target.parent.name)
+        _publish_manifest(target.parent.name, {}, {}, None, None)
+    else:
+        page = lesson_layout.page_for(rel) if lesson_layout.is_fragment(rel) else rel
+        _search_refresh(page)
+        _publish_file(page, deleted=True)
 
 @app.post("/api/save")
 def api_save():
@@ -70,16 +576,26 @@ def api_save():
         return jsonify({"status":"error","message":"missing path"}), 400
 
     target = _path_under_docs(relpath)
+    fsync = _wants_fsync(data)
     if str(target).lower().endswith(".json"):
         if isinstance(content, str):
             try: content = json.loads(content)
             except Exception: return jsonify({"status":"error","message":"content is not valid JSON"}), 400
-        target.write_text(json.dumps(content, ensure_ascii=False, indent=2), encoding="utf-8")
-    else:
-        if not isinstance(content, str):
-            return jsonify({"status":"error","message":"content must be string for non-JSON files"}), 400
-        target.write_text(content, encoding="utf-8")
+        with _locked(target):
+            conflict = _precondition_failed(target)
+            if conflict: return conflict
+            etag = _save_json(target, content, fsync=fsync)
+        if target == DOCS_DIR / "roster.json": _write_overview()
+        resp = jsonify({"status":"success","path": str(target.relative_to(DOCS_DIR)),"etag": etag})
+        resp.set_etag(etag)
+        return resp
 
+    if not isinstance(content, str):
+        return jsonify({"status":"error","message":"content must be string for non-JSON files"}), 400
+    with _locked(target):
+        rel = _save_text(target, content, fsync=fsync)
+    _search_refresh(rel)
+    _publish_file(rel, deleted=False)
     return jsonify({"status":"success","path": str(target.relative_to(DOCS_DIR))})
 
 @app.post("/api/delete")
@@ -88,26 +604,633 @@ def api_delete():
     relpath = (data.get("path") or "").strip("/")
     if not relpath:
         return jsonify({"status":"error","message":"missing path"}), 400
-    target = Path(safe_join(str(DOCS_DIR), relpath))
-    if not target or not target.exists():
+    full = safe_join(str(DOCS_DIR), relpath)
+    if not full:
+        return jsonify({"status":"error","message":"invalid path"}), 400
+    target, sibling = Path(full), _lesson_sibling(relpath)
+    if not (target.exists() or (sibling and sibling.exists())):
         return jsonify({"status":"success","deleted": False, "path": relpath})
     if target.is_dir():
         return jsonify({"status":"error","message":"refuse to delete directory"}), 400
     try:
-        target.unlink()
+        with _locked(target):
+            _delete_files(target, sibling)
+        _after_delete(target)
         return jsonify({"status":"success","deleted": True, "path": relpath})
     except Exception as e:
         return jsonify({"status":"error","message":str(e)}), 500
 
+@app.post("/api/manifest/<student>/patch")
+def api_manifest_patch(student: str):
+    data = request.get_json(silent=True) or {}
+    ops = data.get("ops", data) if isinstance(data, dict) else data
+    target = _manifest_path(student)
+    with _locked(target):
+        conflict = _precondition_failed(target)
+        if conflict: return conflict
+        try:
+            manifest = apply_patch(_load_manifest(student), ops)
+        except PatchError as e:
+            return jsonify({"status":"error","message":str(e)}), 409 if isinstance(e, PatchTestFailed) else 400
+        etag = _write_manifest(target, manifest, fsync=_wants_fsync(data) if isinstance(data, dict) else False)
+    resp = jsonify({"status":"success","path": str(target.relative_to(DOCS_DIR)),"applied": len(ops),"etag": etag})
+    resp.set_etag(etag)
+    return resp
+
+# ---- /api/batch: ordered save/delete/patch ops in one request, all or nothing ----
+BATCH_MAX_OPS = 200
+
+class BatchError(ValueError):
+    def __init__(self, message: str, status: int = 400, etag: str | None = None):
+        super().__init__(message)
+        self.status, self.etag = status, etag
+
+def _batch_path(relpath) -> Path:
+    full = safe_join(str(DOCS_DIR), relpath.strip("/")) if isinstance(relpath, str) and relpath.strip("/") else None
+    if not full: raise BatchError("missing or invalid path")
+    return Path(full)
+
+def _batch_manifest(student) -> Path:
+    full = safe_join(str(DOCS_DIR), "students", student, "manifest.json") if isinstance(student, str) and student else None
+    if not full: raise BatchError("missing or invalid student")
+    return Path(full)
+
+def _batch_check_rev(target: Path, op: dict, staged: dict):
+    """Per-op "if_match": compared with the file as it was before the batch (later ops can't know intermediate ETags)."""
+    expected = op.get("if_match")
+    if not isinstance(expected, str) or not expected or target in staged: return
+    current = _current_etag(target)
+    if current is not None and _base_etag(expected) != current:
+        raise BatchError("stale revision: file was modified elsewhere, reload and retry", 409, current)
+
+def _batch_plan(ops: list) -> list:
+    """Validate every op and compute JSON results in memory (patches see earlier ops); touches nothing on disk."""
+    staged: dict[Path, object] = {}  # JSON path -> content after the ops so far (None: deleted)
+    plan = []
+    for i, op in enumerate(ops):
+        try:
+            if not isinstance(op, dict): raise BatchError("each op must be an object")
+            kind = op.get("op")
+            if kind == "save":
+                target, content = _batch_path(op.get("path")), op.get("content")
+                if target.suffix.lower() == ".json":
+                    if isinstance(content, str):
+                        try: content = json.loads(content)
+                        except ValueError: raise BatchError("content is not valid JSON")
+                    _batch_check_rev(target, op, staged)
+                    staged[target] = content = manifest_store.expand(content) if _is_manifest(target) else content
+                    plan.append(("save", target, content))
+                else:
+                    if not isinstance(content, str): raise BatchError("content must be string for non-JSON files")
+                    plan.append(("save", target, content))
+            elif kind == "delete":
+                target = _batch_path(op.get("path"))
+                if target.is_dir(): raise BatchError("refuse to delete directory")
+                if target.suffix.lower() == ".json":
+                    _batch_check_rev(target, op, staged)
+                    staged[target] = None
+                plan.append(("delete", target, None))
+            elif kind == "patch":
+                target = _batch_manifest(op.get("student"))
+                _batch_check_rev(target, op, staged)
+                base = staged.get(target) if target in staged else _load_manifest(op["student"])
+                try:
+                    staged[target] = apply_patch(base or _default_manifest(op["student"]), op.get("ops"))
+                except PatchError as e:
+                    raise BatchError(str(e), 409 if isinstance(e, PatchTestFailed) else 400)
+                plan.append(("patch", target, staged[target]))
+            else:
+                raise BatchError(f"unsupported op: {kind!r}")
+        except BatchError as e:
+            e.index = i
+            raise
+    return plan
+
+def _batch_locks(ops: list) -> list[Path]:
+    """Paths to lock before planning; malformed ops are skipped here and reported by _batch_plan."""
+    locks = []
+    for op in ops:
+        if not isinstance(op, dict): continue
+        try:
+            if op.get("op") == "patch":
+                locks.append(_batch_manifest(op.get("student")))
+            elif op.get("op") in ("save", "delete"):
+                target = _batch_path(op.get("path"))
+                locks += [target, *filter(None, [_lesson_sibling(target.relative_to(DOCS_DIR).as_posix())])]
+        except BatchError:
+            pass
+    return locks
+
+def _touched_files(kind: str, target: Path) -> list[Path]:
+    """Every file an op may write or remove, for the rollback snapshot."""
+    files = [target]
+    if _is_manifest(target):
+        files += [manifest_store.index_path_for(target), *manifest_store.shard_dir(target).glob("*.json")]
+    elif target.suffix.lower() != ".json":
+        sibling = _lesson_sibling(target.relative_to(DOCS_DIR).as_posix())
+        if sibling: files.append(sibling)
+    return files
+
+def _rollback(snapshot: dict):
+    """Put every touched file back as it was (None: did not exist); new month shards are removed."""
+    for fp in {fp for fp in snapshot if _is_manifest(fp)}:
+        for shard in manifest_store.shard_dir(fp).glob("*.json"):
+            if shard not in snapshot: shard.unlink(missing_ok=True)
+    for fp, body in reversed(snapshot.items()):
+        if body is None: fp.unlink(missing_ok=True)
+        else: _atomic_write(fp, body)
+        _json_cache_drop(fp)
+
+def _new_dirs(paths) -> list[Path]:
+    """Directories under docs/ that don't exist yet (deepest first); _locked creates them for the flock."""
+    dirs = set()
+    for fp in paths:
+        d = fp.parent
+        while d != DOCS_DIR and DOCS_DIR in d.parents and not d.exists():
+            dirs.add(d); d = d.parent
+    return sorted(dirs, key=lambda d: -len(d.parts))
+
+def _remove_new_dirs(dirs: list[Path]):
+    """After a rejected or rolled-back batch: drop the directories it created, if still empty."""
+    for d in dirs:
+        try: d.rmdir()
+        except OSError: pass  # someone else wrote there meanwhile, or already gone
+
+@app.post("/api/batch")
+def api_batch():
+    """{"ops": [{"op":"save","path","content"}, {"op":"delete","path"}, {"op":"patch","student","ops":[…]}], "fsync"?}
+    Every op may carry "if_match". All ops are validated (and patches applied in memory) under the locks
+    before anything is written; a write failure restores every touched file. Results come back per op."""
+    data = request.get_json(silent=True) or {}
+    ops = data.get("ops") if isinstance(data, dict) else None
+    if not isinstance(ops, list) or not ops:
+        return jsonify({"status":"error","message":"ops must be a non-empty list"}), 400
+    if len(ops) > BATCH_MAX_OPS:
+        return jsonify({"status":"error","message":f"at most {BATCH_MAX_OPS} ops per batch"}), 400
+    fsync = _wants_fsync(data)
+    results, effects = [], []
+    locks = _batch_locks(ops)
+    new_dirs = _new_dirs(locks)
+    with _locked_all(locks):
+        try:
+            plan = _batch_plan(ops)
+        except BatchError as e:
+            _remove_new_dirs(new_dirs)
+            results = [{"op": op.get("op") if isinstance(op, dict) else None, "status": "skipped"} for op in ops]
+            results[e.index] = {**results[e.index], "status": "error", "message": str(e)}
+            body = {"status":"error","message":f"op {e.index}: {e}","index": e.index,"results": results}
+            if e.etag: body["etag"] = e.etag
+            return jsonify(body), e.status
+
+        snapshot: dict[Path, bytes | None] = {}
+        try:
+            for i, (kind, target, content) in enumerate(plan):
+                for fp in _touched_files(kind, target):
+                    if fp not in snapshot:
+                        try: snapshot[fp] = fp.read_bytes()
+                        except FileNotFoundError: snapshot[fp] = None
+                rel = target.relative_to(DOCS_DIR).as_posix()
+                if kind == "delete":
+                    sibling = _lesson_sibling(rel)
+                    existed = target.exists() or bool(sibling and sibling.exists())
+                    if existed:
+                        _delete_files(target, sibling)
+                        effects.append(("delete", target))
+                    results.append({"op": "delete", "path": rel, "status": "success", "deleted": existed})
+                elif isinstance(content, str) and target.suffix.lower() != ".json":
+                    effects.append(("file", _save_text(target, content, fsync=fsync)))
+                    results.append({"op": "save", "path": rel, "status": "success"})
+                else:
+                    etag = _save_json(target, content, fsync=fsync)
+                    if target == DOCS_DIR / "roster.json": effects.append(("roster", target))
+                    result = {"op": kind, "path": rel, "status": "success", "etag": etag}
+                    if kind == "patch": result["applied"] = len(ops[i].get("ops") or [])
+                    results.append(result)
+        except Exception as e:
+            app.logger.exception("batch op %d failed, rolling back", i)
+            _rollback(snapshot)
+            _remove_new_dirs(new_dirs)
+            for student in {fp.parent.name for fp in snapshot if _is_manifest(fp)}:
+                _search_sync(student)
+            _write_overview()
+            return jsonify({"status":"error","message":f"op {i} failed, batch rolled back: {e}","index": i}), 500
+
+    for kind, what in effects:
+        if kind == "delete": _after_delete(what)
+        elif kind == "roster": _write_overview()
+        else:
+            _search_refresh(what)
+            _publish_file(what, deleted=False)
+    return jsonify({"status":"success","results": results})
+
+@app.get("/api/students/<student>/index")
+def api_student_index(student: str):
+    index = _calendar_index(student)
+    month = request.args.get("month")
+    if month:
+        if not re.fullmatch(r"\d{4}-\d{2}", month):
+            return jsonify({"status":"error","message":"month must be YYYY-MM"}), 400
+        index = manifest_store.index_month(index, month)
+    return _json_ok(index)
+
+def _overview() -> dict:
+    """One row per roster student (lesson count, first lesson, monthly lesson/homework bitmaps, last update) from the
+    cached calendar indexes. Nothing depends on today's date: teacher.html derives last/next/pending in the browser."""
+    roster_fp = DOCS_DIR / "roster.json"
+    roster = _read_json_cached(roster_fp).data if roster_fp.exists() else _default_roster()
+    rows = []
+    for stu in roster.get("students") or []:
+        sid = stu.get("id")
+        if not sid: continue
+        try: updated = dt.datetime.fromtimestamp(_manifest_path(sid).stat().st_mtime).isoformat(timespec="seconds")
+        except FileNotFoundError: updated = None
+        rows.append({"id": sid, "name": stu.get("name") or sid, "updated": updated,
+                     **manifest_store.overview_row(_calendar_index(sid))})
+    return {"students": rows}
+
+def _write_overview():
+    """Refresh the static docs/overview.json (GitHub Pages) after a manifest/roster write.
+    Best effort: derived data for the whole roster must never make the write that triggered it fail."""
+    fp = DOCS_DIR / "overview.json"
+    with _locked(fp):
+        try:
+            body = _dump_json(_overview())
+        except Exception:
+            app.logger.exception("overview refresh failed")
+            return
+        try:
+            if fp.read_bytes() == body: return
+        except OSError:
+            pass
+        _atomic_write(fp, body)
+
+# ---- full-text search (search_index.py, SQLite at SEARCH_DB; one connection per thread) ----
+_search_local = threading.local()
+
+def _search_conn() -> sqlite3.Connection:
+    conn = getattr(_search_local, "conn", None)
+    if conn is None or getattr(_search_local, "path", None) != SEARCH_DB:
+        conn = _search_local.conn = search_index.connect(SEARCH_DB)
+        _search_local.path = SEARCH_DB
+    return conn
+
+def _search_sync(student: str):
+    """Bring one student's documents up to date; a stat + one SELECT when the manifest is unchanged.
+    Search is best-effort: an index error is logged, never fails the save that triggered it."""
+    fp = _manifest_path(student)
+    try:
+        with metrics.phase("search"):
+            conn = _search_conn()
+            try: st = fp.stat()
+            except FileNotFoundError:
+                search_index.drop_student(conn, student); return
+            stamp = f"{st.st_mtime_ns:x}-{st.st_size:x}"
+            if not search_index.is_fresh(conn, student, stamp):
+                search_index.sync_student(conn, DOCS_DIR, student, _read_json_cached(fp).data, stamp)
+    except sqlite3.Error as e:
+        app.logger.warning("search index update failed for %s: %s", student, e)
+
+def _search_refresh(relpath: str):
+    try:
+        with metrics.phase("search"): search_index.refresh_path(_search_conn(), DOCS_DIR, relpath)
+    except sqlite3.Error as e:
+        app.logger.warning("search index refresh failed for %s: %s", relpath, e)
+@app.get("/api/search")
+def api_search():
+    q = (request.args.get("q") or "").strip()
+    student = request.args.get("student") or None
+    try: limit = max(1, min(100, int(request.args.get("limit", 20))))
+    except ValueError: limit = 20
+    if student:
+        students = [student]
+    else:
+        roster_fp = DOCS_DIR / "roster.json"
+        roster = _read_json_cached(roster_fp).data if roster_fp.exists() else _default_roster()
+        students = [s["id"] for s in roster.get("students") or [] if s.get("id")]
+    for sid in students:
+        _search_sync(sid)  # catches edits made by build.py or by hand since the last query
+    results = search_index.search(_search_conn(), q, student=student, limit=limit) if q else []
+    return jsonify({"q": q, "student": student, "results": results})
+
+@app.get("/api/overview")
+def api_overview():
+    return _json_ok(_overview())
+
+# ---- live change feed: /api/events?student=<id> (Server-Sent Events) ----
+# Saves/patches/deletes publish right away; a poller (only for students someone is watching) catches
+# edits made by build.py, by hand or by another worker process. Events carry the new revision (the ETag)
+# plus the touched days and their new items, so clients patch in place instead of re-downloading.
+EVENTS_KEEP = 256              # replay buffer for reconnects (Last-Event-ID)
+EVENTS_POLL_SECONDS = 1.0
+EVENTS_HEARTBEAT_SECONDS = 15.0
+EVENTS_STREAM_SECONDS = 300.0  # a stream then ends and EventSource reconnects: never pins a waitress thread forever
+EVENTS_MAX_CHANGES = 200       # more than this: send {"full": true}, clients refetch
+EVENT_STREAMS_MAX = 16         # per process; serve() lowers it to half the thread pool
+
+class _Event(NamedTuple):
+    seq: int
+    student: str
+    name: str
+    data: str
+
+_events: deque[_Event] = deque(maxlen=EVENTS_KEEP)
+_events_cond = threading.Condition()
+_events_state = {"seq": 0, "streams": 0, "boot": None, "pid": None, "poller": None}
+_watchers: dict[str, int] = {}                       # student -> open streams
+_watch: dict[str, tuple[tuple | None, dict]] = {}    # student -> (manifest (mtime_ns, size), manifest) last announced
+
+def _events_boot() -> str:
+    """Event ids are '<boot>-<seq>'; boot differs per process (and after fork), so a replayed id from another worker resets."""
+    if _events_state["pid"] != os.getpid():
+        _events_state.update(pid=os.getpid(), boot=os.urandom(4).hex(), seq=0, poller=None)
+        _events.clear(); _watch.clear(); _watchers.clear()
+    return _events_state["boot"]
+
+def _stat_key(fp: Path) -> tuple | None:
+    try:
+        st = fp.stat()
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+def _publish(student: str, name: str, data: dict):
+    with _events_cond:
+        _events_boot()
+        _events_state["seq"] += 1
+        _events.append(_Event(_events_state["seq"], student, name, json.dumps(data, ensure_ascii=False)))
+        _events_cond.notify_all()
+
+def _publish_manifest(student: str, old: dict, new: dict, etag: str | None, key: tuple | None):
+    """old/new are v3 manifests; etag None means the manifest was deleted."""
+    with _events_cond:
+        if student not in _watch: return  # nobody has watched this student in this process
+        _watch[student] = (key, new)
+    data = {"student": student, "rev": f'"{etag}"' if etag else None}
+    changes = manifest_store.changed_entries(old, new)
+    head = lambda m: {k: v for k, v in (m or {}).items() if k not in ("days", "holidays", "version")}
+    if etag is None or len(changes) > EVENTS_MAX_CHANGES or head(old) != head(new):
+        _publish(student, "manifest", {**data, "full": True}); return
+    holidays = set((old or {}).get("holidays") or []) ^ set(new.get("holidays") or [])
+    if not changes and not holidays:
+        return
+    days = new.get("days") or {}
+    data["changes"] = [{"date": d, "course": c, "type": t, "items": (days.get(d) or {}).get(c, {}).get(t)} for d, c, t in changes]
+    if holidays: data["holidays"] = new.get("holidays") or []
+    index = _calendar_index(student)
+    data["months"] = {ym: manifest_store.index_month(index, ym)["months"][ym]
+                      for ym in sorted({d[:7] for d, _, _ in changes} | {d[:7] for d in holidays})}
+    _publish(student, "manifest", data)
+
+def _publish_file(relpath: str, *, deleted: bool):
+    parts = relpath.split("/")
+    if len(parts) > 2 and parts[0] == "materials":
+        _publish(parts[1], "file", {"student": parts[1], "path": relpath, "deleted": deleted})
+
+def _poll_manifests():
+    while True:
+        time.sleep(EVENTS_POLL_SECONDS)
+        with _events_cond:
+            students = [s for s, n in _watchers.items() if n]
+        for student in students:
+            try: _check_manifest(student)
+            except Exception as e:  # never let one bad manifest stop the poller
+                app.logger.warning("event poll failed for %s: %s", student, e)
+
+def _check_manifest(student: str):
+    fp = _manifest_path(student)
+    key = _stat_key(fp)
+    with _events_cond:
+        known = _watch.get(student)
+    if known is not None and known[0] == key:
+        return
+    entry = _read_json_cached(fp) if key else None
+    if known is None:
+        with _events_cond: _watch[student] = (key, entry.data if entry else {})
+    else:
+        _publish_manifest(student, known[1], entry.data if entry else {}, entry.etag if entry else None, key)
+
+def _sse(name: str, data: str, event_id: str | None = None) -> str:
+    return (f"id: {event_id}\n" if event_id else "") + f"event: {name}\ndata: {data}\n\n"
+
+def _event_stream(student: str, last_id: str | None):
+    with _events_cond:
+        boot = _events_boot()
+        _watchers[student] = _watchers.get(student, 0) + 1
+        _events_state["streams"] += 1
+        if _events_state["poller"] is None:
+            _events_state["poller"] = threading.Thread(target=_poll_manifests, name="events-poller", daemon=True)
+            _events_state["poller"].start()
+        seq = _events_state["seq"]
+        oldest = _events[0].seq if _events else seq + 1
+    try:
+        _check_manifest(student)  # start watching from the current revision
+        # resumed: everything after Last-Event-ID is still buffered and gets replayed; otherwise the client
+        # compares hello.rev with what it has and refetches if they differ
+        last_boot, _, last_seq = (last_id or "").partition("-")
+        resumed = last_boot == boot and last_seq.isdigit() and oldest - 1 <= int(last_seq) <= seq
+        cursor = int(last_seq) if resumed else seq
+        fp = _manifest_path(student)
+        entry = _read_json_cached(fp) if fp.exists() else None
+        hello = {"student": student, "rev": f'"{entry.etag}"' if entry else None, "resumed": resumed}
+        yield "retry: 3000\n" + _sse("hello", json.dumps(hello), f"{boot}-{cursor}")
+        deadline = time.monotonic() + EVENTS_STREAM_SECONDS
+        while (left := deadline - time.monotonic()) > 0:
+            with _events_cond:
+                if not _events or _events[-1].seq <= cursor:
+                    _events_cond.wait(timeout=min(EVENTS_HEARTBEAT_SECONDS, left))
+                pending = [e for e in _events if e.seq > cursor]
+            if not pending:
+                yield ": ping\n\n"
+                continue
+            cursor = pending[-1].seq
+            out = "".join(_sse(e.name, e.data, f"{boot}-{e.seq}") for e in pending if e.student == student)
+            if out: yield out
+    finally:
+        with _events_cond:
+            _watchers[student] -= 1
+            _events_state["streams"] -= 1
+
+@app.get("/api/events")
+def api_events():
+    student = (request.args.get("student") or "").strip()
+    if not student:
+        return jsonify({"status":"error","message":"missing student"}), 400
+    _manifest_path(student)  # validates the id
+    if _events_state["streams"] >= EVENT_STREAMS_MAX:
+        resp = jsonify({"status":"error","message":"too many event streams"})
+        resp.status_code, resp.headers["Retry-After"] = 503, "30"
+        return resp
+    resp = Response(_event_stream(student, request.headers.get("Last-Event-ID")), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"  # no proxy buffering
+    return resp
+
 @app.get("/")
 def _root(): return send_from_directory(DOCS_DIR, "teacher.html")
 
 @app.get("/<path:filename>")
 def _static(filename: str):
     full = safe_join(str(DOCS_DIR), filename)
-    if not full or not Path(full).exists(): abort(404)
-    return send_from_directory(DOCS_DIR, filename)
+    if not full: abort(404)
+    fp = Path(full)
+    rendered = _rendered_lesson(fp)
+    if rendered is not None:
+        return _lesson_response(rendered)
+    if not fp.exists(): abort(404)
+    etag = _file_etag(fp.stat())
+    if fp.is_file():
+        pre = _precompressed(fp, _guess_mime(fp), etag)
+        if pre is not None:
+            return pre
+    # same mtime/size ETag as api_data; send_file answers If-None-Match with 304
+    resp = send_from_directory(DOCS_DIR, filename, etag=etag)
+    resp.vary.add("Accept-Encoding")
+    return resp
+
+# ---- request metrics (metrics.py) + opt-in slow-request profiling ----
+SLOW_REQUEST_MS: float | None = None        # --slow-ms: profile requests and log those at/over this many ms
+SLOW_LOG_DIR = BASE_DIR / ".slow_requests"  # --slow-log-dir: slow.log + one .prof (pstats) per slow request
+SLOW_PROFILE_LINES = 25
+_profiler_busy = threading.Lock()  # one cProfile at a time (3.12+ refuses a second active profiler)
+
+@app.before_request
+def _metrics_begin():
+    metrics.begin_request()
+    g.t0 = time.perf_counter()
+    if SLOW_REQUEST_MS is not None and _profiler_busy.acquire(blocking=False):
+        import cProfile
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+            g.profile = prof
+        except ValueError:  # another profiler (debugger…) is active
+            _profiler_busy.release()
+
+def _stop_profile():
+    prof = g.pop("profile", None)
+    if prof is not None:
+        prof.disable()
+        _profiler_busy.release()
+    return prof
+
+@app.after_request
+def _metrics_end(resp: Response):
+    prof = _stop_profile()
+    took = time.perf_counter() - g.get("t0", time.perf_counter())
+    endpoint = request.endpoint or "unmatched"
+    phases = metrics.request_phases()
+    metrics.observe_request(endpoint, request.method, resp.status_code, took,
+                            request.content_length or 0, resp.content_length or 0)
+    resp.headers["Server-Timing"] = ", ".join(
+        [f"{k};dur={v * 1000:.2f}" for k, v in sorted(phases.items())] + [f"total;dur={took * 1000:.2f}"])
+    if SLOW_REQUEST_MS is not None and took * 1000 >= SLOW_REQUEST_MS:
+        try: _log_slow(endpoint, took, phases, prof)
+        except OSError as e: app.logger.warning("slow request log failed: %s", e)
+    return resp
+
+@app.teardown_request
+def _metrics_teardown(exc):
+    _stop_profile()  # after_request is skipped when a response could not be built
+
+def _log_slow(endpoint: str, took: float, phases: dict, prof):
+    import io, pstats
+    SLOW_LOG_DIR.mkdir(parents=True, exist_ok=True)
+    stamp = dt.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    lines = [f"{stamp} {request.method} {request.full_path.rstrip('?')} [{endpoint}] {took * 1000:.1f} ms",
+             "  phases: " + (", ".join(f"{k}={v * 1000:.1f}ms" for k, v in sorted(phases.items(), key=lambda kv: -kv[1])) or "-")]
+    if prof is not None:
+        prof_path = SLOW_LOG_DIR / f"{stamp}-{endpoint}.prof"
+        prof.dump_stats(prof_path)
+        buf = io.StringIO()
+        pstats.Stats(prof, stream=buf).sort_stats("cumulative").print_stats(SLOW_PROFILE_LINES)
+        lines += [f"  profile: {prof_path.name}", buf.getvalue().rstrip()]
+    with open(SLOW_LOG_DIR / "slow.log", "a", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n\n")
+    app.logger.warning("slow request: %s", lines[0])
+
+@app.get("/api/metrics")
+def api_metrics():
+    """Prometheus text format; counters are per worker process."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE, headers={"Cache-Control": "no-store"})
+
+# ---- production serving (waitress: pure-Python WSGI, debug off) ----
+def serve(host: str = "127.0.0.1", port: int = 5000, *, workers: int = 1, threads: int = 8):
+    """Bind once, then run `workers` processes (fork, POSIX only) sharing the listening socket,
+    each with a waitress thread pool. SIGTERM/SIGINT finish in-flight requests before exiting."""
+    try:
+        from waitress import create_server
+    except ImportError:
+        raise SystemExit("--serve needs waitress: pip install waitress")
+    import signal, socket, sys
+
+    if workers > 1 and not hasattr(os, "fork"):
+        print("[serve] fork unavailable on this platform; running a single worker")
+        workers = 1
+
+    sock = socket.create_server((host, port), backlog=1024)
+    global EVENT_STREAMS_MAX
+    EVENT_STREAMS_MAX = max(1, threads // 2)  # each /api/events stream holds a waitress thread
+
+    def run_worker():
+        def _stop(signum, frame):
+            raise SystemExit(0)  # waitress.run() catches this and drains its task queue
+        signal.signal(signal.SIGTERM, _stop)
+        server = create_server(app, sockets=[sock], threads=threads, ident="en_class")
+        server.run()
+
+    print(f"Serving at http://{host}:{port} (workers={workers}, threads={threads}, debug off)")
+    if workers == 1:
+        run_worker()
+        return
+
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker()
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    def _shutdown(signum, frame):
+        for pid in children:
+            try: os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError: pass
+    signal.signal(signal.SIGTERM, _shutdown)
+    signal.signal(signal.SIGINT, _shutdown)
+    for pid in children:
+        while True:
+            try:
+                os.waitpid(pid, 0)
+                break
+            except InterruptedError:
+                continue
+            except ChildProcessError:
+                break
+    sock.close()
+    sys.exit(0)
+
+def main(argv=None):
+    import argparse
+    global SLOW_REQUEST_MS, SLOW_LOG_DIR
+    ap = argparse.ArgumentParser(description="en_class local server")
+    ap.add_argument("--serve", action="store_true", help="production mode: waitress, debug/reloader off")
+    ap.add_argument("--host", default="127.0.0.1", help="bind address (default 127.0.0.1)")
+    ap.add_argument("--port", type=int, default=5000)
+    ap.add_argument("--workers", type=int, default=1, help="worker processes for --serve (POSIX)")
+    ap.add_argument("--threads", type=int, default=8, help="threads per worker for --serve")
+    ap.add_argument("--slow-ms", type=float, help="profile requests (cProfile) and log those taking at least this many ms")
+    ap.add_argument("--slow-log-dir", default=str(SLOW_LOG_DIR), help="where slow.log and .prof files go (default .slow_requests/)")
+    args = ap.parse_args(argv)
+
+    SLOW_REQUEST_MS, SLOW_LOG_DIR = args.slow_ms, Path(args.slow_log_dir)
+
+    if args.serve:
+        serve(args.host, args.port, workers=max(1, args.workers), threads=max(1, args.threads))
+    else:
+        print(f"Serving at http://{args.host}:{args.port}")
+        app.run(host=args.host, port=args.port, debug=True)
 
 if __name__ == "__main__":
-    print("Serving at http://127.0.0.1:5000")
-    app.run(host="127.0.0.1", port=5000, debug=True)
+    main()
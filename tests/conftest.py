@@ -0,0 +1,61 @@
+# tests/conftest.py
+"""
+共用 fixture：server.py / build.py 的 DOCS 等路徑指向 tmp_path（與 bench/bench.py 同做法），不碰版控裡的 docs/
+"""
+from __future__ import annotations
+import json, sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import manifest_store, search_index  # noqa: E402
+
+STUDENT = "t1"
+
+def seed_docs(root: Path) -> Path:
+    """最小資料集：roster、一位學生（v4 manifest）、一份教材檔。"""
+    docs = root / "docs"
+    (docs / "students" / STUDENT).mkdir(parents=True)
+    (docs / "materials" / STUDENT / "english").mkdir(parents=True)
+    (docs / "roster.json").write_text(json.dumps({"students": [{"id": STUDENT, "name": "Test"}]}), encoding="utf-8")
+    manifest = {
+        "version": 3, "student": STUDENT,
+        "courses": {"english": {"label": "英文", "color": "#1d4ed8"}},
+        "types": {"material": "教材", "homework": "作業", "note": "提醒"},
+        "days": {"2025-09-01": {"english": {"material": [
+            {"title": "Lesson 1", "path": f"materials/{STUDENT}/english/2025-09-01_lesson.html"}]}}},
+        "holidays": [],
+    }
+    (docs / "students" / STUDENT / "manifest.json").write_text(manifest_store.dumps(manifest), encoding="utf-8")
+    (docs / "materials" / STUDENT / "english" / "notes.txt").write_text("original", encoding="utf-8")
+    return docs
+
+@pytest.fixture
+def server_docs(tmp_path, monkeypatch):
+    import server
+    docs = seed_docs(tmp_path)
+    monkeypatch.setattr(server, "BASE_DIR", tmp_path)
+    monkeypatch.setattr(server, "DOCS_DIR", docs)
+    monkeypatch.setattr(server, "SEARCH_DB", tmp_path / search_index.DB_NAME)
+    server._json_cache.clear(); server._index_cache.clear(); server._render_cache.clear()
+    yield docs
+    server._json_cache.clear(); server._index_cache.clear(); server._render_cache.clear()
+
+@pytest.fixture
+def client(server_docs):
+    import server
+    return server.app.test_client()
+
+@pytest.fixture
+def build_docs(tmp_path, monkeypatch):
+    import build
+    docs = seed_docs(tmp_path)
+    monkeypatch.setattr(build, "ROOT", tmp_path)
+    monkeypatch.setattr(build, "DOCS", docs)
+    monkeypatch.setattr(build, "BACKUPS", tmp_path / ".backups")
+    monkeypatch.setattr(build, "BLOBS", docs / ".blobs")
+    monkeypatch.setattr(build, "SEARCH_DB", tmp_path / search_index.DB_NAME)
+    return docs
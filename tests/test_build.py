@@ -0,0 +1,49 @@
+import pytest
+
+import build
+import manifest_store
+
+from conftest import STUDENT
+
+def _manifest(docs):
+    return manifest_store.load(docs / "students" / STUDENT / "manifest.json")
+
+def _tree(docs):
+    return sorted(p.relative_to(docs).as_posix() for p in docs.rglob("*") if p.is_file())
+
+def _sources(tmp_path, *names):
+    src = tmp_path / "incoming"
+    src.mkdir()
+    for name in names: (src / name).write_bytes(f"%PDF {name}".encode())
+    return src
+
+def test_batch_add_writes_files_and_manifest(build_docs, tmp_path):
+    src = _sources(tmp_path, "251001.pdf", "251001_hw.pdf", "251008.pdf")
+    build.batch_add_cmd(student=STUDENT, course="math", from_dir=str(src))
+    folder = build_docs / "materials" / STUDENT / "math"
+    assert sorted(p.name for p in folder.iterdir()) == ["251001.pdf", "251001_hw.pdf", "251008.pdf"]
+    assert (folder / "251001_hw.pdf").read_bytes() == b"%PDF 251001_hw.pdf"
+    days = _manifest(build_docs)["days"]
+    assert days["2025-10-01"]["math"]["homework"]["url"] == f"materials/{STUDENT}/math/251001_hw.pdf"
+    assert days["2025-10-08"]["math"]["material"]["format"] == "pdf"
+    assert not list(folder.glob(".*.tmp"))
+
+@pytest.mark.parametrize("names", [
+    ("251001.pdf", "251001_v2.pdf"),    # 同一天同類型
+    ("251001.pdf", "251001.png"),       # 同一格、不同格式
+    ("251001_hw.pdf", "251001_HW.pdf"),
+])
+def test_batch_add_rejects_colliding_slots_without_writing(build_docs, tmp_path, names):
+    src = _sources(tmp_path, *names, "251008.pdf")
+    before = _tree(build_docs)
+    with pytest.raises(SystemExit, match="重複"):
+        build.batch_add_cmd(student=STUDENT, course="math", from_dir=str(src))
+    assert _tree(build_docs) == before
+
+def test_copy_files_atomic_rejects_duplicate_destinations(build_docs, tmp_path):
+    src = _sources(tmp_path, "a.pdf", "b.pdf")
+    dst = build_docs / "materials" / STUDENT / "english" / "251001.pdf"
+    before = _tree(build_docs)
+    with pytest.raises(SystemExit, match="目的檔"):
+        build.copy_files_atomic([(src / "a.pdf", dst), (src / "b.pdf", dst)])
+    assert _tree(build_docs) == before
@@ -0,0 +1,87 @@
+from manifest_store import MANIFEST_VERSION, calendar_index, compact, dumps, expand, loads
+
+def _v3():
+    return {
+        "version": 3, "student": "s1",
+        "courses": {"english": {"label": "英文"}, "math": {"label": "數學"}},
+        "days": {
+            "2025-09-01": {"english": {
+                "material": [{"title": "a", "path": "materials/s1/english/2025-09-01_a.html"}],
+                "homework": [{"title": "b", "path": "materials/s1/english/sub/b.pdf"}],  # 子資料夾：保留完整路徑
+            }},
+            "2025-09-02": {"math": {
+                "note": [{"title": "c", "path": "materials/s2/math/c.html"}],  # 別人的資料夾：保留完整路徑
+                "material": [{"title": "d", "path": "materials/s1/english/d.html"}],  # 別的課程：保留完整路徑
+            }},
+        },
+        "holidays": ["2025-09-10"],
+    }
+
+def test_compact_shortens_only_paths_in_own_course_folder():
+    v4 = compact(_v3())
+    assert v4["version"] == MANIFEST_VERSION
+    eng = v4["days"]["2025-09-01"]["english"]
+    assert eng["material"][0]["path"] == "2025-09-01_a.html"
+    assert eng["homework"][0]["path"] == "materials/s1/english/sub/b.pdf"
+    math = v4["days"]["2025-09-02"]["math"]
+    assert math["note"][0]["path"] == "materials/s2/math/c.html"
+    assert math["material"][0]["path"] == "materials/s1/english/d.html"
+
+def test_compact_expand_round_trip():
+    v3 = _v3()
+    assert expand(compact(v3)) == v3
+    assert loads(dumps(v3)) == v3
+    assert "\n" not in dumps(v3)
+    assert loads(dumps(v3, pretty=True)) == v3
+
+def test_compact_is_idempotent_and_expand_ignores_other_versions():
+    v4 = compact(_v3())
+    assert compact(v4) is v4
+    assert expand(_v3()) == _v3()
+
+def _item(path="x.html"):
+    return [{"title": "x", "path": path}]
+
+def test_calendar_index_bitmaps_and_counts():
+    manifest = {
+        "student": "s1",
+        "days": {
+            "2025-09-01": {"english": {"material": _item()}},
+            "2025-09-03": {"english": {"note": _item(), "homework": _item()}},
+            "2025-09-05": {"english": {"material": []}},  # 空陣列不算
+            "2025-10-31": {"math": {"material": _item(), "note": _item()}},
+        },
+        "holidays": ["2025-09-10"],
+    }
+    idx = calendar_index(manifest)
+    sep, oct_ = idx["months"]["2025-09"], idx["months"]["2025-10"]
+    assert sep["content"] == 1 << 0 | 1 << 2  # 作業也算教材日
+    assert sep["note"] == 1 << 2
+    assert sep["homework"] == 1 << 2
+    assert sep["holiday"] == 1 << 9
+    assert sep["types"] == {"material": 1, "note": 1, "homework": 1}
+    assert oct_["content"] == oct_["note"] == 1 << 30
+    assert (idx["first"], idx["last"], idx["days"]) == ("2025-09-01", "2025-10-31", 3)
+    assert idx["types"] == {"material": 2, "note": 2, "homework": 1}
+
+def test_calendar_index_skips_invalid_dates():
+    manifest = {
+        "student": "s1",
+        "days": {d: {"english": {"material": _item()}} for d in ("2025-09-00", "2025-02-30", "2025-W01-1", "20250901", "2025-09-1")},
+        "holidays": ["2025-13-01", "2025-02-29"],
+    }
+    idx = calendar_index(manifest)
+    assert idx["months"] == {}
+    assert (idx["first"], idx["last"], idx["days"]) == (None, None, 0)
+
+def test_calendar_index_keeps_unloaded_months_from_base():
+    full = {"student": "s1", "days": {
+        "2025-08-04": {"english": {"material": _item()}},
+        "2025-09-01": {"english": {"material": _item()}},
+    }}
+    base = calendar_index(full)
+    partial = {"student": "s1", "days": {"2025-09-02": {"english": {"note": _item()}}}}  # 只載入 9 月、9/1 已刪
+    idx = calendar_index(partial, base=base, loaded={"2025-09"})
+    assert idx["months"]["2025-08"]["content"] == base["months"]["2025-08"]["content"]
+    assert idx["months"]["2025-09"]["content"] == 0
+    assert idx["months"]["2025-09"]["note"] == 1 << 1
@@ -0,0 +1,103 @@
+import copy
+
+import pytest
+
+import manifest_store
+import server
+from server import PatchError, PatchTestFailed, apply_patch
+
+from conftest import STUDENT
+
+DOC = {"days": {"2025-09-01": {"english": {"material": [{"title": "a", "path": "a.html"}]}}},
+       "holidays": ["2025-09-10"], "types": {"material": "教材"}, "courses": {}}
+
+def test_patch_add_replace_remove():
+    doc = copy.deepcopy(DOC)
+    out = apply_patch(doc, [
+        {"op": "add", "path": "/holidays/-", "value": "2025-09-11"},
+        {"op": "add", "path": "/days/2025-09-02", "value": {}},
+        {"op": "replace", "path": "/days/2025-09-01/english/material/0/title", "value": "b"},
+        {"op": "remove", "path": "/types/material"},
+    ])
+    assert out["holidays"] == ["2025-09-10", "2025-09-11"]
+    assert out["days"]["2025-09-02"] == {}
+    assert out["days"]["2025-09-01"]["english"]["material"][0]["title"] == "b"
+    assert out["types"] == {}
+    assert doc == DOC  # 只複製改到的節點，原文件不變
+
+def test_patch_move_copy_and_test():
+    out = apply_patch(copy.deepcopy(DOC), [
+        {"op": "test", "path": "/holidays/0", "value": "2025-09-10"},
+        {"op": "copy", "from": "/days/2025-09-01", "path": "/days/2025-09-08"},
+        {"op": "move", "from": "/days/2025-09-01", "path": "/days/2025-09-15"},
+    ])
+    assert set(out["days"]) == {"2025-09-08", "2025-09-15"}
+    assert out["days"]["2025-09-08"] == out["days"]["2025-09-15"] == DOC["days"]["2025-09-01"]
+    assert out["days"]["2025-09-08"] is not out["days"]["2025-09-15"]
+
+@pytest.mark.parametrize("ops, exc", [
+    ([{"op": "test", "path": "/holidays/0", "value": "2000-01-01"}], PatchTestFailed),
+    ([{"op": "remove", "path": "/days"}], PatchError),                   # 不能刪整個根
+    ([{"op": "add", "path": "/student", "value": "x"}], PatchError),     # 只能改 PATCH_ROOTS
+    ([{"op": "remove", "path": "/days/1999-01-01"}], PatchError),
+    ([{"op": "add", "path": "/holidays/5", "value": "x"}], PatchError),
+    ([{"op": "replace", "path": "/holidays/0"}], PatchError),            # 缺 value
+    ([{"op": "frobnicate", "path": "/days"}], PatchError),
+    ({"op": "add"}, PatchError),
+])
+def test_patch_rejects_bad_ops(ops, exc):
+    doc = copy.deepcopy(DOC)
+    with pytest.raises(exc):
+        apply_patch(doc, ops)
+    assert doc == DOC
+
+def _manifest_text(docs):
+    return (docs / "students" / STUDENT / "manifest.json").read_text(encoding="utf-8")
+
+def _batch(new_title):
+    return {"ops": [
+        {"op": "save", "path": f"materials/{STUDENT}/english/notes.txt", "content": "changed"},
+        {"op": "save", "path": f"materials/{STUDENT}/english/new.txt", "content": "new"},
+        {"op": "patch", "student": STUDENT, "ops": [
+            {"op": "replace", "path": "/days/2025-09-01/english/material/0/title", "value": new_title}]},
+    ]}
+
+def test_batch_applies_every_op(client, server_docs):
+    resp = client.post("/api/batch", json=_batch("renamed"))
+    assert resp.status_code == 200, resp.get_json()
+    assert [r["status"] for r in resp.get_json()["results"]] == ["success"] * 3
+    folder = server_docs / "materials" / STUDENT / "english"
+    assert (folder / "notes.txt").read_text(encoding="utf-8") == "changed"
+    assert (folder / "new.txt").read_text(encoding="utf-8") == "new"
+    assert manifest_store.loads(_manifest_text(server_docs))["days"]["2025-09-01"]["english"]["material"][0]["title"] == "renamed"
+
+def test_batch_rolls_back_when_a_write_fails(client, server_docs, monkeypatch):
+    folder = server_docs / "materials" / STUDENT / "english"
+    before = _manifest_text(server_docs)
+    def boom(*a, **kw): raise OSError("disk full")
+    monkeypatch.setattr(server, "_save_json", boom)  # 兩個教材檔都已寫入後，manifest 寫入失敗
+    resp = client.post("/api/batch", json=_batch("renamed"))
+    assert resp.status_code == 500
+    assert resp.get_json()["index"] == 2
+    assert (folder / "notes.txt").read_text(encoding="utf-8") == "original"
+    assert not (folder / "new.txt").exists()
+    assert _manifest_text(server_docs) == before
+
+def test_batch_rejects_stale_if_match_without_writing(client, server_docs):
+    folder = server_docs / "materials" / STUDENT / "english"
+    body = _batch("renamed")
+    body["ops"][2]["if_match"] = '"stale"'
+    resp = client.post("/api/batch", json=body)
+    assert resp.status_code == 409
+    assert resp.get_json()["index"] == 2
+    assert (folder / "notes.txt").read_text(encoding="utf-8") == "original"
+    assert not (folder / "new.txt").exists()
+
+def test_batch_removes_directories_it_created_on_rejection(client, server_docs):
+    body = {"ops": [
+        {"op": "save", "path": f"materials/{STUDENT}/grammar/a.txt", "content": "x"},
+        {"op": "patch", "student": STUDENT, "ops": [{"op": "remove", "path": "/days/1999-01-01"}]},
+    ]}
+    resp = client.post("/api/batch", json=body)
+    assert resp.status_code >= 400
+    assert not (server_docs / "materials" / STUDENT / "grammar").exists()